@@ -0,0 +1,264 @@
+"""
+Pipeline funnel analytics over columnar deals (see columnar.py), using the cached stages for their
+order, names and win likelihoods. Needs NumPy (`pip install django-basecrm[analytics]`).
+
+A Funnel is loaded once from a full set of deal columns, with every aggregate computed in
+whole-array passes, and can then be kept fresh incrementally: each changed deal has its old
+contribution taken away and its new one added, so keeping up with the updated_at feed (or the Sync
+API, or webhooks) never needs a full recompute.
+"""
+import time
+
+from . import columnar, exceptions, helpers, utils
+
+numpy = columnar.numpy
+
+DEAL_FIELDS = [
+    'id',
+    'stage_id',
+    'value',
+    'customized_win_likelihood',
+    'last_stage_change_at',
+    'updated_at',
+]
+
+# upper bounds of the stage-age histogram buckets, in days
+AGE_BUCKETS = [7, 14, 30, 60, 90]
+DAY = 24 * 60 * 60
+
+
+class Funnel(object):
+
+    def __init__(self, stages=None, columns=None):
+        if numpy is None:
+            raise exceptions.BaseCRMConfigurationError("Funnel analytics require NumPy")
+        if stages is None:
+            stages = helpers.get_stages()
+        self.stages = sorted(stages, key=lambda s: s.get('position') or 0)
+        self.stage_ids = numpy.array([s['id'] for s in self.stages], dtype='q')
+        self.likelihoods = numpy.array(
+            [(s.get('likelihood') or 0) / 100.0 for s in self.stages], dtype='d'
+        )
+        self._stage_positions = {s['id']: i for i, s in enumerate(self.stages)}
+        self._stage_order = numpy.argsort(self.stage_ids)
+        if columns is not None:
+            self.load(columns)
+            return
+        # no deals until they're loaded or updated
+        n = len(self.stages)
+        self._stage = numpy.empty(0, dtype='q')
+        self._value = numpy.empty(0)
+        self._weighted = numpy.empty(0)
+        self._changed = numpy.empty(0)
+        self._rows = {}
+        self.updated_at = None
+        self.counts = numpy.zeros(n, dtype='q')
+        self.values = numpy.zeros(n)
+        self.forecast = numpy.zeros(n)
+
+    def load(self, columns):
+        """
+        Replaces everything with the deals in `columns`, which must include id, stage_id, value,
+        last_stage_change_at and updated_at (and may include customized_win_likelihood)
+        """
+        self._stage = self._stage_index(numpy.asarray(columns['stage_id']))
+        self._value = numpy.nan_to_num(numpy.array(columns['value'], dtype='d'))
+        custom = (
+            numpy.asarray(columns['customized_win_likelihood'])
+            if 'customized_win_likelihood' in columns
+            else numpy.full(len(self._stage), numpy.nan)
+        )
+        self._weighted = self._value * self._likelihood(self._stage, custom)
+        self._changed = numpy.array(columns['last_stage_change_at'], dtype='d')
+        self._rows = dict(zip(numpy.asarray(columns['id']).tolist(), range(len(self._stage))))
+        updated_at = numpy.asarray(columns['updated_at'])
+        self.updated_at = (
+            float(numpy.nanmax(updated_at))
+            if len(updated_at) and not numpy.isnan(updated_at).all()
+            else None
+        )
+
+        valid = self._stage >= 0
+        n = len(self.stages)
+        self.counts = numpy.bincount(self._stage[valid], minlength=n).astype('q')
+        self.values = numpy.bincount(self._stage[valid], self._value[valid], minlength=n)
+        self.forecast = numpy.bincount(self._stage[valid], self._weighted[valid], minlength=n)
+        return self
+
+    def update(self, deals):
+        """
+        Applies changed (or new) deal dicts, e.g. from the updated_at feed or the Sync API
+        """
+        new = []
+        for deal in deals:
+            stage = self._stage_positions.get(deal.get('stage_id'), -1)
+            value = _to_float(deal.get('value'))
+            value = 0.0 if numpy.isnan(value) else value
+            custom = _to_float(deal.get('customized_win_likelihood'))
+            if not numpy.isnan(custom):
+                weighted = value * custom / 100.0
+            elif stage >= 0:
+                weighted = value * self.likelihoods[stage]
+            else:
+                weighted = 0.0
+            changed = _to_timestamp(deal.get('last_stage_change_at'))
+            updated_at = _to_timestamp(deal.get('updated_at'))
+            if not numpy.isnan(updated_at) and (
+                self.updated_at is None or updated_at > self.updated_at
+            ):
+                self.updated_at = updated_at
+
+            row = self._rows.get(deal['id'])
+            if row is None:
+                self._rows[deal['id']] = len(self._stage) + len(new)
+                new.append((stage, value, weighted, changed))
+            else:
+                self._contribute(row, -1)
+                self._stage[row] = stage
+                self._value[row] = value
+                self._weighted[row] = weighted
+                self._changed[row] = changed
+                self._contribute(row, 1)
+
+        if new:
+            start = len(self._stage)
+            stage, value, weighted, changed = zip(*new)
+            self._stage = numpy.concatenate([self._stage, numpy.array(stage, dtype='q')])
+            self._value = numpy.concatenate([self._value, value])
+            self._weighted = numpy.concatenate([self._weighted, weighted])
+            self._changed = numpy.concatenate([self._changed, changed])
+            for row in range(start, len(self._stage)):
+                self._contribute(row, 1)
+        return self
+
+    def remove(self, ids):
+        for id in ids:
+            row = self._rows.pop(id, None)
+            if row is not None:
+                self._contribute(row, -1)
+                self._stage[row] = -1
+        return self
+
+    def refresh(self, **kwargs):
+        """
+        Pages through deals most recently updated first, applying those updated since the last
+        one seen (re-applying one that was is harmless) and stopping at the first older one.
+        Returns the number of deals applied
+        """
+        kwargs['sort_by'] = 'updated_at:desc'
+        changed = []
+        for page in utils.paginate('deals', kwargs):
+            for deal in page:
+                updated_at = _to_timestamp(deal.get('updated_at'))
+                if self.updated_at is not None and updated_at < self.updated_at:
+                    break
+                changed.append(deal)
+            else:
+                continue
+            break
+        self.update(changed)
+        return len(changed)
+
+    def sync_handler(self):
+        """
+        Returns a handler for sync.Sync.register('deal', ...) that keeps the funnel up to date
+        """
+        def handler(event_type, data, meta):
+            if event_type == 'deleted':
+                self.remove([data['id']])
+            else:
+                self.update([data])
+        return handler
+
+    def stage_ages(self, now=None):
+        """
+        How long deals have been in their current stage: for each stage (in pipeline order), the
+        count of deals in each AGE_BUCKETS bucket, and the mean and max age in days
+        """
+        now = time.time() if now is None else now
+        valid = (self._stage >= 0) & ~numpy.isnan(self._changed)
+        stage = self._stage[valid]
+        ages = (now - self._changed[valid]) / DAY
+        n, buckets = len(self.stages), len(AGE_BUCKETS) + 1
+
+        histogram = numpy.bincount(
+            stage * buckets + numpy.digitize(ages, AGE_BUCKETS), minlength=n * buckets
+        ).reshape(n, buckets)
+        counts = numpy.bincount(stage, minlength=n)
+        totals = numpy.bincount(stage, ages, minlength=n)
+        maxima = numpy.zeros(n)
+        numpy.maximum.at(maxima, stage, ages)
+
+        labels = _bucket_labels()
+        return [
+            {
+                'id': s['id'],
+                'name': s.get('name'),
+                'buckets': dict(zip(labels, histogram[i].tolist())),
+                'mean': float(totals[i] / counts[i]) if counts[i] else None,
+                'max': float(maxima[i]) if counts[i] else None,
+            }
+            for i, s in enumerate(self.stages)
+        ]
+
+    def report(self):
+        """
+        Per-stage deal counts, value sums and likelihood-weighted forecasts, in pipeline order
+        """
+        return [
+            {
+                'id': s['id'],
+                'name': s.get('name'),
+                'count': int(self.counts[i]),
+                'value': float(self.values[i]),
+                'forecast': float(self.forecast[i]),
+            }
+            for i, s in enumerate(self.stages)
+        ]
+
+    def _stage_index(self, stage_ids):
+        """
+        Maps an array of stage IDs to positions in self.stages; -1 for those not in the pipeline
+        """
+        if not len(self.stage_ids):
+            return numpy.full(len(stage_ids), -1, dtype='q')
+        ordered = self.stage_ids[self._stage_order]
+        found = numpy.clip(numpy.searchsorted(ordered, stage_ids), 0, len(ordered) - 1)
+        return numpy.where(ordered[found] == stage_ids, self._stage_order[found], -1).astype('q')
+
+    def _likelihood(self, stage, custom):
+        """
+        A deal's customized_win_likelihood if it has one, otherwise its stage's likelihood
+        """
+        if len(self.likelihoods):
+            stage_likelihood = numpy.where(
+                stage >= 0, self.likelihoods[numpy.clip(stage, 0, None)], 0.0
+            )
+        else:
+            stage_likelihood = numpy.zeros(len(stage))
+        return numpy.where(numpy.isnan(custom), stage_likelihood, custom / 100.0)
+
+    def _contribute(self, row, sign):
+        stage = self._stage[row]
+        if stage >= 0:
+            self.counts[stage] += sign
+            self.values[stage] += sign * self._value[row]
+            self.forecast[stage] += sign * self._weighted[row]
+
+
+def funnel(stages=None, **kwargs):
+    """
+    Loads every deal (kwargs are passed to the API as GET params) into a Funnel over the given
+    stages, or else the cached ones
+    """
+    # not deal_columns, as the stage and owner names aren't needed
+    return Funnel(stages, columnar.load('deals', columnar.DEAL_FIELDS, DEAL_FIELDS, **kwargs))
+
+
+def _bucket_labels():
+    bounds = [0] + AGE_BUCKETS
+    return ['%s-%s' % (a, b) for a, b in zip(bounds, bounds[1:])] + ['%s+' % AGE_BUCKETS[-1]]
+
+
+_to_float = columnar.converter(columnar.FLOAT)
+_to_timestamp = columnar.converter(columnar.DATETIME)
@@ -1,20 +1,38 @@
 from django.apps import AppConfig
 
-from . import settings, helpers
+from . import settings, client, helpers, metrics
+
+
+def _reference_data(name):
+    """
+    The pipeline, stages and users belong to the current client (see client.py), so each account
+    in BASECRM_ACCOUNTS keeps its own
+    """
+    return property(
+        lambda self: getattr(client.get_client(), name),
+        lambda self, value: setattr(client.get_client(), name, value),
+    )
 
 
 class BaseCRMConfig(AppConfig):
 
     name = 'basecrm'
     verbose_name = "Base (CRM)"
-    pipeline = None
-    stages = None
-    users = None
+    default_auto_field = 'django.db.models.AutoField'
+    pipeline = _reference_data('pipeline')
+    stages = _reference_data('stages')
+    users = _reference_data('users')
 
     def ready(self):
         super(BaseCRMConfig, self).ready()
+        if settings.BASECRM_METRICS:
+            metrics.collector.connect()
         if settings.BASECRM_CACHE_AT_STARTUP:
             self.instantiate_objects()
+            for alias in settings.BASECRM_ACCOUNTS:
+                if alias != client.DEFAULT_ACCOUNT:
+                    with client.account(alias):
+                        self.instantiate_objects()
 
     def instantiate_objects(self, force=False):
         """
@@ -0,0 +1,124 @@
+"""
+BaseCRM has no bulk endpoints, so writing many records means many requests. The BatchWriter runs
+them concurrently on a thread pool, taking operations from any iterable a chunk at a time so that
+memory stays bounded however many there are. A rate (in requests per second, across all the
+workers) keeps big batches within the account's API rate limit, and adaptive concurrency (see
+limits.AdaptiveLimiter) runs as many at once as the API is handling well. Writes are in the
+background lane by default (see lanes.py), so they leave room for interactive requests.
+"""
+import collections
+import itertools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from . import client, deadline, exceptions, helpers, lanes, settings, tracing, utils
+from .limits import AdaptiveLimiter, RateLimiter
+
+logger = logging.getLogger(__name__)
+
+RESOURCES = ['contact', 'deal', 'lead']
+
+# `key` identifies the operation in a checkpoint, so it isn't repeated when a job is resumed
+Operation = collections.namedtuple('Operation', ['action', 'id', 'data', 'context', 'key'])
+Operation.__new__.__defaults__ = (None, None, None)
+
+# `record` is the dict given back by the API, or None if the write failed with `error`
+Result = collections.namedtuple('Result', ['operation', 'record', 'error'])
+
+
+class BatchWriter(object):
+
+    def __init__(
+        self, resource, max_workers=None, chunk_size=None, checkpoint=None, rate=None,
+        adaptive=None, lane=lanes.BACKGROUND
+    ):
+        if resource not in RESOURCES:
+            raise exceptions.BaseCRMBadParameterFormat(
+                "Expecting one of %s but got %s" % (', '.join(RESOURCES), resource)
+            )
+        self.resource = resource
+        self.max_workers = max_workers or settings.BASECRM_BATCH_WORKERS
+        self.chunk_size = chunk_size or self.max_workers * 4
+        self.checkpoint = checkpoint
+        self.lane = lane
+        rate = rate or settings.BASECRM_BATCH_RATE
+        self.limiter = RateLimiter(rate) if rate else None
+        if adaptive is None:
+            adaptive = settings.BASECRM_ADAPTIVE_CONCURRENCY
+        # with adaptive concurrency, max_workers is the most that will be in flight
+        self.concurrency = None
+        if adaptive:
+            self.concurrency = AdaptiveLimiter('batch %s' % resource, maximum=self.max_workers)
+
+    def write(self, operations):
+        """
+        Generator that performs each Operation (utils.CREATE or utils.UPDATE) and yields a Result
+        for it, in the order given. Failures are caught and reported on the Result rather than
+        stopping the batch.
+
+        With a checkpoint, operations whose key already completed are skipped (and yield nothing),
+        and the outcome of every keyed operation is recorded a chunk at a time
+        """
+        operations = iter(operations)
+        # the workers write to whichever account is current here, under the same deadline and span
+        write_one = client.bind(deadline.bind(tracing.bind(self.write_one)))
+
+        def write_in_lane(operation):
+            with lanes.use(self.lane):
+                return write_one(operation)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while True:
+                chunk = list(itertools.islice(operations, self.chunk_size))
+                if not chunk:
+                    return
+                if self.checkpoint is not None:
+                    done = self.checkpoint.done(o.key for o in chunk if o.key is not None)
+                    chunk = [o for o in chunk if o.key is None or str(o.key) not in done]
+                results = list(executor.map(write_in_lane, chunk))
+                if self.checkpoint is not None:
+                    self.checkpoint.record(
+                        (r.operation.key, r.record and r.record.get('id'), r.error)
+                        for r in results
+                        if r.operation.key is not None
+                    )
+                for result in results:
+                    yield result
+
+    def write_one(self, operation):
+        try:
+            lanes.wait(self.limiter)
+            if operation.action == utils.CREATE:
+                write, args = getattr(helpers, 'create_%s' % self.resource), (operation.data,)
+            elif operation.action == utils.UPDATE:
+                write = getattr(helpers, 'update_%s' % self.resource)
+                args = (operation.id, operation.data)
+            else:
+                raise exceptions.BaseCRMBadParameterFormat(
+                    "Expecting one of CREATE or UPDATE but got %s" % operation.action
+                )
+            if self.concurrency is not None:
+                record = self.concurrency.run(write, *args)
+            else:
+                record = write(*args)
+        except Exception as e:
+            logger.warning(
+                "BaseCRM batch %s of %s %s failed: %s" % (
+                    utils.VERBS.get(operation.action), self.resource, operation.id, e
+                )
+            )
+            return Result(operation, None, e)
+        return Result(operation, record, None)
+
+
+def create(resource, dicts, **kwargs):
+    return BatchWriter(resource, **kwargs).write(Operation(utils.CREATE, None, d) for d in dicts)
+
+
+def update(resource, pairs, **kwargs):
+    """
+    Updates from an iterable of (id, dict) pairs
+    """
+    return BatchWriter(resource, **kwargs).write(
+        Operation(utils.UPDATE, id, d) for id, d in pairs
+    )
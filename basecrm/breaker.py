@@ -0,0 +1,181 @@
+"""
+A circuit breaker per endpoint, so that when BaseCRM is failing we stop waiting on it. Each
+breaker watches the outcome of the last `window` requests to its endpoint; once at least
+`minimum_requests` have been seen and `failure_rate` of them failed (a 5xx, or no response at all),
+it opens and requests fail straight away with BaseCRMCircuitOpen. After `reset_timeout` seconds
+it's half-open: `probes` requests are let through, and it closes again if they succeed or reopens
+if one fails.
+
+Each client (see client.py) has its own breakers. State changes are logged and sent as the
+signals.breaker_state_changed signal, and client.breakers.states() gives the current ones.
+"""
+import collections
+import logging
+import threading
+import time
+
+from . import exceptions, settings, signals
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitBreaker(object):
+
+    def __init__(
+        self, name, failure_rate=None, minimum_requests=None, window=None, reset_timeout=None,
+        probes=None
+    ):
+        self.name = name
+        self.failure_rate = failure_rate or settings.BASECRM_BREAKER_FAILURE_RATE
+        self.minimum_requests = minimum_requests or settings.BASECRM_BREAKER_MINIMUM_REQUESTS
+        self.reset_timeout = reset_timeout or settings.BASECRM_BREAKER_RESET_TIMEOUT
+        self.probes = probes or settings.BASECRM_BREAKER_PROBES
+        self.state = CLOSED
+        self.opened_at = None
+        self._outcomes = collections.deque(maxlen=window or settings.BASECRM_BREAKER_WINDOW)
+        self._failures = 0
+        self._probing = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<CircuitBreaker %s %s>' % (self.name, self.state)
+
+    @property
+    def current_failure_rate(self):
+        if not self._outcomes:
+            return 0.0
+        return self._failures / float(len(self._outcomes))
+
+    def before(self):
+        """
+        Raises BaseCRMCircuitOpen unless a request may be sent now; returns True if the request is
+        a half-open probe, which must then be recorded (or released, if it isn't sent after all)
+        """
+        changes = []
+        try:
+            with self._lock:
+                if self.state == OPEN:
+                    if time.monotonic() - self.opened_at < self.reset_timeout:
+                        raise self._open_error()
+                    self._change(HALF_OPEN, changes)
+                if self.state == HALF_OPEN:
+                    if self._probing >= self.probes:
+                        raise self._open_error()
+                    self._probing += 1
+                    return True
+                return False
+        finally:
+            self._notify(changes)
+
+    def record(self, failed, probe=False):
+        """
+        Records the outcome of a request that before() let through
+        """
+        changes = []
+        try:
+            with self._lock:
+                self._record(failed, probe, changes)
+        finally:
+            self._notify(changes)
+
+    def release(self, probe):
+        """
+        For a request that before() let through but that wasn't sent, e.g. because it timed out
+        waiting for the rate limit; it says nothing about the endpoint, so isn't recorded
+        """
+        if probe:
+            with self._lock:
+                self._probing -= 1
+
+    def _record(self, failed, probe, changes):
+        if probe:
+            self._probing -= 1
+            if self.state != HALF_OPEN:
+                return
+            if failed:
+                self._open(changes)
+            elif not self._probing:
+                self._outcomes.clear()
+                self._failures = 0
+                self._change(CLOSED, changes)
+            return
+        if self.state != CLOSED:
+            # sent before it opened
+            return
+        if len(self._outcomes) == self._outcomes.maxlen and self._outcomes[0]:
+            self._failures -= 1
+        self._outcomes.append(failed)
+        self._failures += failed
+        if (
+            len(self._outcomes) >= self.minimum_requests and
+            self.current_failure_rate >= self.failure_rate
+        ):
+            self._open(changes)
+
+    def _open(self, changes):
+        self.opened_at = time.monotonic()
+        self._probing = 0
+        self._change(OPEN, changes)
+
+    def _change(self, state, changes):
+        """
+        Changes state (with the lock held), adding the change to `changes` for _notify
+        """
+        changes.append((self.state, state, self.current_failure_rate, len(self._outcomes)))
+        self.state = state
+
+    def _notify(self, changes):
+        """
+        Logs and sends signals for state changes, once the lock has been released; receivers may
+        look at this breaker, or make requests through it
+        """
+        for previous, state, failure_rate, count in changes:
+            logger.warning(
+                "BaseCRM circuit breaker for '%s' went from %s to %s (%.0f%% of the last %s "
+                "requests failed)" % (self.name, previous, state, failure_rate * 100, count)
+            )
+            signals.breaker_state_changed.send(
+                sender=self.name,
+                endpoint=self.name,
+                previous=previous,
+                state=state,
+                failure_rate=failure_rate,
+            )
+
+    def _open_error(self):
+        return exceptions.BaseCRMCircuitOpen(
+            "BaseCRM '%s' endpoint is failing; not sending requests for up to %ss" % (
+                self.name, self.reset_timeout
+            )
+        )
+
+
+class Breakers(object):
+    """
+    A CircuitBreaker per endpoint, created as they're needed with the given thresholds
+    """
+
+    def __init__(self, **thresholds):
+        self.thresholds = thresholds
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, endpoint):
+        try:
+            return self._breakers[endpoint]
+        except KeyError:
+            pass
+        with self._lock:
+            if endpoint not in self._breakers:
+                self._breakers[endpoint] = CircuitBreaker(endpoint, **self.thresholds)
+            return self._breakers[endpoint]
+
+    def states(self):
+        """
+        A dict of each endpoint's breaker state
+        """
+        return {endpoint: b.state for endpoint, b in list(self._breakers.items())}
@@ -0,0 +1,124 @@
+"""
+An optional cache of RETRIEVE responses, switched on by setting BASECRM_RESPONSE_CACHE_TIMEOUT.
+Single-record responses are keyed on endpoint and ID so they can be invalidated individually; list
+responses are keyed on a per-endpoint generation number, so bumping it invalidates every cached
+list for that endpoint at once.
+
+Each client (see client.py) has its own ResponseCache; the module functions use the one that
+goes with the settings.
+"""
+import hashlib
+
+from django.core.cache import caches
+
+from . import settings
+
+KEY_PREFIX = 'basecrm'
+
+
+class ResponseCache(object):
+    """
+    Anything not given is taken from settings when it's needed; a different key prefix keeps the
+    responses of different accounts apart in the same Django cache
+    """
+
+    def __init__(self, alias=None, timeout=None, endpoints=None, prefix=KEY_PREFIX):
+        self._alias = alias
+        self._timeout = timeout
+        self._endpoints = endpoints
+        self.prefix = prefix
+
+    @property
+    def alias(self):
+        return self._alias or settings.BASECRM_RESPONSE_CACHE_ALIAS
+
+    @property
+    def timeout(self):
+        if self._timeout is None:
+            return settings.BASECRM_RESPONSE_CACHE_TIMEOUT
+        return self._timeout
+
+    @property
+    def endpoints(self):
+        if self._endpoints is None:
+            return settings.BASECRM_RESPONSE_CACHE_ENDPOINTS
+        return self._endpoints
+
+    def enabled(self):
+        return bool(self.timeout)
+
+    def make_key(self, endpoint, get_params=None):
+        """
+        Returns the cache key for the request, or None if it shouldn't be cached
+        """
+        if endpoint not in self.endpoints:
+            return None
+
+        params = dict(get_params or {})
+        id = params.pop('id', None)
+        if id is not None:
+            if params:
+                # filtered ID requests are rare enough that they're not worth tracking
+                return None
+            return self._record_key(endpoint, id)
+
+        digest = hashlib.md5(repr(sorted(params.items())).encode('utf-8')).hexdigest()
+        return '%s:%s:list:%s:%s' % (self.prefix, endpoint, self._generation(endpoint), digest)
+
+    def get(self, key):
+        return self._cache().get(key)
+
+    def set(self, key, value):
+        self._cache().set(key, value, self.timeout)
+
+    def invalidate(self, endpoint, ids=None):
+        """
+        Drops the cached records for the given IDs, and all cached lists for the endpoint
+        """
+        if endpoint not in self.endpoints:
+            return
+        cache = self._cache()
+        if ids:
+            cache.delete_many([self._record_key(endpoint, id) for id in ids])
+        key = self._generation_key(endpoint)
+        cache.add(key, 0, None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # evicted between the add and the incr
+            cache.set(key, 1, None)
+
+    def _cache(self):
+        return caches[self.alias]
+
+    def _record_key(self, endpoint, id):
+        return '%s:%s:%s' % (self.prefix, endpoint, id)
+
+    def _generation_key(self, endpoint):
+        return '%s:%s:generation' % (self.prefix, endpoint)
+
+    def _generation(self, endpoint):
+        return self._cache().get(self._generation_key(endpoint), 0)
+
+
+default = ResponseCache()
+
+
+def enabled():
+    return default.enabled()
+
+
+def make_key(endpoint, get_params=None):
+    return default.make_key(endpoint, get_params)
+
+
+def get(key):
+    return default.get(key)
+
+
+def set(key, value):
+    default.set(key, value)
+
+
+def invalidate(endpoint, ids=None):
+    default.invalidate(endpoint, ids)
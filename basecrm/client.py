@@ -0,0 +1,257 @@
+"""
+A BaseCRMClient holds everything that belongs to one Base account: its API key and URL (and the
+headers built from them, worked out once), a requests session with its own connection pool and
+default timeouts, an optional rate limit on every request (with a share of it, and of the pool,
+kept for interactive requests; see lanes.py), circuit breakers for its endpoints, optionally a
+hedger for single-record reads (see hedging.py), its response cache and its reference data (the
+pipeline, stages and users that apps.BaseCRMConfig loads).
+
+The module functions in utils and helpers use the current client, which is built from settings
+unless another is selected; e.g. to give a batch job its own pool and rate limit, without taking
+over the requests of other threads (such as a web process's):
+
+    with client.selected(client.BaseCRMClient(pool_size=20, rate=8)):
+        batch.create('contact', contacts, max_workers=16)
+
+client.use installs a client for every thread, which is for scripts and tests.
+
+Several accounts can be configured in BASECRM_ACCOUNTS, by alias, each getting a client of its own
+(so its own connections, rate limit, response cache and reference data). A thread picks one for
+the duration of a with block, which also covers the worker threads that paginate and batch writes
+start inside it:
+
+    with client.account('emea'):
+        deals = helpers.get_deals(stage_id=stage_id)
+"""
+import contextlib
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import breaker, cache, exceptions, hedging, lanes, settings, transport
+from .limits import RateLimiter
+
+DEFAULT_ACCOUNT = 'default'
+
+_client = None
+_default = None
+_accounts = {}
+_lock = threading.Lock()
+
+
+class _Selection(threading.local):
+    # a class default, as getattr with a default is slow when the attribute is missing
+    client = None
+
+
+_local = _Selection()
+
+
+class BaseCRMClient(object):
+
+    def __init__(
+        self, api_key=None, api_url=None, user_agent=None, pool_size=None, rate=None,
+        response_cache=None, session=None, alias=None, connect_timeout=None, read_timeout=None,
+        breakers=None, interactive_reserve=None, hedger=None
+    ):
+        self.alias = alias
+        self.api_key = api_key or settings.BASECRM_API_KEY
+        # as for settings.BASECRM_API_URL, the trailing slash is expected
+        self.api_url = api_url or settings.BASECRM_API_URL
+        self.user_agent = user_agent or settings.BASECRM_USER_AGENT
+        self.headers = {
+            'Accept': 'application/json',
+            'Content-Type': 'application/json',
+            'Authorization': 'Bearer %s' % self.api_key,
+            'User-Agent': self.user_agent
+        }
+        if session is None:
+            pool_size = pool_size or settings.BASECRM_POOL_SIZE
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+        self.transport = transport.RequestsTransport(session)
+        # as for requests: seconds to wait for a connection, and then between bytes of the response
+        self.timeout = (
+            connect_timeout or settings.BASECRM_CONNECT_TIMEOUT,
+            read_timeout or settings.BASECRM_READ_TIMEOUT,
+        )
+        rate = rate or settings.BASECRM_RATE
+        self.limiter = RateLimiter(rate) if rate else None
+        if interactive_reserve is None:
+            interactive_reserve = settings.BASECRM_INTERACTIVE_RESERVE
+        self.lanes = lanes.Lanes(
+            self.limiter, rate, pool_size or settings.BASECRM_POOL_SIZE, interactive_reserve
+        )
+        self.cache = response_cache or cache.ResponseCache()
+        if breakers is None and settings.BASECRM_BREAKER:
+            breakers = breaker.Breakers()
+        self.breakers = breakers
+        if hedger is None and settings.BASECRM_HEDGE:
+            hedger = hedging.Hedger(max_workers=2 * (pool_size or settings.BASECRM_POOL_SIZE))
+        self.hedger = hedger
+        self.pipeline = None
+        self.stages = None
+        self.users = None
+
+    def __repr__(self):
+        return '<BaseCRMClient %s>' % (self.alias or self.api_url)
+
+    def build_headers(self, extra_headers=None):
+        """
+        The client's headers, plus a dict that can add to or override them
+        """
+        if extra_headers is None:
+            return dict(self.headers)
+        if not isinstance(extra_headers, dict):
+            raise exceptions.BaseCRMBadParameterFormat(
+                u'Parameter format was not a dict as expected. The parameter given was: %s' %
+                repr(extra_headers)
+            )
+        headers = dict(self.headers)
+        headers.update(extra_headers)
+        return headers
+
+    def build_url(self, endpoint, get_params=None):
+        """
+        Pops any 'id' off get_params and onto the URL
+        """
+        url = self.api_url + endpoint
+        if get_params is not None:
+            if not isinstance(get_params, dict):
+                raise exceptions.BaseCRMBadParameterFormat(
+                    u'Parameter format was not a dict as expected. The parameter given was: %s' %
+                    repr(get_params)
+                )
+
+            id = get_params.pop('id', None)
+            if id is not None:
+                url = "%s/%s" % (url, id)
+        return url
+
+    def close(self):
+        self.transport.close()
+        if self.hedger is not None:
+            self.hedger.close()
+
+
+def get_client():
+    """
+    The current client: the account this thread has selected, if any, or else the one installed
+    with set_client or use, or else the default account's
+    """
+    # on every request, so kept to a single expression
+    return _local.client or _client or _default or get_account(DEFAULT_ACCOUNT)
+
+
+def get_account(alias):
+    """
+    The client for an account in BASECRM_ACCOUNTS, created the first time it's asked for. The
+    default account is configured by the top-level settings unless it's in BASECRM_ACCOUNTS too
+    """
+    global _default
+    if alias == DEFAULT_ACCOUNT:
+        if _default is None:
+            with _lock:
+                if _default is None:
+                    _default = _build(alias)
+        return _default
+    try:
+        return _accounts[alias]
+    except KeyError:
+        pass
+    with _lock:
+        if alias not in _accounts:
+            _accounts[alias] = _build(alias)
+    return _accounts[alias]
+
+
+def set_client(new_client):
+    """
+    Installs a client (None to go back to the default account's)
+    """
+    global _client
+    _client = new_client
+
+
+@contextlib.contextmanager
+def use(new_client):
+    """
+    Installs a client for every thread for the duration of a with block; to change the client for
+    just this thread (and the workers it starts), use selected
+    """
+    global _client
+    previous = _client
+    _client = new_client
+    try:
+        yield new_client
+    finally:
+        _client = previous
+
+
+@contextlib.contextmanager
+def account(alias):
+    """
+    Sends this thread's requests to the account with the given alias for the duration of a with
+    block
+    """
+    with selected(get_account(alias)) as account_client:
+        yield account_client
+
+
+@contextlib.contextmanager
+def selected(new_client):
+    """
+    Makes a client the current one for this thread only, for the duration of a with block
+    """
+    previous = _local.client
+    _local.client = new_client
+    try:
+        yield new_client
+    finally:
+        _local.client = previous
+
+
+def bind(fn):
+    """
+    Wraps fn to run with the client that's current now, e.g. when it's given to a worker thread
+    """
+    current = get_client()
+
+    def run(*args, **kwargs):
+        with selected(current):
+            return fn(*args, **kwargs)
+    return run
+
+
+def _build(alias):
+    if alias not in settings.BASECRM_ACCOUNTS:
+        if alias == DEFAULT_ACCOUNT:
+            return BaseCRMClient(response_cache=cache.default, alias=alias)
+        raise exceptions.BaseCRMConfigurationError(
+            "No BaseCRM account '%s' in BASECRM_ACCOUNTS" % alias
+        )
+    config = settings.BASECRM_ACCOUNTS[alias]
+    if not config.get('API_KEY'):
+        # falling back to BASECRM_API_KEY would quietly share the default account
+        raise exceptions.BaseCRMConfigurationError(
+            "BaseCRM account '%s' has no API_KEY" % alias
+        )
+    if alias == DEFAULT_ACCOUNT:
+        response_cache = cache.default
+    else:
+        response_cache = cache.ResponseCache(prefix='%s:%s' % (cache.KEY_PREFIX, alias))
+    return BaseCRMClient(
+        api_key=config['API_KEY'],
+        api_url=config.get('API_URL'),
+        user_agent=config.get('USER_AGENT'),
+        pool_size=config.get('POOL_SIZE'),
+        rate=config.get('RATE'),
+        connect_timeout=config.get('CONNECT_TIMEOUT'),
+        read_timeout=config.get('READ_TIMEOUT'),
+        interactive_reserve=config.get('INTERACTIVE_RESERVE'),
+        response_cache=response_cache,
+        alias=alias,
+    )
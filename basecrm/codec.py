@@ -0,0 +1,117 @@
+"""
+The JSON codec used for request bodies and responses. BASECRM_JSON_BACKEND picks the backend:
+'json' (the stdlib, the default), 'orjson', 'ujson', or the dotted path of any module providing
+dumps() and loads(). If the backend can't be imported we log a warning and fall back to the stdlib.
+
+Values our serializers commonly produce that JSON has no type for are encoded as strings: dates and
+datetimes in ISO 8601 format, and Decimals in full (so e.g. a deal value keeps its precision).
+"""
+import datetime
+import importlib
+import json
+import logging
+from decimal import Decimal
+
+from . import settings
+
+logger = logging.getLogger(__name__)
+
+_backend = None
+
+
+def default(obj):
+    if isinstance(obj, (datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return str(obj)
+    raise TypeError("Object of type %s is not JSON serializable" % type(obj).__name__)
+
+
+class StdlibBackend(object):
+    name = 'json'
+
+    def dumps(self, obj):
+        return json.dumps(obj, default=default, separators=(',', ':')).encode('utf-8')
+
+    def loads(self, data):
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        return json.loads(data)
+
+
+class OrjsonBackend(object):
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self.orjson = orjson
+
+    def dumps(self, obj):
+        # orjson handles datetimes itself, but only gives `default` the types it can't
+        return self.orjson.dumps(obj, default=default)
+
+    def loads(self, data):
+        return self.orjson.loads(data)
+
+
+class ModuleBackend(object):
+    """
+    Any module with json-style dumps() and loads(), e.g. ujson
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.module = importlib.import_module(name)
+
+    def dumps(self, obj):
+        data = self.module.dumps(obj, default=default)
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        return data
+
+    def loads(self, data):
+        return self.module.loads(data)
+
+
+def get_backend(name=None):
+    name = name or settings.BASECRM_JSON_BACKEND
+    try:
+        if name == 'json':
+            return StdlibBackend()
+        if name == 'orjson':
+            return OrjsonBackend()
+        return ModuleBackend(name)
+    except ImportError:
+        logger.warning(
+            "BaseCRM JSON backend '%s' could not be imported; falling back to json" % name
+        )
+        return StdlibBackend()
+
+
+def backend():
+    global _backend
+    if _backend is None:
+        _backend = get_backend()
+    return _backend
+
+
+def reset():
+    """
+    Forgets the chosen backend so that it's looked up from settings again
+    """
+    global _backend
+    _backend = None
+
+
+def dumps(obj):
+    """
+    Encodes obj to JSON bytes
+    """
+    return backend().dumps(obj)
+
+
+def loads(data):
+    """
+    Decodes JSON from bytes or str
+    """
+    return backend().loads(data)
@@ -0,0 +1,206 @@
+"""
+Columnar materialisation of deals and contacts for analytics. Selected fields are accumulated from
+paginated reads into typed arrays, one per field: NumPy arrays when NumPy is installed, the stdlib
+`array` module otherwise. Integer columns use -1 for missing values (BaseCRM IDs are positive),
+float columns use NaN; dates and datetimes are stored as float seconds since the epoch (UTC).
+"""
+import array
+import calendar
+
+from django.utils.dateparse import parse_date, parse_datetime
+
+from . import exceptions, helpers, utils
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+INT = 'q'
+FLOAT = 'd'
+BOOL = 'b'
+DATE = 'date'
+DATETIME = 'datetime'
+
+TYPECODES = {INT: INT, FLOAT: FLOAT, BOOL: BOOL, DATE: FLOAT, DATETIME: FLOAT}
+MISSING = {INT: -1, FLOAT: float('nan'), BOOL: 0}
+
+DEAL_FIELDS = {
+    'id': INT,
+    'owner_id': INT,
+    'stage_id': INT,
+    'contact_id': INT,
+    'organization_id': INT,
+    'source_id': INT,
+    'loss_reason_id': INT,
+    'value': FLOAT,
+    'customized_win_likelihood': FLOAT,
+    'hot': BOOL,
+    'estimated_close_date': DATE,
+    'last_stage_change_at': DATETIME,
+    'last_activity_at': DATETIME,
+    'created_at': DATETIME,
+    'updated_at': DATETIME,
+}
+DEAL_DEFAULT_FIELDS = ['id', 'owner_id', 'stage_id', 'value', 'last_stage_change_at', 'updated_at']
+
+CONTACT_FIELDS = {
+    'id': INT,
+    'owner_id': INT,
+    'contact_id': INT,
+    'is_organization': BOOL,
+    'created_at': DATETIME,
+    'updated_at': DATETIME,
+}
+CONTACT_DEFAULT_FIELDS = ['id', 'owner_id', 'is_organization', 'updated_at']
+
+
+class Columns(object):
+    """
+    A set of equal-length typed columns, built up a record at a time with append()/extend() and
+    then frozen with finalize(), after which each column is available as columns[field_name].
+    """
+    stage_names = None
+    owner_names = None
+
+    def __init__(self, fields):
+        """
+        `fields` maps each field name to its kind: INT, FLOAT, BOOL, DATE or DATETIME
+        """
+        self.kinds = dict(fields)
+        self._converters = [(f, converter(kind)) for f, kind in self.kinds.items()]
+        self._data = {f: array.array(TYPECODES[kind]) for f, kind in self.kinds.items()}
+        self.finalized = False
+
+    def __len__(self):
+        return len(next(iter(self._data.values()))) if self._data else 0
+
+    def __getitem__(self, field_name):
+        return self._data[field_name]
+
+    def __contains__(self, field_name):
+        return field_name in self._data
+
+    def append(self, record):
+        for f, convert in self._converters:
+            self._data[f].append(convert(record.get(f)))
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+    def finalize(self):
+        """
+        Converts the columns to NumPy arrays, if NumPy is installed; this doesn't copy the data
+        """
+        if numpy is not None and not self.finalized:
+            self._data = {
+                f: numpy.frombuffer(col, dtype=col.typecode) if len(col) else
+                numpy.array([], dtype=col.typecode)
+                for f, col in self._data.items()
+            }
+        self.finalized = True
+        return self
+
+    def group_count(self, key):
+        """
+        Counts rows by the value of the `key` column, as a dict
+        """
+        if numpy is not None and self.finalized:
+            keys, counts = numpy.unique(self[key], return_counts=True)
+            return dict(zip(keys.tolist(), counts.tolist()))
+        totals = {}
+        for k in self[key]:
+            totals[k] = totals.get(k, 0) + 1
+        return totals
+
+    def group_sum(self, key, value):
+        """
+        Sums the `value` column by the value of the `key` column, as a dict; missing (NaN) values
+        are ignored
+        """
+        if numpy is not None and self.finalized:
+            keys, inverse = numpy.unique(self[key], return_inverse=True)
+            values = numpy.nan_to_num(numpy.asarray(self[value], dtype=float))
+            sums = numpy.bincount(inverse, weights=values, minlength=len(keys))
+            return dict(zip(keys.tolist(), sums.tolist()))
+        totals = {}
+        for k, v in zip(self[key], self[value]):
+            if v == v:  # not NaN
+                totals[k] = totals.get(k, 0.0) + v
+            else:
+                totals.setdefault(k, 0.0)
+        return totals
+
+
+def load(endpoint, kinds, fields, **kwargs):
+    """
+    Pages through the endpoint accumulating the given fields; kwargs are passed to the API as GET
+    params. Returns finalized Columns
+    """
+    unknown = [f for f in fields if f not in kinds]
+    if unknown:
+        raise exceptions.BaseCRMBadParameterFormat(
+            "Can't store %s as columns; expecting any of %s" % (
+                ', '.join(unknown), ', '.join(sorted(kinds))
+            )
+        )
+    columns = Columns((f, kinds[f]) for f in fields)
+    for page in utils.paginate(endpoint, kwargs):
+        columns.extend(page)
+    return columns.finalize()
+
+
+def deal_columns(fields=None, **kwargs):
+    """
+    Loads deals as Columns, with .stage_names and .owner_names dicts (by ID) from the cached stages
+    and users
+    """
+    columns = load('deals', DEAL_FIELDS, fields or DEAL_DEFAULT_FIELDS, **kwargs)
+    columns.stage_names = {s['id']: s.get('name') for s in helpers.get_stages()}
+    columns.owner_names = {u['id']: u.get('name') for u in helpers.get_users()}
+    return columns
+
+
+def contact_columns(fields=None, **kwargs):
+    """
+    Loads contacts as Columns, with an .owner_names dict (by ID) from the cached users
+    """
+    columns = load('contacts', CONTACT_FIELDS, fields or CONTACT_DEFAULT_FIELDS, **kwargs)
+    columns.owner_names = {u['id']: u.get('name') for u in helpers.get_users()}
+    return columns
+
+
+def converter(kind):
+    missing = MISSING.get(TYPECODES[kind])
+
+    def to_int(value):
+        return missing if value is None else int(value)
+
+    def to_float(value):
+        if value is None or value == '':
+            return missing
+        return float(value)
+
+    def to_bool(value):
+        return 1 if value else 0
+
+    def to_date(value):
+        d = parse_date(value) if value else None
+        return missing if d is None else float(calendar.timegm(d.timetuple()))
+
+    def to_datetime(value):
+        dt = parse_datetime(value) if value else None
+        if dt is None:
+            return missing
+        if dt.utcoffset() is not None:
+            dt = dt - dt.utcoffset()
+        return calendar.timegm(dt.timetuple()) + dt.microsecond / 1e6
+
+    return {
+        INT: to_int,
+        FLOAT: to_float,
+        BOOL: to_bool,
+        DATE: to_date,
+        DATETIME: to_datetime,
+    }[kind]
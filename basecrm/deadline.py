@@ -0,0 +1,99 @@
+"""
+A deadline is a budget of time for all the BaseCRM requests made inside a with block, so a view
+can give up on the CRM cleanly rather than tie up a worker:
+
+    try:
+        with deadline.within(0.8):
+            contact = helpers.get_contacts(id=contact_id)
+    except exceptions.BaseCRMTimeout:
+        contact = None
+
+Every request's connect and read timeouts are cut to the time left, and once it has run out,
+requests raise BaseCRMTimeout without being sent. Deadlines nest (an inner one can only shorten
+the outer one) and carry over to the worker threads of parallel paginate and batch writes.
+"""
+import contextlib
+import threading
+import time
+
+from . import exceptions
+
+_local = threading.local()
+
+
+@contextlib.contextmanager
+def within(seconds):
+    """
+    Sets a deadline `seconds` from now for the duration of a with block
+    """
+    expires = time.monotonic() + seconds
+    outer = current()
+    if outer is not None:
+        expires = min(expires, outer)
+    with _expiring(expires):
+        yield
+
+
+def current():
+    """
+    When this thread's deadline expires (by time.monotonic), or None if it doesn't have one
+    """
+    return getattr(_local, 'expires', None)
+
+
+def remaining():
+    """
+    Seconds left until the deadline (negative once it's passed), or None if there isn't one
+    """
+    expires = current()
+    if expires is None:
+        return None
+    return expires - time.monotonic()
+
+
+def check():
+    """
+    Raises BaseCRMTimeout if the deadline has passed; otherwise returns the time left, or None
+    """
+    left = remaining()
+    if left is not None and left <= 0:
+        raise exceptions.BaseCRMTimeout(
+            "Deadline for BaseCRM requests passed %.3fs ago" % -left
+        )
+    return left
+
+
+def cap(timeout):
+    """
+    A requests timeout (a number, a (connect, read) tuple or None) cut to the time left
+    """
+    left = check()
+    if left is None:
+        return timeout
+    if timeout is None:
+        return left
+    if isinstance(timeout, tuple):
+        return tuple(left if t is None else min(t, left) for t in timeout)
+    return min(timeout, left)
+
+
+def bind(fn):
+    """
+    Wraps fn to run under the deadline that's current now, e.g. when it's given to a worker thread
+    """
+    expires = current()
+
+    def run(*args, **kwargs):
+        with _expiring(expires):
+            return fn(*args, **kwargs)
+    return run
+
+
+@contextlib.contextmanager
+def _expiring(expires):
+    previous = current()
+    _local.expires = expires
+    try:
+        yield
+    finally:
+        _local.expires = previous
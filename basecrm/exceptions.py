@@ -89,3 +89,64 @@ class BaseCRMNoResult(Exception):
 
     def __str__(self):
         return self.detail
+
+
+class BaseCRMReplayError(Exception):
+    default_detail = _(
+        u'No recorded response matches the request'
+    )
+
+    def __init__(self, detail=None):
+        if detail is not None:
+            self.detail = force_text(detail)
+        else:
+            self.detail = force_text(self.default_detail)
+
+    def __str__(self):
+        return self.detail
+
+
+class BaseCRMTimeout(Exception):
+    default_detail = _(
+        u'The BaseCRM API did not respond in time'
+    )
+
+    def __init__(self, detail=None):
+        if detail is not None:
+            self.detail = force_text(detail)
+        else:
+            self.detail = force_text(self.default_detail)
+
+    def __str__(self):
+        return self.detail
+
+
+class BaseCRMCircuitOpen(Exception):
+    default_detail = _(
+        u'BaseCRM API requests are failing, so none are being sent for now'
+    )
+
+    def __init__(self, detail=None):
+        if detail is not None:
+            self.detail = force_text(detail)
+        else:
+            self.detail = force_text(self.default_detail)
+
+    def __str__(self):
+        return self.detail
+
+
+class BaseCRMOverloaded(Exception):
+    default_detail = _(
+        u'BaseCRM API is throttling requests or failing'
+    )
+
+    def __init__(self, detail=None, status_code=None):
+        self.status_code = status_code
+        if detail is not None:
+            self.detail = force_text(detail)
+        else:
+            self.detail = force_text(self.default_detail)
+
+    def __str__(self):
+        return self.detail
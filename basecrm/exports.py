@@ -0,0 +1,223 @@
+"""
+Exports of a whole resource to gzip-compressed JSONL (one record per line) or CSV. Pages are
+fetched (optionally several at once) and written out as they arrive, so memory is bounded by a
+handful of pages however large the export.
+
+Given a models.Checkpoint the export can be resumed. Each page is written (as a complete gzip
+member of its own, when compressing) and synced to disk before the checkpoint records it along with
+where it ends in the file. A resumed export cuts off anything after that, such as a page only half
+written when the process was killed, and carries on from the next page. Gzip (and Python's gzip
+module) reads the members as one file. Once an export completes its checkpoint is reset, so the
+next one starts afresh.
+"""
+import csv
+import gzip
+import io
+import os
+import time
+
+from . import codec, exceptions, lanes, records, serializers, settings, utils
+
+JSONL = 'jsonl'
+CSV = 'csv'
+FORMATS = [JSONL, CSV]
+
+LEAD_FIELDS = [
+    'id',
+    'owner_id',
+    'first_name',
+    'last_name',
+    'organization_name',
+    'status',
+    'source_id',
+    'title',
+    'description',
+    'industry',
+    'website',
+    'email',
+    'phone',
+    'mobile',
+    'fax',
+    'twitter',
+    'facebook',
+    'linkedin',
+    'skype',
+    'address',
+    'tags',
+    'custom_fields',
+]
+
+# the fields that can be exported, as the serializers (for leads, the API docs) describe them
+FIELDS = {
+    'contacts': serializers.ContactModelSerializer.base_fields + records.COMMON_FIELDS,
+    'deals': serializers.DealModelSerializer.base_fields + records.COMMON_FIELDS,
+    'leads': LEAD_FIELDS + records.COMMON_FIELDS,
+}
+
+
+class JsonLinesWriter(object):
+
+    def __init__(self, fileobj, fields):
+        self.fileobj = fileobj
+        self.fields = fields
+
+    def write_header(self):
+        pass
+
+    def write(self, items):
+        self.fileobj.write(b''.join(
+            codec.dumps({f: item.get(f) for f in self.fields}) + b'\n' for item in items
+        ))
+
+    def close(self):
+        pass
+
+
+class CsvWriter(object):
+    """
+    Nested values (addresses, tags, custom fields) are written as JSON
+    """
+
+    def __init__(self, fileobj, fields):
+        self.text = io.TextIOWrapper(fileobj, encoding='utf-8', newline='', write_through=True)
+        self.writer = csv.writer(self.text)
+        self.fields = fields
+
+    def write_header(self):
+        self.writer.writerow(self.fields)
+
+    def write(self, items):
+        self.writer.writerows([_csv_value(item.get(f)) for f in self.fields] for item in items)
+
+    def close(self):
+        # don't let the wrapper close the file it was given
+        self.text.detach()
+
+
+WRITERS = {JSONL: JsonLinesWriter, CSV: CsvWriter}
+
+
+class Stats(object):
+
+    def __init__(self):
+        self.records = 0
+        self.pages = 0
+        self.bytes = 0
+        self.started = time.time()
+        self.seconds = 0.0
+
+    def add(self, items):
+        self.records += len(items)
+        self.pages += 1
+        self.seconds = time.time() - self.started
+
+    def summary(self):
+        rate = self.records / self.seconds if self.seconds else 0.0
+        return "%s records in %s pages, %s bytes, in %.1fs (%.1f records/s)" % (
+            self.records, self.pages, self.bytes, self.seconds, rate
+        )
+
+
+def fields_for(endpoint, fields=None):
+    """
+    Validates the requested fields against those the endpoint has; all of them if none are given
+    """
+    if endpoint not in FIELDS:
+        raise exceptions.BaseCRMBadParameterFormat(
+            "Can't export %s; expecting one of %s" % (endpoint, ', '.join(sorted(FIELDS)))
+        )
+    if not fields:
+        return list(FIELDS[endpoint])
+    unknown = [f for f in fields if f not in FIELDS[endpoint]]
+    if unknown:
+        raise exceptions.BaseCRMBadParameterFormat(
+            "Unknown %s fields: %s; expecting any of %s" % (
+                endpoint, ', '.join(unknown), ', '.join(FIELDS[endpoint])
+            )
+        )
+    return list(fields)
+
+
+def export(
+    endpoint, path, format=JSONL, fields=None, compress=True, workers=None, per_page=None,
+    checkpoint=None, get_params=None, lane=lanes.BACKGROUND
+):
+    """
+    Writes every record of the endpoint to the file at `path`; get_params are passed to the API.
+    Returns Stats for the export (for a resumed export, just the part done this time). Its requests
+    are in the background lane by default (see lanes.py)
+    """
+    if format not in FORMATS:
+        raise exceptions.BaseCRMBadParameterFormat(
+            "Expecting one of %s but got %s" % (', '.join(FORMATS), format)
+        )
+    fields = fields_for(endpoint, fields)
+    resuming = (
+        checkpoint is not None and checkpoint.page > 0 and checkpoint.offset is not None and
+        os.path.exists(path) and os.path.getsize(path) >= checkpoint.offset
+    )
+    if checkpoint is not None and checkpoint.page and not resuming:
+        # nothing to resume
+        checkpoint.reset()
+    params = dict(get_params or {})
+    start = params.get('page', 1)
+    if resuming:
+        start = params['page'] = checkpoint.page + 1
+    stats = Stats()
+
+    with lanes.use(lane), open(path, 'r+b' if resuming else 'wb') as fileobj:
+        if resuming:
+            # anything after the last recorded page is from an export that was interrupted
+            fileobj.truncate(checkpoint.offset)
+            fileobj.seek(checkpoint.offset)
+        size = fileobj.tell()
+        buffer = io.BytesIO()
+        writer = WRITERS[format](buffer, fields)
+        if not resuming:
+            writer.write_header()
+        pages = utils.paginate(
+            endpoint,
+            params,
+            per_page=per_page,
+            workers=workers or settings.BASECRM_BATCH_WORKERS,
+        )
+        for number, items in enumerate(pages, start):
+            writer.write(items)
+            # the page must be on disk before the checkpoint is moved past it
+            _write_segment(fileobj, buffer, compress, sync=checkpoint is not None)
+            if checkpoint is not None:
+                checkpoint.advance(number, items[-1].get('id'), fileobj.tell())
+            stats.add(items)
+        writer.close()
+        # e.g. the header of an empty export
+        _write_segment(fileobj, buffer, compress)
+        stats.bytes = fileobj.tell() - size
+
+    if checkpoint is not None:
+        checkpoint.reset()
+    stats.seconds = time.time() - stats.started
+    return stats
+
+
+def _write_segment(fileobj, buffer, compress, sync=False):
+    """
+    Writes out and empties the buffer, as a gzip member of its own if compressing; with sync, it's
+    on disk when this returns
+    """
+    data = buffer.getvalue()
+    if not data:
+        return
+    buffer.seek(0)
+    buffer.truncate()
+    fileobj.write(gzip.compress(data) if compress else data)
+    if sync:
+        fileobj.flush()
+        os.fsync(fileobj.fileno())
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list)):
+        return codec.dumps(value).decode('utf-8')
+    return value
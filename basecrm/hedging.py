@@ -0,0 +1,135 @@
+"""
+Hedged requests, to cut the tail latency of single-record reads. If a request hasn't been answered
+within the `percentile` latency of its endpoint, an identical one is sent and whichever answers
+first is used. Latencies come from the last `window` requests to each endpoint (a metrics.Histogram,
+so the delay is accurate to within a bucket), and nothing is hedged until `minimum_requests` of
+them have been seen.
+
+Hedges are capped by a budget: each request earns `budget` of a hedge (so 0.05 allows about one
+extra request for every twenty), and up to BURST unspent hedges can be saved up. When BaseCRM is
+slow across the board the budget runs out, and requests are just waited for, rather than doubling
+the load on it.
+
+Switch it on with BASECRM_HEDGE = True. utils.request only hedges interactive RETRIEVE requests for
+a single ID (see lanes.py), as they're idempotent and someone is waiting on them.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError, wait
+
+from . import settings
+from .metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+BURST = 10
+
+
+class Hedger(object):
+
+    def __init__(
+        self, percentile=None, budget=None, minimum_requests=None, window=None, max_workers=None
+    ):
+        self.percentile = percentile or settings.BASECRM_HEDGE_PERCENTILE
+        self.budget = budget or settings.BASECRM_HEDGE_BUDGET
+        self.minimum_requests = minimum_requests or settings.BASECRM_HEDGE_MINIMUM_REQUESTS
+        self.window = window or settings.BASECRM_HEDGE_WINDOW
+        # each request and its hedge take a worker while they're in flight
+        self.max_workers = max_workers or 2 * settings.BASECRM_POOL_SIZE
+        self.requests = 0
+        self.hedges = 0
+        self.wins = 0
+        self._tokens = 0.0
+        self._latencies = {}
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix='basecrm-hedge'
+        )
+        self._lock = threading.Lock()
+
+    def delay(self, endpoint):
+        """
+        Seconds to wait for a request to the endpoint before hedging it, or None if too few
+        requests to it have been seen yet
+        """
+        with self._lock:
+            latencies = self._latencies.get(endpoint)
+            if latencies is None:
+                return None
+            current, previous = latencies
+            if current.count < self.minimum_requests:
+                # just started a new window
+                current = previous
+            if current is None or current.count < self.minimum_requests:
+                return None
+            return current.percentile(self.percentile)
+
+    def run(self, endpoint, send):
+        """
+        Calls send() (which must be safe to call twice, from any thread) and returns its result,
+        calling it again if it's slow and the budget allows
+        """
+        delay = self.delay(endpoint)
+        with self._lock:
+            self.requests += 1
+            self._tokens = min(self._tokens + self.budget, BURST)
+        started = time.monotonic()
+        if delay is None:
+            # nothing to hedge against yet, so there's no need for another thread
+            try:
+                return send()
+            finally:
+                self._record(endpoint, time.monotonic() - started)
+        primary = self._executor.submit(send)
+        # slow requests are recorded too, however they finish, or the delay would only ever drop
+        primary.add_done_callback(lambda f: self._record(endpoint, time.monotonic() - started))
+        try:
+            return primary.result(timeout=delay)
+        except TimeoutError:
+            pass
+        if not self._spend():
+            return primary.result()
+
+        logger.debug(
+            "Hedging BaseCRM request to '%s' endpoint after %.0fms" % (endpoint, delay * 1000)
+        )
+        hedge = self._executor.submit(send)
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        with self._lock:
+                            self.wins += 1
+                    return future.result()
+        # both failed
+        return primary.result()
+
+    def stats(self):
+        """
+        Requests run, how many were hedged, and how many of those the hedge answered first
+        """
+        with self._lock:
+            return {'requests': self.requests, 'hedges': self.hedges, 'wins': self.wins}
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    def _spend(self):
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            self.hedges += 1
+            return True
+
+    def _record(self, endpoint, duration):
+        with self._lock:
+            if endpoint not in self._latencies:
+                self._latencies[endpoint] = (Histogram(), None)
+            current, previous = self._latencies[endpoint]
+            if current.count >= self.window:
+                current, previous = Histogram(), current
+                self._latencies[endpoint] = (current, previous)
+            current.add(duration)
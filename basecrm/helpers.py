@@ -1,12 +1,11 @@
-from django.apps import apps as django_apps
-
-from . import utils, exceptions, settings
-
 """
 All functions at this level are simple wrappers that accept (as kwargs) any extra GET vars to be
 sent to the API call. In addition, the special 'id' kwarg parameter will affect the API endpoint
 URL itself instead of being appended as a GET var.
 """
+from django.apps import apps as django_apps
+
+from . import utils, exceptions, settings
 
 
 def get_contacts(**kwargs):
@@ -20,6 +19,16 @@ def get_contacts(**kwargs):
     return utils.parse(resp)
 
 
+def iter_contacts(**kwargs):
+    """
+    Pages through the API for contacts, yielding each contact dict in turn; kwargs are passed
+    to the API as GET params as with get_contacts.
+    """
+    for page in utils.paginate('contacts', kwargs):
+        for item in page:
+            yield item
+
+
 def create_contact(contact_dict):
     """
     Runs local validation on the given dict and gives passing ones to the API to create
@@ -55,6 +64,16 @@ def get_deals(**kwargs):
     return utils.parse(resp)
 
 
+def iter_deals(**kwargs):
+    """
+    Pages through the API for deals, yielding each deal dict in turn; kwargs are passed
+    to the API as GET params as with get_deals.
+    """
+    for page in utils.paginate('deals', kwargs):
+        for item in page:
+            yield item
+
+
 def create_deal(deal_dict):
     """
     Runs local validation on the given dict and gives passing ones to the API to create
@@ -90,6 +109,16 @@ def get_leads(**kwargs):
     return utils.parse(resp)
 
 
+def iter_leads(**kwargs):
+    """
+    Pages through the API for leads, yielding each lead dict in turn; kwargs are passed
+    to the API as GET params as with get_leads.
+    """
+    for page in utils.paginate('leads', kwargs):
+        for item in page:
+            yield item
+
+
 def create_lead(lead_dict):
     """
     Runs local validation on the given dict and gives passing ones to the API to create
@@ -0,0 +1,226 @@
+"""
+Imports of records from JSONL (one JSON object per line) or CSV files, such as those written by
+exports.py. Rows are read, checked against the schemas behind utils.validate_*_dict, and sent a
+chunk at a time through a batch.BatchWriter, and the outcome of each is written to a results file
+as it completes, so memory is bounded by the writer's chunk size however large the file.
+
+Rows with an `id` update that record; rows without one create a new record. The read-only fields
+an export includes (created_at, updated_at, creator_id) are dropped. In CSV files empty cells are
+left out, and cells holding JSON objects or arrays (e.g. addresses, tags) and integer IDs are
+decoded, as is true/false in the resource's boolean fields (see validation.Schema).
+
+Each row is keyed by its (1-based) row number, so given a models.Checkpoint an interrupted import
+can be run again without repeating the rows that succeeded; their results are written again from
+the checkpoint, so the results file still covers every row. Once an import completes its
+checkpoint is reset, so the next one (e.g. of a different file) starts afresh.
+"""
+import collections
+import csv
+import gzip
+import io
+import itertools
+import json
+
+from . import batch, codec, exceptions, records, utils
+
+JSONL = 'jsonl'
+CSV = 'csv'
+FORMATS = [JSONL, CSV]
+
+RESOURCES = {
+    'contacts': 'contact',
+    'deals': 'deal',
+    'leads': 'lead',
+}
+
+INVALID = 'invalid'
+FAILED = 'failed'
+
+
+class Stats(object):
+
+    def __init__(self):
+        self.counts = collections.Counter()
+
+    def add(self, outcome):
+        self.counts[outcome] += 1
+
+    def summary(self):
+        return "%s created, %s updated, %s invalid, %s failed" % (
+            self.counts['created'],
+            self.counts['updated'],
+            self.counts[INVALID],
+            self.counts[FAILED],
+        )
+
+
+class ResultsWriter(object):
+    """
+    Writes a JSON line per row: its row number, outcome, BaseCRM ID and any error
+    """
+
+    def __init__(self, fileobj, stats):
+        self.fileobj = fileobj
+        self.stats = stats
+
+    def write(self, row, action, base_id=None, error=None):
+        if error is None:
+            outcome = 'created' if action == utils.CREATE else 'updated'
+        else:
+            outcome = INVALID if isinstance(error, exceptions.BaseCRMValidationError) else FAILED
+        self.stats.add(outcome)
+        self.fileobj.write(codec.dumps({
+            'row': row,
+            'outcome': outcome,
+            'id': base_id,
+            'error': None if error is None else str(error),
+        }) + b'\n')
+
+
+def read_jsonl(fileobj):
+    """
+    Generator of (row number, dict) from a binary file of JSON lines; blank lines are skipped, and
+    lines that aren't JSON objects are given as the ValueError raised for them
+    """
+    for number, line in enumerate(fileobj, 1):
+        if not line.strip():
+            continue
+        try:
+            row = codec.loads(line)
+            if not isinstance(row, dict):
+                raise ValueError("Expecting a JSON object")
+        except ValueError as e:
+            row = e
+        yield number, row
+
+
+def read_csv(fileobj, booleans=()):
+    """
+    Generator of (row number, dict) from a binary CSV file with a header row; true/false is only
+    decoded in the `booleans` fields, so text that happens to say "true" is left alone
+    """
+    text = io.TextIOWrapper(fileobj, encoding='utf-8', newline='')
+    for number, row in enumerate(csv.DictReader(text), 1):
+        yield number, {
+            k: _from_csv(k, v, booleans)
+            for k, v in row.items()
+            if k is not None and v not in ('', None)
+        }
+
+
+def operations(resource, rows, results):
+    """
+    Generator of a batch.Operation for each valid row; invalid rows are written straight to results
+    """
+    schemas = {
+        utils.CREATE: utils.get_schema(resource, utils.CREATE),
+        utils.UPDATE: utils.get_schema(resource, utils.UPDATE, skip_id=True),
+    }
+    for number, row in rows:
+        if isinstance(row, Exception):
+            results.write(number, utils.CREATE, error=exceptions.BaseCRMValidationError(
+                "Row %s could not be read: %s" % (number, row)
+            ))
+            continue
+        id = row.pop('id', None)
+        for f in records.COMMON_FIELDS:
+            row.pop(f, None)
+        action = utils.CREATE if id is None else utils.UPDATE
+        error = schemas[action].check(row)
+        if error is not None:
+            results.write(number, action, error=exceptions.BaseCRMValidationError(error))
+            continue
+        yield batch.Operation(action, id, row, key=number)
+
+
+def import_file(
+    endpoint, path, results_path, format=None, max_workers=None, rate=None, checkpoint=None
+):
+    """
+    Creates or updates a record for each row of the file at `path` (gzipped if it ends in .gz),
+    writing the outcome of each row to `results_path`. Returns Stats.
+
+    The format is taken from the file extension (.jsonl or .csv, before any .gz) if not given
+    """
+    if endpoint not in RESOURCES:
+        raise exceptions.BaseCRMBadParameterFormat(
+            "Can't import %s; expecting one of %s" % (endpoint, ', '.join(sorted(RESOURCES)))
+        )
+    format = format or _format_for(path)
+    if format not in FORMATS:
+        raise exceptions.BaseCRMBadParameterFormat(
+            "Expecting one of %s but got %s" % (', '.join(FORMATS), format)
+        )
+    resource = RESOURCES[endpoint]
+    writer = batch.BatchWriter(resource, max_workers=max_workers, checkpoint=checkpoint, rate=rate)
+    stats = Stats()
+
+    with _open(path, 'rb') as fileobj, _open(results_path, 'wb') as results_file:
+        results = ResultsWriter(results_file, stats)
+        if format == CSV:
+            booleans = (
+                utils.get_schema(resource, utils.CREATE).booleans |
+                utils.get_schema(resource, utils.UPDATE).booleans
+            )
+            rows = read_csv(fileobj, booleans)
+        else:
+            rows = read_jsonl(fileobj)
+        pending = operations(resource, rows, results)
+        if checkpoint is not None:
+            pending = _not_done(pending, checkpoint, results, writer.chunk_size)
+        for result in writer.write(pending):
+            results.write(
+                result.operation.key,
+                result.operation.action,
+                result.record and result.record.get('id') or result.operation.id,
+                result.error,
+            )
+    if checkpoint is not None:
+        checkpoint.reset()
+    return stats
+
+
+def _not_done(operations, checkpoint, results, chunk_size):
+    """
+    Passes on the operations that haven't already succeeded, a chunk at a time; those that have
+    are written to results with the BaseCRM ID the checkpoint recorded for them
+    """
+    operations = iter(operations)
+    while True:
+        chunk = list(itertools.islice(operations, chunk_size))
+        if not chunk:
+            return
+        done = dict(
+            checkpoint.items.filter(key__in=[str(o.key) for o in chunk], error__isnull=True)
+            .values_list('key', 'base_id')
+        )
+        for operation in chunk:
+            if str(operation.key) in done:
+                results.write(operation.key, operation.action, done[str(operation.key)])
+            else:
+                yield operation
+
+
+def _open(path, mode):
+    return gzip.open(path, mode) if path.endswith('.gz') else open(path, mode)
+
+
+def _format_for(path):
+    name = path[:-3] if path.endswith('.gz') else path
+    return name.rsplit('.', 1)[-1].lower() if '.' in name else None
+
+
+def _from_csv(field_name, value, booleans=()):
+    if field_name in booleans and value.lower() in ('true', 'false'):
+        return value.lower() == 'true'
+    if value[:1] in ('{', '['):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+    if field_name == 'id' or field_name.endswith('_id'):
+        try:
+            return int(value)
+        except ValueError:
+            return value
+    return value
@@ -0,0 +1,103 @@
+"""
+Traffic classes, so bulk work can't crowd out requests someone is waiting for. Requests are
+interactive unless made in the background lane, which batch writes and exports use by default:
+
+    with lanes.use(lanes.BACKGROUND):
+        for page in utils.paginate('contacts', workers=4):
+            ...
+
+A share of each client's rate limit and connection pool (BASECRM_INTERACTIVE_RESERVE) is kept for
+interactive requests: background requests are held to the rest, while interactive ones can use it
+all. Like deadlines, the lane carries over to the worker threads of parallel paginate.
+"""
+import contextlib
+import threading
+
+from . import deadline, exceptions
+from .limits import RateLimiter
+
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+LANES = [INTERACTIVE, BACKGROUND]
+
+_local = threading.local()
+
+
+class Lanes(object):
+    """
+    Admits requests to a client's rate limit (a limits.RateLimiter, or None) and connection pool,
+    holding the background lane to 1 - reserve of each
+    """
+
+    def __init__(self, limiter, rate, pool_size, reserve):
+        self.limiter = limiter
+        self.reserve = reserve
+        share = 1.0 - reserve
+        self.background_limiter = RateLimiter(rate * share) if rate and reserve else None
+        self.background_connections = max(1, int(pool_size * share))
+        self._background_slots = threading.BoundedSemaphore(self.background_connections)
+
+    @contextlib.contextmanager
+    def admit(self, lane):
+        """
+        Waits for the lane's share of the rate limit and connection pool, holding a connection for
+        the duration of the with block
+        """
+        if lane == BACKGROUND:
+            wait(self.background_limiter)
+            if not self._background_slots.acquire(timeout=deadline.check()):
+                raise exceptions.BaseCRMTimeout(
+                    "Deadline for BaseCRM requests passed waiting for a background connection"
+                )
+            try:
+                wait(self.limiter)
+                yield
+            finally:
+                self._background_slots.release()
+        else:
+            wait(self.limiter)
+            yield
+
+
+def wait(limiter):
+    """
+    Waits for a turn at a limits.RateLimiter (or None, for no limit), raising BaseCRMTimeout
+    without taking one if the turn would come after the deadline
+    """
+    if limiter is not None and not limiter.wait(timeout=deadline.check()):
+        raise exceptions.BaseCRMTimeout(
+            "Deadline for BaseCRM requests would pass waiting for the rate limit"
+        )
+
+
+def current():
+    return getattr(_local, 'lane', INTERACTIVE)
+
+
+@contextlib.contextmanager
+def use(lane):
+    """
+    Puts this thread's requests in a lane for the duration of a with block
+    """
+    if lane not in LANES:
+        raise exceptions.BaseCRMBadParameterFormat(
+            "Expecting one of %s but got %s" % (', '.join(LANES), lane)
+        )
+    previous = current()
+    _local.lane = lane
+    try:
+        yield
+    finally:
+        _local.lane = previous
+
+
+def bind(fn):
+    """
+    Wraps fn to run in the lane that's current now, e.g. when it's given to a worker thread
+    """
+    lane = current()
+
+    def run(*args, **kwargs):
+        with use(lane):
+            return fn(*args, **kwargs)
+    return run
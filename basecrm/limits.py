@@ -0,0 +1,124 @@
+"""
+Limits on how hard we hit the BaseCRM API, shared by whatever threads are making requests: a fixed
+rate, and an adaptive limit on concurrency for parallel pagination and batch writes.
+"""
+import threading
+import time
+
+import requests
+
+from . import exceptions, signals
+
+
+class RateLimiter(object):
+    """
+    Spaces out calls to wait(), from any number of threads, to no more than `rate` per second
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self, timeout=None):
+        """
+        Waits for this call's turn and returns True, or returns False straight away (without taking
+        a turn) if that would be more than `timeout` seconds from now
+        """
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            if timeout is not None and delay > timeout:
+                return False
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+        return True
+
+
+class AdaptiveLimiter(object):
+    """
+    Limits how many requests are in flight at once, adjusting the limit AIMD-style between
+    `minimum` and `maximum`: each request that comes back in good time adds 1/limit (so about one
+    more per round trip), and a request that's throttled, fails with a 5xx or times out, or whose
+    (smoothed) latency reaches `tolerance` times the best seen, cuts it by `backoff`. Requests
+    already in flight when it's cut can't cut it again.
+
+    The limit is sent as the signals.concurrency_changed signal whenever its whole part changes
+    (see metrics.py), with this limiter's name as the sender.
+    """
+
+    def __init__(self, name, maximum, minimum=1, initial=None, tolerance=2.0, backoff=0.5):
+        self.name = name
+        self.maximum = maximum
+        self.minimum = minimum
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.limit = float(initial or max(minimum, maximum // 2))
+        self.in_flight = 0
+        self.latency = None
+        self.best_latency = None
+        self._recovering = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """
+        Waits for a slot; returns the time to give to release() with the outcome
+        """
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+        return time.monotonic()
+
+    def release(self, started, overloaded=False):
+        duration = time.monotonic() - started
+        with self._condition:
+            self.in_flight -= 1
+            previous = int(self.limit)
+            if not overloaded:
+                self.latency = duration if self.latency is None else (
+                    0.8 * self.latency + 0.2 * duration
+                )
+                if self.best_latency is None or self.latency < self.best_latency:
+                    self.best_latency = self.latency
+                overloaded = self.latency >= self.best_latency * self.tolerance
+            if self._recovering:
+                self._recovering -= 1
+            elif overloaded:
+                self.limit = max(self.minimum, self.limit * self.backoff)
+                self._recovering = self.in_flight
+            else:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self._condition.notify_all()
+            changed = int(self.limit) != previous
+        if changed:
+            signals.concurrency_changed.send(
+                sender=self.name, name=self.name, limit=int(self.limit)
+            )
+
+    def run(self, fn, *args, **kwargs):
+        """
+        Calls fn in a slot, taking the outcome from whatever it raises (see overloaded())
+        """
+        started = self.acquire()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            self.release(started, overloaded(e))
+            raise
+        self.release(started)
+        return result
+
+
+def overloaded(exception):
+    """
+    Whether an exception means BaseCRM is struggling or throttling us, rather than that the
+    request itself was bad
+    """
+    return isinstance(exception, (
+        exceptions.BaseCRMOverloaded,
+        exceptions.BaseCRMTimeout,
+        exceptions.BaseCRMCircuitOpen,
+        requests.exceptions.ConnectionError,
+    ))
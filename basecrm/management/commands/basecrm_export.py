@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from basecrm import exceptions, exports, models
+
+
+class Command(BaseCommand):
+    help = "Exports every record of a BaseCRM resource to a gzip-compressed JSONL or CSV file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('resource', choices=sorted(exports.FIELDS))
+        parser.add_argument(
+            '--output', help="File to write to (default: <resource>.<format>[.gz])"
+        )
+        parser.add_argument('--format', choices=exports.FORMATS, default=exports.JSONL)
+        parser.add_argument(
+            '--fields', help="Comma-separated fields to export (default: all of them)"
+        )
+        parser.add_argument('--no-compress', action='store_true', help="Don't gzip the output")
+        parser.add_argument('--workers', type=int, help="Pages to fetch concurrently")
+        parser.add_argument('--per-page', type=int)
+        parser.add_argument(
+            '--checkpoint',
+            help="Name of a checkpoint to resume from (and record progress to)",
+        )
+        parser.add_argument(
+            '--filter',
+            action='append',
+            default=[],
+            metavar='PARAM=VALUE',
+            help="GET param to filter by, e.g. --filter owner_id=1; may be repeated",
+        )
+
+    def handle(self, *args, **options):
+        resource = options['resource']
+        compress = not options['no_compress']
+        output = options['output'] or '%s.%s%s' % (
+            resource, options['format'], '.gz' if compress else ''
+        )
+        fields = options['fields'].split(',') if options['fields'] else None
+        get_params = {}
+        for f in options['filter']:
+            if '=' not in f:
+                raise CommandError("Filters must be given as PARAM=VALUE, not %s" % f)
+            key, value = f.split('=', 1)
+            get_params[key] = value
+        checkpoint = None
+        if options['checkpoint']:
+            checkpoint = models.Checkpoint.for_job(options['checkpoint'])
+            if checkpoint.page:
+                self.stdout.write("Resuming after page %s" % checkpoint.page)
+
+        try:
+            stats = exports.export(
+                resource,
+                output,
+                format=options['format'],
+                fields=fields,
+                compress=compress,
+                workers=options['workers'],
+                per_page=options['per_page'],
+                checkpoint=checkpoint,
+                get_params=get_params,
+            )
+        except exceptions.BaseCRMBadParameterFormat as e:
+            raise CommandError(str(e))
+        self.stdout.write("Exported %s to %s: %s" % (resource, output, stats.summary()))
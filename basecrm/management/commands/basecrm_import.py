@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from basecrm import exceptions, imports, models
+
+
+class Command(BaseCommand):
+    help = "Creates or updates BaseCRM records from a JSONL or CSV file (optionally gzipped)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('resource', choices=sorted(imports.RESOURCES))
+        parser.add_argument('path')
+        parser.add_argument(
+            '--format',
+            choices=imports.FORMATS,
+            help="Format of the file (default: from its extension)",
+        )
+        parser.add_argument(
+            '--results',
+            help="File to write the outcome of each row to (default: <path>.results.jsonl)",
+        )
+        parser.add_argument('--workers', type=int, help="Requests to make concurrently")
+        parser.add_argument('--rate', type=float, help="Maximum requests per second")
+        parser.add_argument(
+            '--checkpoint',
+            help="Name of a checkpoint to skip rows already imported (and record progress to)",
+        )
+
+    def handle(self, *args, **options):
+        results = options['results'] or '%s.results.jsonl' % options['path']
+        checkpoint = None
+        if options['checkpoint']:
+            checkpoint = models.Checkpoint.for_job(options['checkpoint'])
+
+        try:
+            stats = imports.import_file(
+                options['resource'],
+                options['path'],
+                results,
+                format=options['format'],
+                max_workers=options['workers'],
+                rate=options['rate'],
+                checkpoint=checkpoint,
+            )
+        except exceptions.BaseCRMBadParameterFormat as e:
+            raise CommandError(str(e))
+        except IOError as e:
+            raise CommandError("Could not read %s: %s" % (options['path'], e))
+        self.stdout.write("Imported %s from %s: %s; results in %s" % (
+            options['resource'], options['path'], stats.summary(), results
+        ))
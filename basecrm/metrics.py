@@ -0,0 +1,169 @@
+"""
+An in-memory collector of BaseCRM API request metrics, fed by the signals in signals.py. For each
+method and endpoint it keeps request and error counts, bytes sent and received, retries and a
+latency histogram (fixed, logarithmically spaced buckets, so memory doesn't grow with the number
+of requests and percentiles are accurate to within a bucket, about 10%).
+
+It also keeps the latest limit of each adaptive concurrency limiter (see limits.py).
+
+Switch on the default collector with BASECRM_METRICS = True, then scrape collector.snapshot() and
+collector.concurrency(), or call collector.log() periodically.
+"""
+import bisect
+import collections
+import logging
+import threading
+
+from . import signals
+
+logger = logging.getLogger(__name__)
+
+# upper bounds of the latency buckets, in seconds: 1ms to about 2 minutes
+BOUNDS = [0.001 * 1.1 ** i for i in range(125)]
+PERCENTILES = [50, 95, 99]
+
+
+class Histogram(object):
+
+    def __init__(self):
+        self.counts = [0] * (len(BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        """
+        The upper bound of the bucket holding the p-th percentile (but never more than the max)
+        """
+        if not self.count:
+            return None
+        rank = self.count * p / 100.0
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(BOUNDS[i], self.max) if i < len(BOUNDS) else self.max
+        return self.max
+
+
+class EndpointStats(object):
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.statuses = collections.Counter()
+        self.latency = Histogram()
+
+    def add(self, status, duration, request_bytes, response_bytes, retries, exception):
+        self.requests += 1
+        if exception is not None or status is None or status >= 400:
+            self.errors += 1
+        if retries:
+            self.retries += 1
+        self.request_bytes += request_bytes or 0
+        self.response_bytes += response_bytes or 0
+        self.statuses[status if status is not None else type(exception).__name__] += 1
+        self.latency.add(duration)
+
+    def as_dict(self):
+        d = {
+            'requests': self.requests,
+            'errors': self.errors,
+            'error_rate': self.errors / float(self.requests) if self.requests else 0.0,
+            'retries': self.retries,
+            'request_bytes': self.request_bytes,
+            'response_bytes': self.response_bytes,
+            'statuses': dict(self.statuses),
+            'total_time': self.latency.total,
+            'mean': self.latency.total / self.latency.count if self.latency.count else None,
+            'max': self.latency.max if self.latency.count else None,
+        }
+        for p in PERCENTILES:
+            d['p%s' % p] = self.latency.percentile(p)
+        return d
+
+
+class Collector(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._limits = {}
+
+    def connect(self):
+        signals.request_finished.connect(self.record, dispatch_uid=self._dispatch_uid())
+        signals.concurrency_changed.connect(self.record_limit, dispatch_uid=self._dispatch_uid())
+
+    def disconnect(self):
+        signals.request_finished.disconnect(dispatch_uid=self._dispatch_uid())
+        signals.concurrency_changed.disconnect(dispatch_uid=self._dispatch_uid())
+
+    def record(self, sender, method, endpoint, status, duration, request_bytes=0,
+               response_bytes=None, retries=0, exception=None, **kwargs):
+        key = '%s %s' % (method, endpoint)
+        with self._lock:
+            if key not in self._stats:
+                self._stats[key] = EndpointStats()
+            self._stats[key].add(
+                status, duration, request_bytes, response_bytes, retries, exception
+            )
+
+    def record_limit(self, sender, name, limit, **kwargs):
+        with self._lock:
+            self._limits[name] = limit
+
+    def concurrency(self):
+        """
+        The latest adaptive concurrency limit of each limiter (see limits.AdaptiveLimiter), by name
+        """
+        with self._lock:
+            return dict(self._limits)
+
+    def snapshot(self, reset=False):
+        """
+        A dict of stats by "<method> <endpoint>": requests, errors, error_rate, retries (requests
+        that were retries), request_bytes, response_bytes, statuses (counts by status code, or
+        exception name), and the total_time spent waiting plus latency mean, max, p50, p95 and p99,
+        all in seconds
+        """
+        with self._lock:
+            stats = self._stats
+            if reset:
+                self._stats = {}
+            return {key: s.as_dict() for key, s in stats.items()}
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+    def log(self, level=logging.INFO, reset=False):
+        for key, s in sorted(self.snapshot(reset=reset).items()):
+            logger.log(
+                level,
+                "BaseCRM %s: %s requests, %.1f%% errors, p50 %.0fms, p95 %.0fms, p99 %.0fms" % (
+                    key,
+                    s['requests'],
+                    s['error_rate'] * 100,
+                    s['p50'] * 1000,
+                    s['p95'] * 1000,
+                    s['p99'] * 1000,
+                )
+            )
+        for name, limit in sorted(self.concurrency().items()):
+            logger.log(level, "BaseCRM %s: concurrency limit %s" % (name, limit))
+
+    def _dispatch_uid(self):
+        return 'basecrm.metrics.%s' % id(self)
+
+
+collector = Collector()
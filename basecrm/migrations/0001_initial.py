@@ -0,0 +1,39 @@
+# Generated by Django 3.2.25 on 2026-10-19 08:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Checkpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('page', models.PositiveIntegerField(default=0)),
+                ('last_id', models.BigIntegerField(null=True)),
+                ('offset', models.BigIntegerField(null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CheckpointItem',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255)),
+                ('base_id', models.BigIntegerField(null=True)),
+                ('error', models.TextField(null=True)),
+                ('checkpoint', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='basecrm.checkpoint')),
+            ],
+            options={
+                'unique_together': {('checkpoint', 'key')},
+            },
+        ),
+    ]
@@ -0,0 +1,115 @@
+"""
+An optional app of read-only local copies of BaseCRM contacts, deals and leads; add
+'basecrm.mirror' to INSTALLED_APPS (after 'basecrm') to have the tables. These are the loaders for
+them. Records are written a page at a time: each page is one transaction that deletes any existing
+rows for its IDs and bulk-inserts the fresh copies, which is an upsert that works on every database
+backend. A record older (by updated_at) than the row already stored is skipped, so a retried or
+late webhook can't overwrite newer data.
+"""
+from django.apps import apps as django_apps
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+from .. import utils
+
+default_app_config = 'basecrm.mirror.apps.MirrorConfig'
+
+APP_LABEL = 'basecrm_mirror'
+
+# model names by resource type
+MODELS = {
+    'contact': 'Contact',
+    'deal': 'Deal',
+    'lead': 'Lead',
+}
+
+
+def is_installed():
+    return django_apps.is_installed('basecrm.mirror')
+
+
+def get_model(resource):
+    """
+    The mirror model for a resource type (e.g. 'deal'), or None if it isn't mirrored
+    """
+    if resource not in MODELS:
+        return None
+    return django_apps.get_model(APP_LABEL, MODELS[resource])
+
+
+def upsert(model, records):
+    """
+    Writes the given record dicts to the model's table, replacing any existing rows that aren't
+    newer. Returns the number written
+    """
+    rows = {}
+    for record in records:
+        row = model.from_record(record)
+        if not _older(row.updated_at, getattr(rows.get(row.id), 'updated_at', None)):
+            rows[row.id] = row
+    if not rows:
+        return 0
+    with transaction.atomic():
+        stored = model.objects.select_for_update().filter(id__in=list(rows))
+        for id, updated_at in stored.values_list('id', 'updated_at'):
+            if _older(rows[id].updated_at, updated_at):
+                del rows[id]
+        model.objects.filter(id__in=list(rows)).delete()
+        model.objects.bulk_create(rows.values())
+    return len(rows)
+
+
+def newest(record, other):
+    """
+    Whichever of two copies of a record dict was updated last; `other` if that can't be told
+    """
+    if _older(_updated_at(other), _updated_at(record)):
+        return record
+    return other
+
+
+def delete(model, ids):
+    return model.objects.filter(id__in=list(ids)).delete()[0]
+
+
+def load(model, **kwargs):
+    """
+    Pages through the model's endpoint and upserts every record; kwargs are passed to the API as
+    GET params (e.g. updated_since-style filters). Returns the number of records written
+    """
+    total = 0
+    for page in utils.paginate(model.endpoint, kwargs):
+        total += upsert(model, page)
+    return total
+
+
+def load_contacts(**kwargs):
+    return load(get_model('contact'), **kwargs)
+
+
+def load_deals(**kwargs):
+    return load(get_model('deal'), **kwargs)
+
+
+def load_leads(**kwargs):
+    return load(get_model('lead'), **kwargs)
+
+
+def sync_handler(model):
+    """
+    Returns a handler for sync.Sync.register that keeps the model's table up to date
+    """
+    def handler(event_type, data, meta):
+        if event_type == 'deleted':
+            delete(model, [data['id']])
+        else:
+            upsert(model, [data])
+    return handler
+
+
+def _updated_at(record):
+    return parse_datetime(record.get('updated_at') or '') if record is not None else None
+
+
+def _older(updated_at, than):
+    return updated_at is not None and than is not None and updated_at < than
@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class MirrorConfig(AppConfig):
+
+    name = 'basecrm.mirror'
+    label = 'basecrm_mirror'
+    verbose_name = "Base (CRM) mirror"
+    default_auto_field = 'django.db.models.AutoField'
@@ -0,0 +1,72 @@
+# Generated by Django 3.2.25 on 2026-10-19 08:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Contact',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('owner_id', models.BigIntegerField(db_index=True, null=True)),
+                ('created_at', models.DateTimeField(null=True)),
+                ('updated_at', models.DateTimeField(db_index=True, null=True)),
+                ('data', models.TextField(default='{}')),
+                ('is_organization', models.BooleanField(null=True)),
+                ('contact_id', models.BigIntegerField(null=True)),
+                ('name', models.CharField(blank=True, max_length=255, null=True)),
+                ('first_name', models.CharField(blank=True, max_length=255, null=True)),
+                ('last_name', models.CharField(blank=True, max_length=255, null=True)),
+                ('email', models.CharField(blank=True, db_index=True, max_length=255, null=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='Deal',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('owner_id', models.BigIntegerField(db_index=True, null=True)),
+                ('created_at', models.DateTimeField(null=True)),
+                ('updated_at', models.DateTimeField(db_index=True, null=True)),
+                ('data', models.TextField(default='{}')),
+                ('name', models.CharField(blank=True, max_length=255, null=True)),
+                ('value', models.DecimalField(decimal_places=2, max_digits=20, null=True)),
+                ('currency', models.CharField(blank=True, max_length=3, null=True)),
+                ('hot', models.BooleanField(null=True)),
+                ('stage_id', models.BigIntegerField(db_index=True, null=True)),
+                ('contact_id', models.BigIntegerField(null=True)),
+                ('organization_id', models.BigIntegerField(null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Lead',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('owner_id', models.BigIntegerField(db_index=True, null=True)),
+                ('created_at', models.DateTimeField(null=True)),
+                ('updated_at', models.DateTimeField(db_index=True, null=True)),
+                ('data', models.TextField(default='{}')),
+                ('first_name', models.CharField(blank=True, max_length=255, null=True)),
+                ('last_name', models.CharField(blank=True, max_length=255, null=True)),
+                ('organization_name', models.CharField(blank=True, max_length=255, null=True)),
+                ('status', models.CharField(blank=True, max_length=255, null=True)),
+                ('email', models.CharField(blank=True, db_index=True, max_length=255, null=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AddIndex(
+            model_name='deal',
+            index=models.Index(fields=['stage_id', 'owner_id'], name='basecrm_mirror_deal_stage'),
+        ),
+    ]
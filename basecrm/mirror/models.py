@@ -0,0 +1,134 @@
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings as django_settings
+from django.db import models
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+
+class MirroredRecord(models.Model):
+    """
+    A local, read-only copy of a BaseCRM record. The columns hold the fields we filter on; the full
+    record as given by the API is kept as JSON in `data`. Concrete models set the `endpoint` they
+    mirror and the list of `mirrored_fields` copied straight from the record into columns.
+    """
+    endpoint = None
+    mirrored_fields = []
+
+    id = models.BigIntegerField(primary_key=True)  # BaseCRM ID
+    owner_id = models.BigIntegerField(null=True, db_index=True)
+    created_at = models.DateTimeField(null=True)
+    updated_at = models.DateTimeField(null=True, db_index=True)
+    data = models.TextField(default='{}')
+
+    class Meta:
+        abstract = True
+
+    @property
+    def record(self):
+        return json.loads(self.data)
+
+    @classmethod
+    def from_record(cls, record):
+        """
+        Builds an (unsaved) instance from a record dict as returned by utils.parse
+        """
+        instance = cls(
+            id=record['id'],
+            owner_id=record.get('owner_id'),
+            created_at=_to_datetime(record.get('created_at')),
+            updated_at=_to_datetime(record.get('updated_at')),
+            data=json.dumps(record),
+        )
+        for f in cls.mirrored_fields:
+            setattr(instance, f, record.get(f))
+        return instance
+
+
+class Contact(MirroredRecord):
+    endpoint = 'contacts'
+    mirrored_fields = [
+        'is_organization',
+        'contact_id',
+        'name',
+        'first_name',
+        'last_name',
+        'email',
+    ]
+
+    is_organization = models.BooleanField(null=True)
+    contact_id = models.BigIntegerField(null=True)
+    name = models.CharField(max_length=255, null=True, blank=True)
+    first_name = models.CharField(max_length=255, null=True, blank=True)
+    last_name = models.CharField(max_length=255, null=True, blank=True)
+    email = models.CharField(max_length=255, null=True, blank=True, db_index=True)
+
+
+class Deal(MirroredRecord):
+    endpoint = 'deals'
+    mirrored_fields = [
+        'name',
+        'currency',
+        'hot',
+        'stage_id',
+        'contact_id',
+        'organization_id',
+    ]
+
+    name = models.CharField(max_length=255, null=True, blank=True)
+    value = models.DecimalField(max_digits=20, decimal_places=2, null=True)
+    currency = models.CharField(max_length=3, null=True, blank=True)
+    hot = models.BooleanField(null=True)
+    stage_id = models.BigIntegerField(null=True, db_index=True)
+    contact_id = models.BigIntegerField(null=True)
+    organization_id = models.BigIntegerField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['stage_id', 'owner_id'], name='basecrm_mirror_deal_stage'),
+        ]
+
+    @classmethod
+    def from_record(cls, record):
+        instance = super(Deal, cls).from_record(record)
+        instance.value = _to_decimal(record.get('value'))
+        return instance
+
+
+class Lead(MirroredRecord):
+    endpoint = 'leads'
+    mirrored_fields = [
+        'first_name',
+        'last_name',
+        'organization_name',
+        'status',
+        'email',
+    ]
+
+    first_name = models.CharField(max_length=255, null=True, blank=True)
+    last_name = models.CharField(max_length=255, null=True, blank=True)
+    organization_name = models.CharField(max_length=255, null=True, blank=True)
+    status = models.CharField(max_length=255, null=True, blank=True)
+    email = models.CharField(max_length=255, null=True, blank=True, db_index=True)
+
+
+def _to_datetime(value):
+    """
+    BaseCRM gives ISO 8601 UTC strings; make them safe to store whatever USE_TZ is set to
+    """
+    if not value:
+        return None
+    dt = parse_datetime(value)
+    if dt is not None and timezone.is_aware(dt) and not django_settings.USE_TZ:
+        dt = timezone.make_naive(dt, timezone.utc)
+    return dt
+
+
+def _to_decimal(value):
+    if value in (None, ''):
+        return None
+    try:
+        return Decimal(str(value))
+    except InvalidOperation:
+        return None
@@ -0,0 +1,66 @@
+from django.db import models, transaction
+
+
+class Checkpoint(models.Model):
+    """
+    Progress of a named long-running job, so that it can resume where it stopped. Paginating
+    readers record the last page (and the last ID on it) they completed, and exports how far into
+    their file it ends; batch writers record the outcome of each item by key so completed items are
+    never sent again.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    page = models.PositiveIntegerField(default=0)
+    last_id = models.BigIntegerField(null=True)
+    offset = models.BigIntegerField(null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @classmethod
+    def for_job(cls, name):
+        return cls.objects.get_or_create(name=name)[0]
+
+    def advance(self, page, last_id=None, offset=None):
+        self.page = page
+        self.last_id = last_id
+        self.offset = offset
+        self.save(update_fields=['page', 'last_id', 'offset', 'updated_at'])
+
+    def done(self, keys):
+        """
+        The subset of the given keys that have already completed successfully
+        """
+        return set(
+            self.items.filter(key__in=[str(k) for k in keys], error__isnull=True)
+            .values_list('key', flat=True)
+        )
+
+    def record(self, outcomes):
+        """
+        Saves outcomes from an iterable of (key, base_id, error) tuples, replacing earlier ones
+        """
+        items = [
+            CheckpointItem(
+                checkpoint=self,
+                key=str(key),
+                base_id=base_id,
+                error=None if error is None else str(error),
+            )
+            for key, base_id, error in outcomes
+        ]
+        if items:
+            with transaction.atomic():
+                self.items.filter(key__in=[i.key for i in items]).delete()
+                CheckpointItem.objects.bulk_create(items)
+
+    def reset(self):
+        self.items.all().delete()
+        self.advance(0)
+
+
+class CheckpointItem(models.Model):
+    checkpoint = models.ForeignKey(Checkpoint, related_name='items', on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    base_id = models.BigIntegerField(null=True)
+    error = models.TextField(null=True)
+
+    class Meta:
+        unique_together = [('checkpoint', 'key')]
@@ -0,0 +1,219 @@
+"""
+Makes BaseCRM match a Django queryset. Both sides are streamed in BaseCRM ID order (the queryset
+with .iterator(), BaseCRM page by page) and merge-joined in a single pass, so memory is bounded by a
+page rather than by the number of rows. Each local row linked to a BaseCRM record whose serialized
+fields differ is planned as an update of just those fields; rows with no link, or linked to a record
+that no longer exists, are planned as creates; BaseCRM records with no local row are reported as
+orphans (nothing is ever deleted). Only IDs up to the highest one there was when planning started
+are joined, so the records a run creates (which get higher IDs), and the local rows it links to
+them, don't come back around in that same run as orphans and creates.
+"""
+import collections
+import datetime
+import itertools
+from decimal import Decimal, InvalidOperation
+
+from django.db import models
+from django.db.models.functions import Cast
+
+from . import batch, exceptions, serializers, utils
+
+CREATE = utils.CREATE
+UPDATE = utils.UPDATE
+ORPHAN = '__orphan__'
+
+PlanItem = collections.namedtuple('PlanItem', ['action', 'id', 'data', 'instance'])
+
+
+class Report(object):
+    """
+    Counts everything planned, by action. With keep_items it also lists (action, local pk, BaseCRM
+    ID) for each item in plan order, and get() looks one up by either ID; that takes memory for
+    every changed row and orphan, so it's off by default.
+    """
+
+    def __init__(self, keep_items=False):
+        self.counts = collections.Counter()
+        self.items = [] if keep_items else None
+        self.errors = []
+        self._by_pk = {}
+        self._by_id = {}
+
+    def add(self, item):
+        self.counts[item.action] += 1
+        if self.items is None:
+            return
+        pk = getattr(item.instance, 'pk', None)
+        entry = (item.action, pk, item.id)
+        self.items.append(entry)
+        if pk is not None:
+            self._by_pk[pk] = entry
+        if item.id is not None:
+            self._by_id[item.id] = entry
+
+    def get(self, pk=None, id=None):
+        """
+        The item for the local row with the given pk, or else for the BaseCRM ID; None if there
+        isn't one (e.g. an unchanged row)
+        """
+        if self.items is None:
+            raise exceptions.BaseCRMConfigurationError(
+                "Items are only kept by a Report made with keep_items=True"
+            )
+        if pk is not None:
+            return self._by_pk.get(pk)
+        return self._by_id.get(id)
+
+    def summary(self):
+        return "%s to create, %s to update, %s orphaned in BaseCRM, %s errors" % (
+            self.counts[CREATE],
+            self.counts[UPDATE],
+            self.counts[ORPHAN],
+            len(self.errors),
+        )
+
+
+class Reconciliation(object):
+
+    def __init__(self, queryset, serializer_class, base_id_field='basecrm_id', resource=None):
+        self.queryset = queryset
+        self.serializer_class = serializer_class
+        self.base_id_field = base_id_field
+        self.resource = resource or _resource_for(serializer_class)
+
+    def plan(self):
+        """
+        Generator of PlanItems; instance is the local model instance (None for orphans) and data
+        is the (partial, for updates) dict to send
+        """
+        # before anything is created
+        last_id = self._last_id()
+        unlinked = self.queryset.filter(**{'%s__isnull' % self.base_id_field: True})
+        for instance in unlinked.iterator():
+            yield PlanItem(CREATE, None, self.serialize(instance), instance)
+
+        local = itertools.takewhile(
+            lambda instance: int(getattr(instance, self.base_id_field)) <= last_id,
+            self.queryset.exclude(
+                **{'%s__isnull' % self.base_id_field: True}
+            ).order_by(self._id().asc()).iterator()
+        )
+        remote = itertools.takewhile(
+            lambda record: record['id'] <= last_id,
+            (
+                record
+                for page in utils.paginate('%ss' % self.resource, {'sort_by': 'id'})
+                for record in page
+            )
+        )
+
+        instance = next(local, None)
+        record = next(remote, None)
+        while instance is not None or record is not None:
+            local_id = None if instance is None else int(getattr(instance, self.base_id_field))
+            if record is None or (instance is not None and local_id < record['id']):
+                # linked to a record that no longer exists
+                yield PlanItem(CREATE, None, self.serialize(instance), instance)
+                instance = next(local, None)
+            elif instance is None or record['id'] < local_id:
+                yield PlanItem(ORPHAN, record['id'], None, None)
+                record = next(remote, None)
+            else:
+                changes = _diff(self.serialize(instance), record)
+                if changes:
+                    yield PlanItem(UPDATE, record['id'], changes, instance)
+                instance = next(local, None)
+                record = next(remote, None)
+
+    def _last_id(self):
+        """
+        The highest BaseCRM ID so far, in BaseCRM or linked locally (to a record since deleted);
+        anything created from now on gets a higher one
+        """
+        records = utils.parse(utils.request(
+            utils.RETRIEVE, '%ss' % self.resource, {'sort_by': 'id:desc', 'per_page': 1}
+        ))
+        local = self.queryset.aggregate(last=models.Max(self._id()))['last']
+        return max(int(records[0]['id']) if records else 0, int(local or 0))
+
+    def _id(self):
+        """
+        The BaseCRM ID as a number, even if it's kept as text (where '10' sorts before '9')
+        """
+        field = self.queryset.model._meta.get_field(self.base_id_field)
+        if isinstance(field, models.IntegerField):
+            return models.F(self.base_id_field)
+        return Cast(self.base_id_field, models.BigIntegerField())
+
+    def serialize(self, instance):
+        data = self.serializer_class(instance).to_dict()
+        data.pop('id', None)
+        return data
+
+    def run(self, dry_run=False, writer=None, checkpoint=None, keep_items=False):
+        """
+        Plans, and unless dry_run is set, executes the plan. Records created in BaseCRM have their
+        new ID saved to base_id_field on the local row. Given a models.Checkpoint, writes already
+        completed by an interrupted run (keyed on the local pk) are not sent again; it's reset once
+        a run completes, so the next run (e.g. the next night's) starts afresh. Returns a Report,
+        listing every item if keep_items is set
+        """
+        report = Report(keep_items)
+        operations = self._operations(self.plan(), report)
+        if dry_run:
+            for operation in operations:
+                pass
+            return report
+
+        writer = writer or batch.BatchWriter(self.resource, checkpoint=checkpoint)
+        for result in writer.write(operations):
+            if result.error is not None:
+                report.errors.append((result.operation.context.pk, result.error))
+            elif result.operation.action == CREATE:
+                self.queryset.model._default_manager.filter(
+                    pk=result.operation.context.pk
+                ).update(**{self.base_id_field: result.record['id']})
+        if writer.checkpoint is not None:
+            writer.checkpoint.reset()
+        return report
+
+    def _operations(self, plan, report):
+        for item in plan:
+            report.add(item)
+            if item.action != ORPHAN:
+                yield batch.Operation(
+                    item.action, item.id, item.data, item.instance, item.instance.pk
+                )
+
+
+def _resource_for(serializer_class):
+    if issubclass(serializer_class, serializers.ContactModelSerializer):
+        return 'contact'
+    if issubclass(serializer_class, serializers.DealModelSerializer):
+        return 'deal'
+    raise exceptions.BaseCRMConfigurationError(
+        "Could not derive the resource from the serializer; pass `resource` explicitly"
+    )
+
+
+def _diff(local, remote):
+    """
+    The subset of `local` whose values differ from those in the BaseCRM record
+    """
+    return {k: v for k, v in local.items() if not _same(v, remote.get(k))}
+
+
+def _same(local, remote):
+    if local == remote:
+        return True
+    if isinstance(local, dict) and isinstance(remote, dict):
+        # BaseCRM gives back every custom field / address key; we only care about the ones we set
+        return all(_same(v, remote.get(k)) for k, v in local.items())
+    if isinstance(local, datetime.date):
+        return local.isoformat() == remote
+    if isinstance(local, (int, float, Decimal)) and not isinstance(local, bool):
+        try:
+            return Decimal(str(local)) == Decimal(str(remote))
+        except InvalidOperation:
+            return False
+    return False
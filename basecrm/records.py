@@ -0,0 +1,99 @@
+"""
+Compact, read-only representations of BaseCRM records for bulk reads. Each resource gets a class
+with a __slots__ attribute per field, generated from the serializer's base_fields (plus the
+read-only timestamps the API always sends), so a record's container is a pointer per field
+instead of a hash table. That is only the container: the values, which make up most of a record,
+are the same either way, and a page of deals measures at about three quarters of the memory of the
+dicts (see benchmarks/record_memory.py). Any keys not in the slots are kept in a small dict on the
+side.
+
+Records are also read-only Mappings, so code written against the dicts given back by utils.parse
+(record['name'], record.get('value'), 'email' in record, dict(record) ...) keeps working.
+"""
+from collections.abc import Mapping
+
+from . import serializers
+
+COMMON_FIELDS = ['created_at', 'updated_at', 'creator_id']
+
+_classes = {}
+
+
+class Record(Mapping):
+    __slots__ = ('_extra', )
+    fields = ()
+    _field_set = frozenset()
+
+    @classmethod
+    def from_dict(cls, d):
+        record = cls.__new__(cls)
+        slots = cls._field_set
+        extra = None
+        for k, v in d.items():
+            if k in slots:
+                object.__setattr__(record, k, v)
+            else:
+                if extra is None:
+                    extra = {}
+                extra[k] = v
+        object.__setattr__(record, '_extra', extra)
+        return record
+
+    def __setattr__(self, name, value):
+        raise AttributeError("%s is read-only" % type(self).__name__)
+
+    def __getitem__(self, key):
+        if key in self._field_set:
+            try:
+                return object.__getattribute__(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __iter__(self):
+        for f in self.fields:
+            try:
+                object.__getattribute__(self, f)
+            except AttributeError:
+                continue
+            yield f
+        if self._extra is not None:
+            for k in self._extra:
+                yield k
+
+    def __len__(self):
+        return sum(1 for k in self)
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, self.to_dict())
+
+    def to_dict(self):
+        return dict(self.items())
+
+
+def record_class(name, fields):
+    """
+    Generates (and caches) a Record class with a slot for each of the given fields
+    """
+    fields = tuple(dict.fromkeys(list(fields) + COMMON_FIELDS))
+    if (name, fields) not in _classes:
+        _classes[(name, fields)] = type(name, (Record, ), {
+            '__slots__': fields,
+            'fields': fields,
+            '_field_set': frozenset(fields),
+        })
+    return _classes[(name, fields)]
+
+
+def record_class_for(serializer_class):
+    """
+    The Record class for the resource a serializer describes
+    """
+    name = serializer_class.__name__.replace('ModelSerializer', '') + 'Record'
+    return record_class(name, serializer_class.base_fields)
+
+
+ContactRecord = record_class_for(serializers.ContactModelSerializer)
+DealRecord = record_class_for(serializers.DealModelSerializer)
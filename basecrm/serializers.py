@@ -2,7 +2,7 @@ import types
 
 from django.apps import apps
 
-from . import exceptions, helpers
+from . import exceptions, helpers, tracing
 
 
 class AbstractModelSerializer(object):
@@ -34,17 +34,19 @@ class AbstractModelSerializer(object):
                 "Initialise serializer with an instance of type model (as defined in Meta class)"
             )
         self.instance = instance
-        self._self_assign_values()
+        with tracing.span('basecrm.serialize', serializer=type(self).__name__):
+            self._self_assign_values()
 
     def to_dict(self):
         """
         Creates a dict of the self-set values
         """
         output = {}
-        for f in self._get_field_list():
-            val = getattr(self, f, None)
-            if val is not None:
-                output[f] = val
+        with tracing.span('basecrm.to_dict', serializer=type(self).__name__):
+            for f in self._get_field_list():
+                val = getattr(self, f, None)
+                if val is not None:
+                    output[f] = val
 
         return output
 
@@ -53,6 +55,7 @@ class AbstractModelSerializer(object):
         Assigns values to internal attributes, based on the instance values and falling back to
         values defined at class level. Will also call callables where appropriate.
         """
+        span = tracing.tracer().span
         for f in self._get_field_list():
             if (
                 self.read_only_fields is None or
@@ -61,7 +64,8 @@ class AbstractModelSerializer(object):
                     f not in self.read_only_fields
                 )
             ):
-                instance_val = self._get_value(f)
+                with span('basecrm.serialize.field', field=f):
+                    instance_val = self._get_value(f)
                 if instance_val is not None:
                     setattr(self, f, instance_val)
 
@@ -2,7 +2,33 @@ from django.conf import settings
 
 BASECRM_API_URL = getattr(settings, 'BASECRM_API_URL', 'https://api.getbase.com/v2/')
 BASECRM_API_KEY = getattr(settings, 'BASECRM_API_KEY', None)
+# alias -> {'API_KEY': ..., and optionally 'API_URL', 'USER_AGENT', 'POOL_SIZE', 'RATE',
+# 'CONNECT_TIMEOUT', 'READ_TIMEOUT', 'INTERACTIVE_RESERVE', 'WEBHOOK_SECRET'}
+BASECRM_ACCOUNTS = getattr(settings, 'BASECRM_ACCOUNTS', {})
 BASECRM_USER_AGENT = getattr(settings, 'BASECRM_USER_AGENT', 'YunoJuno/1.0')
+BASECRM_PER_PAGE = getattr(settings, 'BASECRM_PER_PAGE', 100)
+# connections kept open to the API, per client
+BASECRM_POOL_SIZE = getattr(settings, 'BASECRM_POOL_SIZE', 10)
+# requests per second across everything using a client; None for no limit
+BASECRM_RATE = getattr(settings, 'BASECRM_RATE', None)
+# the share of the rate and connections that background requests can't use; see lanes.py
+BASECRM_INTERACTIVE_RESERVE = getattr(settings, 'BASECRM_INTERACTIVE_RESERVE', 0.25)
+# seconds to wait for a connection, and for each read from it
+BASECRM_CONNECT_TIMEOUT = getattr(settings, 'BASECRM_CONNECT_TIMEOUT', 3.05)
+BASECRM_READ_TIMEOUT = getattr(settings, 'BASECRM_READ_TIMEOUT', 30)
+# per endpoint circuit breakers; see breaker.py
+BASECRM_BREAKER = getattr(settings, 'BASECRM_BREAKER', True)
+BASECRM_BREAKER_FAILURE_RATE = getattr(settings, 'BASECRM_BREAKER_FAILURE_RATE', 0.5)
+BASECRM_BREAKER_MINIMUM_REQUESTS = getattr(settings, 'BASECRM_BREAKER_MINIMUM_REQUESTS', 20)
+BASECRM_BREAKER_WINDOW = getattr(settings, 'BASECRM_BREAKER_WINDOW', 50)
+BASECRM_BREAKER_RESET_TIMEOUT = getattr(settings, 'BASECRM_BREAKER_RESET_TIMEOUT', 30)
+BASECRM_BREAKER_PROBES = getattr(settings, 'BASECRM_BREAKER_PROBES', 1)
+# hedged single-record reads: see hedging.py
+BASECRM_HEDGE = getattr(settings, 'BASECRM_HEDGE', False)
+BASECRM_HEDGE_PERCENTILE = getattr(settings, 'BASECRM_HEDGE_PERCENTILE', 95)
+BASECRM_HEDGE_BUDGET = getattr(settings, 'BASECRM_HEDGE_BUDGET', 0.05)
+BASECRM_HEDGE_MINIMUM_REQUESTS = getattr(settings, 'BASECRM_HEDGE_MINIMUM_REQUESTS', 20)
+BASECRM_HEDGE_WINDOW = getattr(settings, 'BASECRM_HEDGE_WINDOW', 1000)
 BASECRM_CACHE_USERS = getattr(settings, 'BASECRM_CACHE_USERS', True)
 BASECRM_CACHE_STAGES = getattr(settings, 'BASECRM_CACHE_STAGES', True)
 BASECRM_CACHE_PIPELINE = getattr(settings, 'BASECRM_CACHE_PIPELINE', True)
@@ -15,3 +41,24 @@ BASECRM_CACHE_USERS_FILTERS = {
 }
 if BASECRM_CACHE_USERS_STATUS in (None, '*'):
     del BASECRM_CACHE_USERS_FILTERS['status']
+BASECRM_SYNC_DEVICE_UUID = getattr(settings, 'BASECRM_SYNC_DEVICE_UUID', None)
+BASECRM_SYNC_ACK_BATCH_SIZE = getattr(settings, 'BASECRM_SYNC_ACK_BATCH_SIZE', 100)
+BASECRM_RESPONSE_CACHE_TIMEOUT = getattr(settings, 'BASECRM_RESPONSE_CACHE_TIMEOUT', 0)
+BASECRM_RESPONSE_CACHE_ALIAS = getattr(settings, 'BASECRM_RESPONSE_CACHE_ALIAS', 'default')
+BASECRM_RESPONSE_CACHE_ENDPOINTS = getattr(
+    settings,
+    'BASECRM_RESPONSE_CACHE_ENDPOINTS',
+    ['contacts', 'deals', 'leads', 'notes', 'pipelines', 'stages', 'users']
+)
+BASECRM_WEBHOOK_SECRET = getattr(settings, 'BASECRM_WEBHOOK_SECRET', None)
+# the account whose records the mirror tables hold, and so whose webhooks update them
+BASECRM_MIRROR_ACCOUNT = getattr(settings, 'BASECRM_MIRROR_ACCOUNT', 'default')
+BASECRM_BATCH_WORKERS = getattr(settings, 'BASECRM_BATCH_WORKERS', 4)
+# requests per second across a batch's workers; None for no limit
+BASECRM_BATCH_RATE = getattr(settings, 'BASECRM_BATCH_RATE', None)
+# adjust the requests in flight for parallel pagination and batches (up to their workers)
+BASECRM_ADAPTIVE_CONCURRENCY = getattr(settings, 'BASECRM_ADAPTIVE_CONCURRENCY', False)
+BASECRM_STREAM_CHUNK_SIZE = getattr(settings, 'BASECRM_STREAM_CHUNK_SIZE', 64 * 1024)
+BASECRM_JSON_BACKEND = getattr(settings, 'BASECRM_JSON_BACKEND', 'json')
+BASECRM_METRICS = getattr(settings, 'BASECRM_METRICS', False)
+BASECRM_TRACER = getattr(settings, 'BASECRM_TRACER', None)
@@ -0,0 +1,24 @@
+"""
+Signals sent around every HTTP request made to the BaseCRM API (by utils._request), with the
+endpoint (e.g. 'deals', without any ID) as the sender, so receivers can listen to all endpoints or
+just one. See metrics.py for a collector built on them.
+
+request_started is sent with: method, endpoint, retries (0 for a first attempt).
+
+request_finished is sent with: method, endpoint, retries, status (None if no response was
+received), duration (seconds until the response headers arrived), request_bytes, response_bytes
+(None if unknown, e.g. for a streamed response without a Content-Length) and exception (what was
+raised if no response was received, otherwise None).
+
+breaker_state_changed is sent when an endpoint's circuit breaker (see breaker.py) changes state,
+with: endpoint, previous, state and failure_rate (over the breaker's window).
+
+concurrency_changed is sent when an adaptive concurrency limit (see limits.AdaptiveLimiter)
+changes, with the limiter's name as the sender, and with: name, limit.
+"""
+from django.dispatch import Signal
+
+request_started = Signal()
+request_finished = Signal()
+breaker_state_changed = Signal()
+concurrency_changed = Signal()
@@ -0,0 +1,155 @@
+"""
+Incremental decoding of BaseCRM list responses. Rather than buffering the whole body and building
+the full object tree (as response.json() does), the body is read a chunk at a time and each element
+of `items` is decoded as soon as it is complete, so memory is proportional to a single record.
+"""
+import codecs
+import json
+
+from . import exceptions
+
+WHITESPACE = ' \t\n\r'
+
+
+class ItemStream(object):
+    """
+    Iterates over the `data` dict of each element of a list response's `items`. Any other top-level
+    keys are captured once they've been read: `meta` on .meta, anything else on .extra. Also keeps
+    a running .count of items and the .last_id seen, e.g. for pagination and checkpoints.
+
+    `chunks` is an iterable of bytes, such as response.iter_content(); `response`, if given, is
+    closed once the body has been read.
+    """
+
+    def __init__(self, chunks, response=None):
+        self.meta = None
+        self.extra = {}
+        self.count = 0
+        self.last_id = None
+        self._chunks = iter(chunks)
+        self._response = response
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._exhausted = False
+        self._items = self._parse()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._items)
+
+    def exhaust(self):
+        """
+        Reads (and discards) the rest of the body; returns the total count of items
+        """
+        for item in self._items:
+            pass
+        return self.count
+
+    def _parse(self):
+        try:
+            self._expect('{')
+            while True:
+                token = self._next_token()
+                if token == '}':
+                    break
+                if token == ',':
+                    self._pos += 1
+                    continue
+                key = self._decode()
+                self._skip_whitespace()
+                self._expect(':')
+                if key == 'items':
+                    for item in self._parse_items():
+                        yield item
+                elif key == 'meta':
+                    self.meta = self._decode()
+                else:
+                    self.extra[key] = self._decode()
+        finally:
+            if self._response is not None:
+                self._response.close()
+
+    def _parse_items(self):
+        self._expect('[')
+        while True:
+            token = self._next_token()
+            if token == ']':
+                self._pos += 1
+                return
+            if token == ',':
+                self._pos += 1
+                continue
+            item = self._decode()
+            try:
+                data = item['data']
+            except (KeyError, TypeError):
+                raise exceptions.BaseCRMBadParameterFormat()
+            self.count += 1
+            if isinstance(data, dict):
+                self.last_id = data.get('id', self.last_id)
+            yield data
+
+    def _decode(self):
+        """
+        Decodes the JSON value starting at the current position, reading more of the body until
+        it is complete. A value running right up to the end of the buffer might be a truncated
+        number or literal, so we only trust it once there's more after it (or nothing left)
+        """
+        self._skip_whitespace()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self._buffer, self._pos)
+            except ValueError:
+                if not self._read():
+                    raise exceptions.BaseCRMUnexpectedResult(
+                        "BaseCRM API response body was truncated or is not valid JSON"
+                    )
+                continue
+            if end == len(self._buffer) and self._read():
+                continue
+            self._pos = end
+            return value
+
+    def _expect(self, char):
+        if self._next_token() != char:
+            raise exceptions.BaseCRMUnexpectedResult(
+                "Expected '%s' in BaseCRM API response body" % char
+            )
+        self._pos += 1
+
+    def _next_token(self):
+        self._skip_whitespace()
+        if self._pos >= len(self._buffer):
+            raise exceptions.BaseCRMUnexpectedResult(
+                "BaseCRM API response body ended unexpectedly"
+            )
+        return self._buffer[self._pos]
+
+    def _skip_whitespace(self):
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buffer) or not self._read():
+                return
+
+    def _read(self):
+        """
+        Appends the next chunk of the body to the buffer, dropping what's already been consumed.
+        Returns False once the body is exhausted
+        """
+        while not self._exhausted:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self._exhausted = True
+                text = self._decoder.decode(b'', final=True)
+            else:
+                text = self._decoder.decode(chunk)
+            if text:
+                self._buffer = self._buffer[self._pos:] + text
+                self._pos = 0
+                return True
+        return False
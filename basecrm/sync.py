@@ -0,0 +1,134 @@
+"""
+Wrappers for the BaseCRM Sync API (https://developers.getbase.com/docs/rest/articles/sync). A sync
+session is started for a device UUID, after which the API serves a queue of every change made
+across the account since that device last acknowledged. Items that are not acknowledged are served
+again in the next session, so the acks double as our checkpoint.
+"""
+import logging
+import time
+
+from . import exceptions, settings, utils
+
+logger = logging.getLogger(__name__)
+
+DEVICE_UUID_HEADER = 'X-Basecrm-Device-UUID'
+MAIN_QUEUE = 'main'
+QUEUES_LABEL = 'sync/queues'
+
+
+class Sync(object):
+    """
+    Streams the sync queue for a single device and dispatches each item to the handler registered
+    for its resource type (e.g. 'contact', 'deal', 'lead'). Handlers are called as
+    handler(event_type, data, meta); returning False leaves the item unacknowledged so it will be
+    served again, anything else acknowledges it.
+    """
+
+    def __init__(self, device_uuid=None, ack_batch_size=None):
+        self.device_uuid = device_uuid or settings.BASECRM_SYNC_DEVICE_UUID
+        if self.device_uuid is None:
+            raise exceptions.BaseCRMConfigurationError(
+                "A device UUID is required; pass one in or set BASECRM_SYNC_DEVICE_UUID"
+            )
+        self.ack_batch_size = ack_batch_size or settings.BASECRM_SYNC_ACK_BATCH_SIZE
+        self.handlers = {}
+        self._ack_keys = []
+
+    def register(self, resource_type, handler):
+        self.handlers[resource_type] = handler
+
+    def start(self):
+        """
+        Starts a new sync session. Returns the session dict, or None if there's nothing new for
+        this device
+        """
+        resp = utils.request(
+            utils.CREATE, 'sync/start', None, data={}, headers=self._build_headers()
+        )
+        if resp is None:
+            return None
+        return utils.parse(resp)
+
+    def fetch(self, session_id, queue=MAIN_QUEUE):
+        """
+        Generator over the items in a session's queue, yielding (data, meta) tuples. The next page
+        is only requested once the consumer has worked through the current one, so a slow consumer
+        holds back the fetching rather than items piling up in memory
+        """
+        endpoint = 'sync/%s/queues/%s' % (session_id, queue)
+        while True:
+            # every session has its own URL, but they're one endpoint for metrics and the breaker
+            resp = utils.request(
+                utils.RETRIEVE, endpoint, None, headers=self._build_headers(), label=QUEUES_LABEL
+            )
+            if resp is None or not resp.get('items'):
+                return
+            for item in resp['items']:
+                yield item['data'], item['meta']
+
+    def ack(self, ack_keys):
+        if ack_keys:
+            utils.request(
+                utils.CREATE,
+                'sync/ack',
+                None,
+                data={'ack_keys': list(ack_keys)},
+                headers=self._build_headers()
+            )
+
+    def flush(self):
+        """
+        Acknowledges everything handled so far
+        """
+        ack_keys, self._ack_keys = self._ack_keys, []
+        self.ack(ack_keys)
+
+    def dispatch(self, data, meta):
+        """
+        Runs the registered handler for the item and queues its ack key if it was handled. Items
+        with no registered handler are acknowledged, so unwanted resource types don't clog the queue
+        """
+        sync_meta = meta.get('sync', {})
+        handler = self.handlers.get(meta.get('type'))
+        if handler is None:
+            logger.debug("No BaseCRM sync handler registered for '%s' items" % meta.get('type'))
+            handled = True
+        else:
+            handled = handler(sync_meta.get('event_type'), data, meta) is not False
+
+        if handled and 'ack_key' in sync_meta:
+            self._ack_keys.append(sync_meta['ack_key'])
+            if len(self._ack_keys) >= self.ack_batch_size:
+                self.flush()
+        return handled
+
+    def run(self):
+        """
+        Starts a session and dispatches everything in its queue, acknowledging in batches. Acks for
+        items already handled are flushed even if a handler raises, so a restart picks up from the
+        first unhandled item. Returns the number of items processed
+        """
+        session = self.start()
+        if session is None:
+            return 0
+
+        processed = 0
+        try:
+            for data, meta in self.fetch(session['id']):
+                self.dispatch(data, meta)
+                processed += 1
+        finally:
+            self.flush()
+        return processed
+
+    def run_forever(self, interval=60):
+        """
+        Keeps a mirror continuously up to date: runs a session, and sleeps for `interval` seconds
+        whenever the queue has been drained
+        """
+        while True:
+            if self.run() == 0:
+                time.sleep(interval)
+
+    def _build_headers(self):
+        return {DEVICE_UUID_HEADER: self.device_uuid}
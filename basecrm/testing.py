@@ -0,0 +1,489 @@
+"""
+An in-process fake of the BaseCRM v2 API, for integration tests and benchmarks that need real HTTP:
+connection handling, pagination, throttling and concurrency. FakeBase is a WSGI application holding
+contacts, deals, leads, notes, pipelines, stages and users in memory, and can serve itself on a
+local port from a thread (speaking HTTP/1.1, so connections are kept alive between requests):
+
+    with FakeBase(latency=0.01, rate_limit=50) as fake, fake.configured():
+        fake.seed(contacts=500)
+        contacts = list(helpers.iter_contacts())
+
+Lists are paginated as the API does (page, per_page up to 100, sort_by, ids and field filters, with
+a total count in meta). Latency, random 429s and 5xxs, a requests-per-second rate limit and specific
+failures (fail_next) can all be configured, and .stats records what was asked of it.
+"""
+import contextlib
+import datetime
+import http.server
+import io
+import itertools
+import json
+import random
+import socketserver
+import sys
+import threading
+import time
+from urllib.parse import parse_qsl
+
+from . import client
+
+RESOURCES = {
+    'contacts': 'contact',
+    'deals': 'deal',
+    'leads': 'lead',
+    'notes': 'note',
+    'pipelines': 'pipeline',
+    'stages': 'stage',
+    'users': 'user',
+}
+MAX_PER_PAGE = 100
+STATUS_TEXT = {
+    200: 'OK',
+    204: 'No Content',
+    400: 'Bad Request',
+    401: 'Unauthorized',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    422: 'Unprocessable Entity',
+    429: 'Too Many Requests',
+    500: 'Internal Server Error',
+    502: 'Bad Gateway',
+    503: 'Service Unavailable',
+}
+
+
+class Stats(object):
+
+    def __init__(self):
+        self.requests = 0
+        self.connections = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.statuses = {}
+
+    def __repr__(self):
+        return '<Stats %s requests, %s connections, max %s in flight, %s>' % (
+            self.requests, self.connections, self.max_in_flight, self.statuses
+        )
+
+
+class FakeBase(object):
+
+    def __init__(self, latency=0, error_rate=0, throttle_rate=0, rate_limit=None, seed=None):
+        """
+        `latency` is seconds per request, or a (min, max) range; `error_rate` and `throttle_rate`
+        are the chances of a request failing with a 500 or a 429; `rate_limit` is requests per
+        second, beyond which requests get a 429; `seed` makes the random failures repeatable
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.rate_limit = rate_limit
+        self.random = random.Random(seed)
+        self.stats = Stats()
+        self.data = {resource: {} for resource in RESOURCES}
+        self._ids = itertools.count(1)
+        self._failures = []
+        self._lock = threading.Lock()
+        self._allowance = rate_limit or 0
+        self._last_check = time.monotonic()
+        self._server = None
+        self._thread = None
+        self._add_defaults()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    # -- data
+
+    def add(self, resource, **record):
+        """
+        Stores a record (with an ID, and timestamps, if not given) and returns it
+        """
+        with self._lock:
+            return self._store(resource, record)
+
+    def seed(self, contacts=0, deals=0, leads=0, notes=0):
+        """
+        Adds the given numbers of synthetic records
+        """
+        owners = list(self.data['users'])
+        stages = list(self.data['stages'])
+        contact_ids = []
+        for i in range(contacts):
+            contact_ids.append(self.add(
+                'contacts',
+                owner_id=owners[i % len(owners)],
+                is_organization=False,
+                first_name='First%s' % i,
+                last_name='Last%s' % i,
+                name='First%s Last%s' % (i, i),
+                email='contact%s@example.com' % i,
+                customer_status='none',
+                prospect_status='current',
+                tags=['tag%s' % (i % 5)],
+                custom_fields={'source': 'seed'},
+            )['id'])
+        for i in range(deals):
+            self.add(
+                'deals',
+                owner_id=owners[i % len(owners)],
+                name='Deal %s' % i,
+                value='%s.00' % (1000 + i % 50 * 100),
+                currency='GBP',
+                hot=i % 3 == 0,
+                stage_id=stages[i % len(stages)],
+                contact_id=contact_ids[i % len(contact_ids)] if contact_ids else None,
+                last_stage_change_at=_now(),
+                tags=[],
+                custom_fields={},
+            )
+        for i in range(leads):
+            self.add(
+                'leads',
+                owner_id=owners[i % len(owners)],
+                first_name='Lead%s' % i,
+                last_name='Person%s' % i,
+                organization_name='Organisation %s' % i,
+                status='New',
+                tags=[],
+                custom_fields={},
+            )
+        for i in range(notes):
+            self.add(
+                'notes',
+                resource_type='contact',
+                resource_id=contact_ids[i % len(contact_ids)] if contact_ids else None,
+                content='Note %s' % i,
+            )
+
+    def fail_next(self, status, count=1, resource=None):
+        """
+        Makes the next `count` requests (to `resource`, if given) fail with the given status
+        """
+        with self._lock:
+            self._failures.append([status, count, resource])
+
+    # -- serving
+
+    @property
+    def url(self):
+        """
+        The API URL to use as BASECRM_API_URL while serving
+        """
+        if self._server is None:
+            return None
+        return 'http://%s:%s/v2/' % self._server.server_address[:2]
+
+    def start(self, port=0):
+        self._server = _Server(('127.0.0.1', port), _Handler)
+        self._server.app = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = self._thread = None
+
+    @contextlib.contextmanager
+    def configured(self):
+        """
+        Installs a client (see client.py) pointed at this server for the duration of a with block
+        """
+        with client.use(client.BaseCRMClient(api_url=self.url)) as fake_client:
+            try:
+                yield self
+            finally:
+                fake_client.close()
+
+    # -- WSGI
+
+    def __call__(self, environ, start_response):
+        with self._lock:
+            self.stats.requests += 1
+            self.stats.in_flight += 1
+            self.stats.max_in_flight = max(self.stats.max_in_flight, self.stats.in_flight)
+        try:
+            status, body, headers = self._respond(environ)
+        except Exception as e:
+            status, body, headers = _error(500, 'server_error', repr(e))
+        finally:
+            with self._lock:
+                self.stats.in_flight -= 1
+                self.stats.statuses[status] = self.stats.statuses.get(status, 0) + 1
+        data = b'' if body is None else json.dumps(body).encode('utf-8')
+        headers = [('Content-Type', 'application/json'), ('Content-Length', str(len(data)))] + [
+            (k, str(v)) for k, v in headers.items()
+        ]
+        start_response('%s %s' % (status, STATUS_TEXT.get(status, '')), headers)
+        return [data]
+
+    def _respond(self, environ):
+        latency = self.latency
+        if isinstance(latency, (list, tuple)):
+            latency = self.random.uniform(*latency)
+        if latency:
+            time.sleep(latency)
+
+        method = environ['REQUEST_METHOD']
+        parts = environ.get('PATH_INFO', '').strip('/').split('/')
+        if not parts or parts[0] != 'v2':
+            return _error(404, 'not_found', "Unknown API version")
+        parts = parts[1:]
+        resource = parts[0] if parts else None
+        id = parts[1] if len(parts) > 1 else None
+
+        if not environ.get('HTTP_AUTHORIZATION', '').startswith('Bearer '):
+            return _error(401, 'unauthorized', "Missing or invalid access token")
+        throttled = self._throttle()
+        if throttled is not None:
+            return throttled
+        failure = self._injected_failure(resource)
+        if failure is not None:
+            return failure
+        if resource not in RESOURCES or len(parts) > 2:
+            return _error(404, 'not_found', "Resource not found")
+
+        params = dict(parse_qsl(environ.get('QUERY_STRING', '')))
+        body = None
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+        if length:
+            try:
+                body = json.loads(environ['wsgi.input'].read(length).decode('utf-8'))
+            except ValueError:
+                return _error(400, 'bad_request', "Body is not valid JSON")
+
+        with self._lock:
+            if method in ('GET', 'HEAD') and id is None:
+                return self._list(resource, params)
+            if method in ('GET', 'HEAD'):
+                return self._retrieve(resource, id)
+            if method == 'POST' and id is None:
+                return self._create(resource, body)
+            if method == 'PUT' and id is not None:
+                return self._update(resource, id, body)
+            if method == 'DELETE' and id is not None:
+                return self._delete(resource, id)
+        return _error(405, 'method_not_allowed', "Method not allowed")
+
+    def _list(self, resource, params):
+        try:
+            page = int(params.pop('page', 1))
+            per_page = min(int(params.pop('per_page', 25)), MAX_PER_PAGE)
+        except ValueError:
+            return _error(422, 'invalid', "page and per_page must be integers")
+        sort_by = params.pop('sort_by', 'id')
+        ids = params.pop('ids', None)
+
+        records = list(self.data[resource].values())
+        if ids:
+            wanted = set(int(i) for i in ids.split(','))
+            records = [r for r in records if r['id'] in wanted]
+        for key, value in params.items():
+            records = [r for r in records if _matches(r.get(key), value)]
+        field, _, order = sort_by.partition(':')
+        records.sort(key=lambda r: (r.get(field) is None, r.get(field)), reverse=order == 'desc')
+
+        start = (page - 1) * per_page
+        items = records[start:start + per_page]
+        links = {'self': '?page=%s&per_page=%s' % (page, per_page)}
+        if page > 1:
+            links['prev_page'] = '?page=%s&per_page=%s' % (page - 1, per_page)
+        if start + per_page < len(records):
+            links['next_page'] = '?page=%s&per_page=%s' % (page + 1, per_page)
+        return 200, {
+            'items': [{'data': r, 'meta': {'type': RESOURCES[resource]}} for r in items],
+            'meta': {'type': 'collection', 'count': len(items), 'links': links},
+        }, {}
+
+    def _retrieve(self, resource, id):
+        record = self._get(resource, id)
+        if record is None:
+            return _error(404, 'not_found', "Could not find %s %s" % (RESOURCES[resource], id))
+        return 200, {'data': record, 'meta': {'type': RESOURCES[resource]}}, {}
+
+    def _create(self, resource, body):
+        if not isinstance(body, dict) or not isinstance(body.get('data'), dict):
+            return _error(422, 'invalid', "Body must have a data object")
+        record = self._store(resource, dict(body['data'], id=None))
+        return 200, {'data': record, 'meta': {'type': RESOURCES[resource]}}, {}
+
+    def _update(self, resource, id, body):
+        record = self._get(resource, id)
+        if record is None:
+            return _error(404, 'not_found', "Could not find %s %s" % (RESOURCES[resource], id))
+        if not isinstance(body, dict) or not isinstance(body.get('data'), dict):
+            return _error(422, 'invalid', "Body must have a data object")
+        record.update((k, v) for k, v in body['data'].items() if k != 'id')
+        record['updated_at'] = _now()
+        return 200, {'data': record, 'meta': {'type': RESOURCES[resource]}}, {}
+
+    def _delete(self, resource, id):
+        if self._get(resource, id) is None:
+            return _error(404, 'not_found', "Could not find %s %s" % (RESOURCES[resource], id))
+        del self.data[resource][int(id)]
+        return 204, None, {}
+
+    def _get(self, resource, id):
+        try:
+            return self.data[resource].get(int(id))
+        except ValueError:
+            return None
+
+    def _store(self, resource, record):
+        if record.get('id') is None:
+            record['id'] = next(self._ids)
+        now = _now()
+        record.setdefault('created_at', now)
+        record.setdefault('updated_at', now)
+        record.setdefault('creator_id', next(iter(self.data['users']), None))
+        self.data[resource][record['id']] = record
+        return record
+
+    def _throttle(self):
+        with self._lock:
+            if self.rate_limit:
+                now = time.monotonic()
+                self._allowance = min(
+                    self.rate_limit, self._allowance + (now - self._last_check) * self.rate_limit
+                )
+                self._last_check = now
+                if self._allowance < 1:
+                    return _rate_limited(self.rate_limit, 0)
+                self._allowance -= 1
+            throttle = self.throttle_rate and self.random.random() < self.throttle_rate
+            error = self.error_rate and self.random.random() < self.error_rate
+        if throttle:
+            return _rate_limited(self.rate_limit or 0, 0)
+        if error:
+            return _error(500, 'server_error', "Injected server error")
+        return None
+
+    def _injected_failure(self, resource):
+        with self._lock:
+            for failure in self._failures:
+                status, count, only = failure
+                if only is None or only == resource:
+                    failure[1] -= 1
+                    if failure[1] <= 0:
+                        self._failures.remove(failure)
+                    if status == 429:
+                        return _rate_limited(self.rate_limit or 0, 0)
+                    return _error(status, 'injected', "Injected failure")
+        return None
+
+    def _add_defaults(self):
+        self.add('users', name='Fake Admin', email='admin@example.com', status='active',
+                 role='admin', confirmed=True)
+        self.add('users', name='Fake User', email='user@example.com', status='active',
+                 role='user', confirmed=True)
+        pipeline = self.add('pipelines', name='Sales Pipeline')
+        for position, (name, category, likelihood) in enumerate([
+            ('Incoming', 'incoming', 10),
+            ('Qualified', 'in_progress', 25),
+            ('Quote', 'in_progress', 50),
+            ('Closure', 'in_progress', 75),
+            ('Won', 'won', 100),
+            ('Lost', 'lost', 0),
+        ], 1):
+            self.add(
+                'stages',
+                name=name,
+                category=category,
+                likelihood=likelihood,
+                position=position,
+                pipeline_id=pipeline['id'],
+                active=category not in ('won', 'lost'),
+            )
+
+
+class _Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def handle_error(self, request, client_address):
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            # the client gave up waiting, e.g. on a timeout
+            return
+        super(_Server, self).handle_error(request, client_address)
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves the server's WSGI app over HTTP/1.1, keeping connections alive
+    """
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately; don't let Nagle hold the body back on a kept-alive
+    # connection
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super(_Handler, self).setup()
+        app = self.server.app
+        with app._lock:
+            app.stats.connections += 1
+
+    def do_request(self):
+        path, _, query = self.path.partition('?')
+        length = self.headers.get('Content-Length') or '0'
+        environ = {
+            'REQUEST_METHOD': self.command,
+            'PATH_INFO': path,
+            'QUERY_STRING': query,
+            'CONTENT_LENGTH': length,
+            'wsgi.input': io.BytesIO(self.rfile.read(int(length))),
+        }
+        for key, value in self.headers.items():
+            environ['HTTP_%s' % key.upper().replace('-', '_')] = value
+        response = {}
+
+        def start_response(status, headers):
+            response['status'], response['headers'] = status, headers
+
+        body = b''.join(self.server.app(environ, start_response))
+        code, _, reason = response['status'].partition(' ')
+        self.send_response(int(code), reason)
+        for key, value in response['headers']:
+            self.send_header(key, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = do_request
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _error(status, code, details):
+    return status, {
+        'errors': [{'error': {'code': code, 'message': details, 'details': details}}],
+        'meta': {'type': 'errors', 'http_status': '%s %s' % (status, STATUS_TEXT.get(status, ''))},
+    }, {}
+
+
+def _rate_limited(limit, remaining):
+    status, body, headers = _error(429, 'rate_limit_exceeded', "Rate limit exceeded")
+    return status, body, {
+        'X-RateLimit-Limit': int(limit),
+        'X-RateLimit-Remaining': remaining,
+        'Retry-After': 1,
+    }
+
+
+def _matches(value, wanted):
+    if isinstance(value, bool):
+        return str(value).lower() == wanted.lower()
+    return str(value) in wanted.split(',')
+
+
+def _now():
+    return datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
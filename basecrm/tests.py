@@ -1,73 +1,120 @@
+import csv
+import datetime
+import gzip
+import importlib.util
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
 import types
-from unittest import mock
+from decimal import Decimal
+from unittest import mock, skipUnless
+
+import requests
 
 from django.apps import apps as django_apps
-from django.test import TestCase
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.http import Http404
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import resolve
 from django.db.models.base import ModelBase
 
 from . import (   # noqa apps used for patching
+    analytics,
     apps,
+    batch,
+    breaker,
+    cache,
+    client,
+    codec,
+    columnar,
+    deadline,
     exceptions,
+    exports,
+    hedging,
     helpers,
+    imports,
+    lanes,
+    limits,
+    metrics,
+    mirror,
+    models,
+    reconcile,
+    records,
     serializers,
     settings,
-    utils
+    signals,
+    streaming,
+    sync,
+    testing,
+    tracing,
+    transport,
+    utils,
+    views,
+    webhooks
 )
+from .mirror import models as mirror_models
+
+HAS_ORJSON = importlib.util.find_spec('orjson') is not None
+HAS_NUMPY = importlib.util.find_spec('numpy') is not None
 
 
 class RequestWrapperTests(TestCase):
 
-    @mock.patch('basecrm.utils.settings')
-    def test_build_api_endpoint(self, settings):
+    def test_build_api_endpoint(self):
         # bad api_urls aren't handled - caveat emptor
-        settings.BASECRM_API_URL = 'api.base.com'
+        base = client.BaseCRMClient(api_url='api.base.com')
         params = None
         endpoint = 'contacts'
-        result = utils._build_api_endpoint(endpoint, params)
+        result = base.build_url(endpoint, params)
         self.assertEqual(result, 'api.base.comcontacts')
 
-        settings.BASECRM_API_URL = 'http://api.base.com/test'
+        base = client.BaseCRMClient(api_url='http://api.base.com/test')
         params = None
         endpoint = 'contacts'
-        result = utils._build_api_endpoint(endpoint, params)
+        result = base.build_url(endpoint, params)
         self.assertEqual(result, 'http://api.base.com/testcontacts')
 
-        settings.BASECRM_API_URL = 'http://api.base.com/test/'
-
+        base = client.BaseCRMClient(api_url='http://api.base.com/test/')
         params = None
         endpoint = 'contacts'
-        result = utils._build_api_endpoint(endpoint, params)
+        result = base.build_url(endpoint, params)
         self.assertEqual(result, 'http://api.base.com/test/contacts')
 
         params = {'id': 34}
         endpoint = 'contacts'
-        result = utils._build_api_endpoint(endpoint, params)
+        result = base.build_url(endpoint, params)
         self.assertEqual(result, 'http://api.base.com/test/contacts/34')
 
         # only id params are used, and then only to add to the endpoint
         params = {'hello': 'world'}
         endpoint = 'contacts'
-        result = utils._build_api_endpoint(endpoint, params)
+        result = base.build_url(endpoint, params)
         self.assertEqual(result, 'http://api.base.com/test/contacts')
 
         params = {'hello': 'world', 'id': 34}
         endpoint = 'contacts'
-        result = utils._build_api_endpoint(endpoint, params)
+        result = base.build_url(endpoint, params)
         self.assertEqual(result, 'http://api.base.com/test/contacts/34')
 
         # but they're also not inspected - caveat emptor
         params = {'hello': 'world', 'id': 'world'}
         endpoint = 'contacts'
-        result = utils._build_api_endpoint(endpoint, params)
+        result = base.build_url(endpoint, params)
         self.assertEqual(result, 'http://api.base.com/test/contacts/world')
 
-    @mock.patch('basecrm.utils.settings')
-    def test_build_headers(self, settings):
-        settings.BASECRM_API_KEY = 'an-api_key/that1s4lphaNuMer1c'
-        settings.BASECRM_USER_AGENT = 'yourApp/1.0'
+    def test_build_headers(self):
+        base = client.BaseCRMClient(
+            api_key='an-api_key/that1s4lphaNuMer1c', user_agent='yourApp/1.0'
+        )
 
         extras = None
-        result = utils._build_headers(extras)
+        result = base.build_headers(extras)
         self.assertEqual(
             result,
             {
@@ -81,7 +128,7 @@ class RequestWrapperTests(TestCase):
         extras = {
             'X-Custom-Header': 'test value'
         }
-        result = utils._build_headers(extras)
+        result = base.build_headers(extras)
         self.assertEqual(
             result,
             {
@@ -96,7 +143,7 @@ class RequestWrapperTests(TestCase):
         extras = {
             'Accept': 'text/html'
         }
-        result = utils._build_headers(extras)
+        result = base.build_headers(extras)
         self.assertEqual(
             result,
             {
@@ -114,7 +161,7 @@ class RequestWrapperTests(TestCase):
             'User-Agent': 'yourApp/2.0',
             'X-Custom-Header': 'test value'
         }
-        result = utils._build_headers(extras)
+        result = base.build_headers(extras)
         self.assertEqual(
             result,
             {
@@ -126,14 +173,14 @@ class RequestWrapperTests(TestCase):
             }
         )
 
-    @mock.patch('basecrm.utils.requests')
-    @mock.patch('basecrm.utils._build_api_endpoint')
-    @mock.patch('basecrm.utils._build_headers')
-    def test_request_wrapper(self, _b_headers, _b_endpoint, requests):
+    @mock.patch('basecrm.transport.RequestsTransport.send')
+    @mock.patch('basecrm.client.BaseCRMClient.build_url')
+    @mock.patch('basecrm.client.BaseCRMClient.build_headers')
+    def test_request_wrapper(self, _b_headers, _b_endpoint, send):
         response = mock.Mock()
         response.status_code = 200
         response.url = 'http://google.com/q=helloworld'
-        requests.request.return_value = response
+        send.return_value = response
         _b_headers.return_value = {'Accept': 'application/json', 'User-Agent': 'Test'}
         _b_endpoint.return_value = 'http://google.com/'
 
@@ -145,16 +192,17 @@ class RequestWrapperTests(TestCase):
         self.assertEqual(result, response)
         _b_headers.assert_called_once_with(None)
         _b_endpoint.assert_called_once_with(endpoint, get_params)
-        requests.request.assert_called_once_with(
+        send.assert_called_once_with(
             method,
             _b_endpoint.return_value,
             headers=_b_headers.return_value,
-            params=get_params
+            params=get_params,
+            timeout=client.get_client().timeout
         )
 
         _b_headers.reset_mock()
         _b_endpoint.reset_mock()
-        requests.request.reset_mock()
+        send.reset_mock()
 
         method = 'POST'
         endpoint = 'http://api.base.com/deals'
@@ -168,16 +216,17 @@ class RequestWrapperTests(TestCase):
         self.assertEqual(result, response)
         _b_headers.assert_called_once_with({'Accept': 'plain/txt', 'User-Agent': 'BaseCRM Client'})
         _b_endpoint.assert_called_once_with(endpoint, get_params)
-        requests.request.assert_called_once_with(
+        send.assert_called_once_with(
             method,
             _b_endpoint.return_value,
             headers=_b_headers.return_value,
-            params=get_params
+            params=get_params,
+            timeout=client.get_client().timeout
         )
 
         _b_headers.reset_mock()
         _b_endpoint.reset_mock()
-        requests.request.reset_mock()
+        send.reset_mock()
 
         method = 'POST'
         endpoint = 'http://api.base.com/deals'
@@ -192,11 +241,12 @@ class RequestWrapperTests(TestCase):
         self.assertEqual(result, response)
         _b_headers.assert_called_once_with({'Accept': 'plain/txt'})
         _b_endpoint.assert_called_once_with(endpoint, get_params)
-        requests.request.assert_called_once_with(
+        send.assert_called_once_with(
             method,
             _b_endpoint.return_value,
             headers=_b_headers.return_value,
             params=get_params,
+            timeout=client.get_client().timeout,
             some_other_requests_param=87
         )
 
@@ -448,6 +498,43 @@ class ValidationTests(TestCase):
         result = utils.validate_deal_dict(operation, deal_dict)
         self.assertTrue(result)
 
+    def test_validate_many(self):
+        contacts = [
+            {'first_name': 'Robert', 'last_name': 'Oppenheimer'},
+            {'first_name': 'Leslie'},
+            {'is_organization': True, 'name': 'Los Alamos'},
+            {'is_organization': False, 'name': 'Los Alamos'},
+            {'is_organization': 'yes', 'first_name': 'Robert', 'last_name': 'Oppenheimer'},
+        ]
+        failures = utils.validate_many('contact', utils.CREATE, contacts)
+        self.assertEqual([i for i, msg in failures], [1, 3, 4])
+        self.assertEqual(failures[0][1], (
+            "Parameters fail BaseCRM API requirements for contact. If 'is_organization'==True, "
+            "'name' is required, otherwise 'first_name' and 'last_name' are all required; "
+            "fields supplied were: first_name"
+        ))
+        self.assertEqual(utils.validate_many('lead', utils.UPDATE, [{'id': 1}]), [])
+        self.assertEqual(utils.validate_many('lead', utils.UPDATE, [{}], skip_id=True), [])
+        self.assertEqual(len(utils.validate_many('lead', utils.UPDATE, [{}, {}])), 2)
+
+        # the single validators give the same messages
+        with self.assertRaises(exceptions.BaseCRMValidationError) as cm:
+            utils.validate_contact_dict(utils.CREATE, contacts[1])
+        self.assertEqual(str(cm.exception), failures[0][1])
+        with self.assertRaises(exceptions.BaseCRMValidationError) as cm:
+            utils.validate_lead_dict(utils.CREATE, {})
+        self.assertIn('requirements for lead', str(cm.exception))
+
+    def test_get_schema(self):
+        schema = utils.get_schema('deal', utils.UPDATE)
+        self.assertIs(utils.get_schema('deal', utils.UPDATE, skip_id=True), schema.without('id'))
+        with self.assertRaises(exceptions.BaseCRMBadParameterFormat):
+            utils.get_schema('note', utils.CREATE)
+        with self.assertRaises(exceptions.BaseCRMValidationError):
+            utils.get_schema('deal', utils.DELETE)
+        with self.assertRaises(exceptions.BaseCRMValidationError):
+            utils.validate_deal_dict(utils.RETRIEVE, {'id': 1})
+
 
 class UtilityMethodTests(TestCase):
 
@@ -517,11 +604,37 @@ class UtilityMethodTests(TestCase):
         result = utils.parse(response_dict)
         self.assertEqual(result, {'name': 'hello'})
 
+    @mock.patch('basecrm.utils.request')
+    @mock.patch('basecrm.utils.settings')
+    def test_paginate(self, utils_settings, request):
+        utils_settings.BASECRM_PER_PAGE = 2
+        request.side_effect = [
+            {'items': [{'data': {'id': 1}}, {'data': {'id': 2}}], 'meta': {}},
+            {'items': [{'data': {'id': 3}}], 'meta': {}},
+        ]
+        result = list(utils.paginate('contacts', {'email': 'a@b.com'}))
+        self.assertEqual(result, [[{'id': 1}, {'id': 2}], [{'id': 3}]])
+        self.assertEqual(request.call_args_list, [
+            mock.call(utils.RETRIEVE, 'contacts', {'email': 'a@b.com', 'per_page': 2, 'page': 1}),
+            mock.call(utils.RETRIEVE, 'contacts', {'email': 'a@b.com', 'per_page': 2, 'page': 2}),
+        ])
+
+        # an exactly full last page means one extra (empty) request, which yields nothing
+        request.reset_mock()
+        request.side_effect = [
+            {'items': [{'data': {'id': 3}}, {'data': {'id': 4}}], 'meta': {}},
+            {'items': [], 'meta': {}},
+        ]
+        result = list(utils.paginate('contacts', {'page': 2}, per_page=2))
+        self.assertEqual(result, [[{'id': 3}, {'id': 4}]])
+        self.assertEqual(request.call_args_list[0][0][2]['page'], 2)
+
     @mock.patch('basecrm.utils._request')
     def test_request(self, _request):
         response = mock.Mock()
         response.status_code = 200
-        response.json.return_value = {'items': [], 'meta': {}}
+        payload = {'items': [], 'meta': {}}
+        response.content = json.dumps(payload).encode('utf-8')
         _request.return_value = response
 
         # test all the pre-send validation
@@ -540,62 +653,48 @@ class UtilityMethodTests(TestCase):
 
         action = utils.RETRIEVE
         result = utils.request(action, endpoint, get_params, **kwargs)
-        self.assertEqual(result, response.json.return_value)
-        response.json.assert_called_once()
+        self.assertEqual(result, payload)
 
-        response.json.reset_mock()
         action = utils.INFO
         result = utils.request(action, endpoint, get_params, **kwargs)
-        self.assertEqual(result, response.json.return_value)
-        response.json.assert_called_once()
+        self.assertEqual(result, payload)
 
-        response.json.reset_mock()
         action = utils.DELETE
         result = utils.request(action, endpoint, get_params, **kwargs)
-        self.assertEqual(result, response.json.return_value)
-        response.json.assert_called_once()
+        self.assertEqual(result, payload)
 
-        response.json.reset_mock()
         action = utils.CREATE
         with self.assertRaises(exceptions.BaseCRMBadParameterFormat):
             utils.request(action, endpoint, get_params, **kwargs)
 
-        response.json.reset_mock()
         action = utils.UPDATE
         with self.assertRaises(exceptions.BaseCRMBadParameterFormat):
             utils.request(action, endpoint, get_params, **kwargs)
 
         kwargs['data'] = {}
 
-        response.json.reset_mock()
         action = utils.CREATE
         result = utils.request(action, endpoint, get_params, **kwargs)
-        self.assertEqual(result, response.json.return_value)
-        response.json.assert_called_once()
+        self.assertEqual(result, payload)
 
-        response.json.reset_mock()
         action = utils.UPDATE
         result = utils.request(action, endpoint, get_params, **kwargs)
-        self.assertEqual(result, response.json.return_value)
-        response.json.assert_called_once()
+        self.assertEqual(result, payload)
 
         # test the param logic
 
         _request.reset_mock()
-        response.json.reset_mock()
         action = utils.UPDATE
         result = utils.request(action, endpoint, get_params, **kwargs)
-        self.assertEqual(result, response.json.return_value)
+        self.assertEqual(result, payload)
         _request.assert_called_once_with(
             utils.VERBS[action],
             endpoint,
             get_params,
             json={'data': {}}
         )
-        response.json.assert_called_once()
 
         _request.reset_mock()
-        response.json.reset_mock()
         action = utils.CREATE
         kwargs = {
             'data': {'serialized_id': 98},
@@ -603,7 +702,7 @@ class UtilityMethodTests(TestCase):
             'other_param_for_requests_lib': True
         }
         result = utils.request(action, endpoint, get_params, **kwargs)
-        self.assertEqual(result, response.json.return_value)
+        self.assertEqual(result, payload)
         _request.assert_called_once_with(
             utils.VERBS[action],
             endpoint,
@@ -612,13 +711,12 @@ class UtilityMethodTests(TestCase):
             headers={'Accept': 'text/plain'},
             other_param_for_requests_lib=True
         )
-        response.json.assert_called_once()
 
-        response.json.return_value = {'errors': [{'error': {'details': 'test error message'}}]}
+        payload = {'errors': [{'error': {'details': 'test error message'}}]}
+        response.content = json.dumps(payload).encode('utf-8')
         response.status_code = 401
 
         _request.reset_mock()
-        response.json.reset_mock()
         action = utils.RETRIEVE
         kwargs = {}
         with self.assertRaises(exceptions.BaseCRMAPIUnauthorized):
@@ -627,7 +725,6 @@ class UtilityMethodTests(TestCase):
         response.status_code = 403
 
         _request.reset_mock()
-        response.json.reset_mock()
         action = utils.RETRIEVE
         kwargs = {}
         with self.assertRaises(Exception):
@@ -636,7 +733,6 @@ class UtilityMethodTests(TestCase):
         response.status_code = 404
 
         _request.reset_mock()
-        response.json.reset_mock()
         action = utils.RETRIEVE
         kwargs = {}
         with self.assertRaises(Exception):
@@ -646,7 +742,6 @@ class UtilityMethodTests(TestCase):
         get_params = {'id': 99}
 
         _request.reset_mock()
-        response.json.reset_mock()
         action = utils.RETRIEVE
         kwargs = {}
         with self.assertRaises(exceptions.BaseCRMNoResult):
@@ -656,12 +751,28 @@ class UtilityMethodTests(TestCase):
         get_params = None
 
         _request.reset_mock()
-        response.json.reset_mock()
         action = utils.RETRIEVE
         kwargs = {}
         with self.assertRaises(exceptions.BaseCRMValidationError):
             utils.request(action, endpoint, get_params, **kwargs)
 
+        # other 2xx codes are successes; those without a body give back None
+
+        payload = {'data': {'id': 'abc'}, 'meta': {}}
+        response.content = json.dumps(payload).encode('utf-8')
+        response.status_code = 201
+        result = utils.request(utils.CREATE, 'sync/start', None, data={})
+        self.assertEqual(result, payload)
+
+        response.status_code = 204
+        result = utils.request(utils.RETRIEVE, endpoint, None)
+        self.assertEqual(result, None)
+
+        response.status_code = 202
+        response.content = b''
+        result = utils.request(utils.CREATE, 'sync/ack', None, data={'ack_keys': ['a']})
+        self.assertEqual(result, None)
+
 
 class HelperMethodTests(TestCase):
 
@@ -686,6 +797,13 @@ class HelperMethodTests(TestCase):
         request.assert_called_once_with(utils.RETRIEVE, 'contacts', {'id': 456, 'hello': 'world'})
         parse.assert_called_once_with(request.return_value)
 
+    @mock.patch('basecrm.utils.paginate')
+    def test_iter_contacts(self, paginate):
+        paginate.return_value = iter([[{'id': 1}, {'id': 2}], [{'id': 3}]])
+        result = list(helpers.iter_contacts(email='a@b.com'))
+        self.assertEqual(result, [{'id': 1}, {'id': 2}, {'id': 3}])
+        paginate.assert_called_once_with('contacts', {'email': 'a@b.com'})
+
     @mock.patch('basecrm.utils.validate_contact_dict')
     @mock.patch('basecrm.utils.request')
     @mock.patch('basecrm.utils.parse')
@@ -1538,6 +1656,7 @@ class AppMethodTests(TestCase):
     @mock.patch('basecrm.apps.settings')
     @mock.patch('basecrm.apps.BaseCRMConfig.instantiate_objects')
     def test_ready(self, instantiate_objects, app_settings):
+        app_settings.BASECRM_METRICS = False
         app_settings.BASECRM_CACHE_AT_STARTUP = False
         self.base_app.ready()
         self.assertEqual(instantiate_objects.call_count, 0)
@@ -1638,3 +1757,2628 @@ class AppMethodTests(TestCase):
         get_pipelines.assert_called_once_with(True)
         get_stages.assert_called_once_with(True)
         get_users.assert_called_once_with(True)
+
+
+class SyncTests(TestCase):
+
+    def setUp(self):
+        self.sync = sync.Sync('device-1', ack_batch_size=2)
+        self.headers = {sync.DEVICE_UUID_HEADER: 'device-1'}
+
+    def _item(self, resource_type, id, ack_key, event_type='updated'):
+        return {
+            'data': {'id': id},
+            'meta': {
+                'type': resource_type,
+                'sync': {'event_type': event_type, 'ack_key': ack_key, 'revision': 1}
+            }
+        }
+
+    @mock.patch('basecrm.sync.settings')
+    def test_init(self, sync_settings):
+        sync_settings.BASECRM_SYNC_DEVICE_UUID = None
+        with self.assertRaises(exceptions.BaseCRMConfigurationError):
+            sync.Sync()
+
+        sync_settings.BASECRM_SYNC_DEVICE_UUID = 'from-settings'
+        sync_settings.BASECRM_SYNC_ACK_BATCH_SIZE = 50
+        s = sync.Sync()
+        self.assertEqual(s.device_uuid, 'from-settings')
+        self.assertEqual(s.ack_batch_size, 50)
+
+    @mock.patch('basecrm.utils.request')
+    def test_start(self, request):
+        request.return_value = None
+        self.assertEqual(self.sync.start(), None)
+        request.assert_called_once_with(
+            utils.CREATE, 'sync/start', None, data={}, headers=self.headers
+        )
+
+        request.return_value = {'data': {'id': 'session-1', 'queues': []}, 'meta': {}}
+        self.assertEqual(self.sync.start(), {'id': 'session-1', 'queues': []})
+
+    @mock.patch('basecrm.utils.request')
+    def test_fetch(self, request):
+        request.side_effect = [
+            {'items': [self._item('contact', 1, 'a'), self._item('deal', 2, 'b')]},
+            {'items': [self._item('lead', 3, 'c')]},
+            None,
+        ]
+        result = list(self.sync.fetch('session-1'))
+        self.assertEqual([data['id'] for data, meta in result], [1, 2, 3])
+        self.assertEqual(request.call_count, 3)
+        request.assert_called_with(
+            utils.RETRIEVE, 'sync/session-1/queues/main', None, headers=self.headers,
+            label='sync/queues'
+        )
+
+    @mock.patch('basecrm.transport.RequestsTransport.send')
+    def test_fetch_label(self, send):
+        send.return_value = mock.Mock(status_code=204, content=b'', url='')
+        collector = metrics.Collector()
+        collector.connect()
+        self.addCleanup(collector.disconnect)
+        base = client.BaseCRMClient(breakers=breaker.Breakers())
+        with client.use(base):
+            for session_id in ['session-1', 'session-2']:
+                list(self.sync.fetch(session_id))
+        self.assertEqual(
+            [c[0][1] for c in send.call_args_list], [
+                settings.BASECRM_API_URL + 'sync/session-1/queues/main',
+                settings.BASECRM_API_URL + 'sync/session-2/queues/main',
+            ]
+        )
+        # one set of stats and one breaker for every session
+        self.assertEqual(list(collector.snapshot()), ['GET sync/queues'])
+        self.assertEqual(collector.snapshot()['GET sync/queues']['requests'], 2)
+        self.assertEqual(base.breakers.states(), {'sync/queues': 'closed'})
+
+    @mock.patch('basecrm.utils.request')
+    def test_run(self, request):
+        contact_handler = mock.Mock(return_value=None)
+        deal_handler = mock.Mock(return_value=False)
+        self.sync.register('contact', contact_handler)
+        self.sync.register('deal', deal_handler)
+        request.side_effect = [
+            {'data': {'id': 'session-1'}, 'meta': {}},
+            {'items': [
+                self._item('contact', 1, 'a', 'created'),
+                self._item('deal', 2, 'b'),
+                self._item('lead', 3, 'c'),
+            ]},
+            None,  # ack of 'a' and 'c'
+            {'items': [self._item('contact', 4, 'd', 'deleted')]},
+            None,  # end of the queue
+            None,  # final ack of 'd'
+        ]
+
+        self.assertEqual(self.sync.run(), 4)
+        contact_handler.assert_any_call('created', {'id': 1}, mock.ANY)
+        contact_handler.assert_any_call('deleted', {'id': 4}, mock.ANY)
+        deal_handler.assert_called_once_with('updated', {'id': 2}, mock.ANY)
+        ack_calls = [c for c in request.call_args_list if c[0][1] == 'sync/ack']
+        self.assertEqual(
+            [c[1]['data'] for c in ack_calls],
+            [{'ack_keys': ['a', 'c']}, {'ack_keys': ['d']}]
+        )
+
+        # nothing to sync
+        request.reset_mock()
+        request.side_effect = None
+        request.return_value = None
+        self.assertEqual(self.sync.run(), 0)
+        request.assert_called_once()
+
+    @mock.patch('basecrm.utils.request')
+    def test_run_flushes_on_error(self, request):
+        self.sync.register('contact', mock.Mock(side_effect=[None, ValueError()]))
+        request.side_effect = [
+            {'data': {'id': 'session-1'}, 'meta': {}},
+            {'items': [self._item('contact', 1, 'a'), self._item('contact', 2, 'b')]},
+            None,
+        ]
+        with self.assertRaises(ValueError):
+            self.sync.run()
+        request.assert_called_with(
+            utils.CREATE, 'sync/ack', None, data={'ack_keys': ['a']}, headers=self.headers
+        )
+
+
+class MirrorTests(TestCase):
+
+    def _deal(self, id, **kwargs):
+        deal = {
+            'id': id,
+            'owner_id': 10,
+            'name': 'Deal %s' % id,
+            'value': '1500.50',
+            'currency': 'GBP',
+            'stage_id': 7,
+            'updated_at': '2017-06-01T10:00:00Z',
+            'custom_fields': {'source': 'web'},
+        }
+        deal.update(kwargs)
+        return deal
+
+    def test_from_record(self):
+        contact = mirror_models.Contact.from_record({
+            'id': 5,
+            'owner_id': 10,
+            'email': 'a@b.com',
+            'first_name': 'Ada',
+            'last_name': 'Lovelace',
+            'created_at': '2017-06-01T10:00:00Z',
+            'address': {'city': 'London'},
+        })
+        self.assertEqual(contact.id, 5)
+        self.assertEqual(contact.email, 'a@b.com')
+        self.assertEqual(contact.name, None)
+        self.assertEqual(contact.created_at.year, 2017)
+        self.assertEqual(contact.record['address'], {'city': 'London'})
+
+        deal = mirror_models.Deal.from_record(self._deal(1, value=None))
+        self.assertEqual(deal.value, None)
+        deal = mirror_models.Deal.from_record(self._deal(1, value=250))
+        self.assertEqual(str(deal.value), '250')
+
+    def test_upsert(self):
+        Deal = mirror_models.Deal
+        self.assertEqual(mirror.upsert(Deal, [self._deal(1), self._deal(2)]), 2)
+        self.assertEqual(mirror.upsert(Deal, [self._deal(2, stage_id=8), self._deal(3)]), 2)
+        self.assertEqual(mirror.upsert(Deal, []), 0)
+
+        self.assertEqual(Deal.objects.count(), 3)
+        self.assertEqual(
+            list(Deal.objects.filter(stage_id=7, owner_id=10).values_list('id', flat=True)),
+            [1, 3]
+        )
+        self.assertEqual(Deal.objects.get(id=2).record['stage_id'], 8)
+
+        self.assertEqual(mirror.delete(Deal, [1, 99]), 1)
+        self.assertEqual(Deal.objects.count(), 2)
+
+    def test_upsert_older(self):
+        Deal = mirror_models.Deal
+        newer = self._deal(1, stage_id=8, updated_at='2017-06-02T10:00:00Z')
+        self.assertEqual(mirror.upsert(Deal, [newer]), 1)
+        # a stale copy, e.g. a retried webhook, is skipped
+        self.assertEqual(mirror.upsert(Deal, [self._deal(1), self._deal(2)]), 1)
+        self.assertEqual(Deal.objects.get(id=1).stage_id, 8)
+        # as is the older of two copies in the same page, in either order
+        self.assertEqual(mirror.upsert(Deal, [self._deal(3), self._deal(3, stage_id=9)]), 1)
+        self.assertEqual(Deal.objects.get(id=3).stage_id, 9)
+        older = self._deal(2, stage_id=9, updated_at='2017-05-01T10:00:00Z')
+        self.assertEqual(mirror.upsert(Deal, [newer, self._deal(1), older]), 1)
+        self.assertEqual(Deal.objects.get(id=2).stage_id, 7)
+        self.assertIs(mirror.newest(newer, self._deal(1)), newer)
+        self.assertIs(mirror.newest(None, newer), newer)
+
+    @mock.patch('basecrm.utils.paginate')
+    def test_load(self, paginate):
+        paginate.return_value = iter([[self._deal(1), self._deal(2)], [self._deal(3)]])
+        self.assertEqual(mirror.load_deals(stage_id=7), 3)
+        paginate.assert_called_once_with('deals', {'stage_id': 7})
+        self.assertEqual(mirror_models.Deal.objects.count(), 3)
+
+        paginate.reset_mock()
+        paginate.return_value = iter([[{'id': 9, 'email': 'x@y.com'}]])
+        self.assertEqual(mirror.load_leads(), 1)
+        paginate.assert_called_once_with('leads', {})
+        self.assertEqual(mirror_models.Lead.objects.get(email='x@y.com').id, 9)
+
+    def test_sync_handler(self):
+        handler = mirror.sync_handler(mirror_models.Contact)
+        handler('created', {'id': 1, 'email': 'a@b.com'}, {})
+        handler('updated', {'id': 1, 'email': 'c@d.com'}, {})
+        self.assertEqual(mirror_models.Contact.objects.get(id=1).email, 'c@d.com')
+        handler('deleted', {'id': 1}, {})
+        self.assertFalse(mirror_models.Contact.objects.exists())
+
+
+@mock.patch('basecrm.settings.BASECRM_RESPONSE_CACHE_TIMEOUT', 60)
+class ResponseCacheTests(TestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        self.response = mock.Mock()
+        self.response.status_code = 200
+        self.response.content = b'{"data": {"id": 5}, "meta": {}}'
+
+    def test_make_key(self):
+        self.assertEqual(cache.make_key('contacts', {'id': 5}), 'basecrm:contacts:5')
+        self.assertEqual(cache.make_key('contacts', {'id': 5, 'email': 'a@b.com'}), None)
+        self.assertEqual(cache.make_key('sync/start', None), None)
+
+        key = cache.make_key('contacts', {'email': 'a@b.com', 'page': 1})
+        self.assertEqual(key, cache.make_key('contacts', {'page': 1, 'email': 'a@b.com'}))
+        self.assertNotEqual(key, cache.make_key('contacts', {'page': 2, 'email': 'a@b.com'}))
+        self.assertNotEqual(key, cache.make_key('deals', {'page': 1, 'email': 'a@b.com'}))
+
+    def test_invalidate(self):
+        record_key = cache.make_key('contacts', {'id': 5})
+        list_key = cache.make_key('contacts', {'page': 1})
+        cache.set(record_key, 'record')
+        cache.set(list_key, 'list')
+        cache.set(cache.make_key('contacts', {'id': 6}), 'other')
+
+        cache.invalidate('contacts', [5])
+        self.assertEqual(cache.get(record_key), None)
+        self.assertEqual(cache.get(cache.make_key('contacts', {'id': 6})), 'other')
+        self.assertEqual(cache.get(cache.make_key('contacts', {'page': 1})), None)
+        self.assertNotEqual(cache.make_key('contacts', {'page': 1}), list_key)
+
+    @mock.patch('basecrm.utils._request')
+    def test_request(self, _request):
+        _request.return_value = self.response
+
+        result = utils.request(utils.RETRIEVE, 'contacts', {'id': 5})
+        self.assertEqual(result, {'data': {'id': 5}, 'meta': {}})
+        result = utils.request(utils.RETRIEVE, 'contacts', {'id': 5})
+        self.assertEqual(result, {'data': {'id': 5}, 'meta': {}})
+        self.assertEqual(_request.call_count, 1)
+
+        # extra requests kwargs bypass the cache
+        utils.request(utils.RETRIEVE, 'contacts', {'id': 5}, headers={'X-Test': '1'})
+        self.assertEqual(_request.call_count, 2)
+
+        # our own writes invalidate
+        utils.request(utils.UPDATE, 'contacts', {'id': 5}, data={'name': 'hello'})
+        utils.request(utils.RETRIEVE, 'contacts', {'id': 5})
+        self.assertEqual(_request.call_count, 4)
+
+    @mock.patch('basecrm.utils._request')
+    def test_request_disabled(self, _request):
+        _request.return_value = self.response
+        with mock.patch('basecrm.settings.BASECRM_RESPONSE_CACHE_TIMEOUT', 0):
+            utils.request(utils.RETRIEVE, 'contacts', {'id': 5})
+            utils.request(utils.RETRIEVE, 'contacts', {'id': 5})
+        self.assertEqual(_request.call_count, 2)
+
+
+@mock.patch('basecrm.settings.BASECRM_WEBHOOK_SECRET', 'sekrit')
+class WebhookTests(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        accounts = {'emea': {'API_KEY': 'emea-key', 'WEBHOOK_SECRET': 'emea-secret'}}
+        patcher = mock.patch('basecrm.settings.BASECRM_ACCOUNTS', accounts)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(client._accounts.clear)
+
+    def _event(self, resource_type, id, event_type='updated', **data):
+        data['id'] = id
+        return {'data': data, 'meta': {'type': resource_type, 'event_type': event_type}}
+
+    def _post(self, payload, signature=None, account=None, secret=None):
+        body = json.dumps(payload).encode('utf-8')
+        if signature is None:
+            signature = webhooks.sign(body, secret)
+        request = self.factory.post(
+            '/webhook/',
+            body,
+            content_type='application/json',
+            HTTP_X_BASECRM_SIGNATURE=signature
+        )
+        if account is None:
+            return views.webhook(request)
+        return views.webhook(request, account=account)
+
+    def test_verify(self):
+        signature = webhooks.sign(b'{}')
+        self.assertTrue(webhooks.verify(b'{}', signature))
+        self.assertFalse(webhooks.verify(b'{"a": 1}', signature))
+        self.assertFalse(webhooks.verify(b'{}', None))
+        self.assertFalse(webhooks.verify(b'{}', u'caf\xe9'))
+        self.assertFalse(webhooks.verify(b'{}', signature, 'emea-secret'))
+        self.assertTrue(webhooks.verify(b'{}', webhooks.sign(b'{}', 'emea-secret'), 'emea-secret'))
+        with mock.patch('basecrm.settings.BASECRM_WEBHOOK_SECRET', None):
+            self.assertFalse(webhooks.verify(b'{}', signature))
+        self.assertEqual(webhooks.get_secret('emea'), 'emea-secret')
+        self.assertEqual(webhooks.get_secret(), settings.BASECRM_WEBHOOK_SECRET)
+
+    @override_settings(ROOT_URLCONF='basecrm.urls')
+    def test_url(self):
+        self.assertEqual(resolve('/webhook/').func, views.webhook)
+        match = resolve('/webhook/emea/')
+        self.assertEqual((match.func, match.kwargs), (views.webhook, {'account': 'emea'}))
+
+    @mock.patch('basecrm.webhooks.apply_events')
+    def test_view(self, apply_events):
+        self.assertEqual(self._post({}, signature='bad').status_code, 403)
+        self.assertEqual(self._post({}, signature=u'caf\xe9').status_code, 403)
+        self.assertEqual(self._post({'items': [{'data': {}}]}).status_code, 400)
+        self.assertFalse(apply_events.called)
+
+        event = self._event('contact', 1)
+        self.assertEqual(self._post(event).status_code, 200)
+        apply_events.assert_called_once_with([event], 'default')
+
+        apply_events.reset_mock()
+        response = self._post({'items': [event, self._event('deal', 2)]})
+        self.assertEqual(response.status_code, 200)
+        apply_events.assert_called_once_with([event, self._event('deal', 2)], 'default')
+
+        # each account's payloads are signed with its own secret
+        apply_events.reset_mock()
+        self.assertEqual(self._post(event, account='emea').status_code, 403)
+        response = self._post(event, account='emea', secret='emea-secret')
+        self.assertEqual(response.status_code, 200)
+        apply_events.assert_called_once_with([event], 'emea')
+        with self.assertRaises(Http404):
+            self._post(event, account='apac')
+
+        get = self.factory.get('/webhook/')
+        self.assertEqual(views.webhook(get).status_code, 405)
+
+    @mock.patch('basecrm.webhooks.apply_events')
+    def test_view_failure(self, apply_events):
+        # not acknowledged, so Base sends it again
+        apply_events.side_effect = exceptions.BaseCRMOverloaded(status_code=503)
+        with self.assertLogs('basecrm.views', 'ERROR'):
+            self.assertEqual(self._post(self._event('contact', 1)).status_code, 500)
+
+    @mock.patch('basecrm.cache.ResponseCache.invalidate', autospec=True)
+    @mock.patch('basecrm.apps.BaseCRMConfig.instantiate_users')
+    @mock.patch('basecrm.apps.BaseCRMConfig.instantiate_stages')
+    def test_apply_events(self, instantiate_stages, instantiate_users, invalidate):
+        mirror_models.Contact.objects.create(id=2, email='old@b.com')
+        webhooks.apply_events([
+            self._event('contact', 1, 'created', email='a@b.com'),
+            self._event('contact', 2, 'deleted'),
+            self._event('contact', 1, 'updated', email='c@d.com'),
+            self._event('stage', 10, 'updated'),
+            self._event('stage', 11, 'created'),
+            self._event('deal', 3, 'created', stage_id=11),
+        ])
+
+        self.assertEqual(
+            list(mirror_models.Contact.objects.values_list('id', 'email')), [(1, 'c@d.com')]
+        )
+        self.assertEqual(mirror_models.Deal.objects.get(id=3).stage_id, 11)
+        instantiate_stages.assert_called_once_with(force=True)
+        self.assertFalse(instantiate_users.called)
+        response_cache = client.get_client().cache
+        invalidate.assert_any_call(response_cache, 'contacts', {1, 2})
+        invalidate.assert_any_call(response_cache, 'stages', {10, 11})
+        invalidate.assert_any_call(response_cache, 'deals', {3})
+
+    @mock.patch('basecrm.cache.ResponseCache.invalidate', autospec=True)
+    @mock.patch('basecrm.apps.BaseCRMConfig.instantiate_users')
+    def test_apply_events_account(self, instantiate_users, invalidate):
+        accounts = []
+        instantiate_users.side_effect = lambda force: accounts.append(client.get_client().alias)
+        webhooks.apply_events(
+            [self._event('contact', 1, 'created'), self._event('user', 5)], 'emea'
+        )
+        # the mirror holds the default account's records
+        self.assertFalse(mirror_models.Contact.objects.exists())
+        self.assertEqual(accounts, ['emea'])
+        invalidate.assert_any_call(client.get_account('emea').cache, 'contacts', {1})
+        self.assertEqual(client.get_client(), client.get_account('default'))
+
+    @mock.patch('basecrm.cache.ResponseCache.invalidate', autospec=True)
+    def test_apply_events_out_of_order(self, invalidate):
+        newer = self._event(
+            'contact', 1, email='new@b.com', updated_at='2017-06-02T10:00:00Z'
+        )
+        older = self._event(
+            'contact', 1, email='old@b.com', updated_at='2017-06-01T10:00:00Z'
+        )
+        webhooks.apply_events([newer])
+        # delivered late, or retried
+        webhooks.apply_events([older])
+        self.assertEqual(mirror_models.Contact.objects.get(id=1).email, 'new@b.com')
+        # and out of order within a payload
+        mirror_models.Contact.objects.all().delete()
+        webhooks.apply_events([newer, older])
+        self.assertEqual(mirror_models.Contact.objects.get(id=1).email, 'new@b.com')
+
+    @mock.patch('basecrm.cache.ResponseCache.invalidate', autospec=True)
+    def test_apply_events_without_mirror(self, invalidate):
+        with override_settings(INSTALLED_APPS=['basecrm']):
+            self.assertFalse(mirror.is_installed())
+            webhooks.apply_events([self._event('contact', 1, 'created')])
+        self.assertFalse(mirror_models.Contact.objects.exists())
+        invalidate.assert_called_once_with(client.get_client().cache, 'contacts', {1})
+        self.assertTrue(mirror.is_installed())
+        self.assertIs(mirror.get_model('deal'), mirror_models.Deal)
+        self.assertIsNone(mirror.get_model('stage'))
+
+
+class BatchWriterTests(TestCase):
+
+    def test_init(self):
+        with self.assertRaises(exceptions.BaseCRMBadParameterFormat):
+            batch.BatchWriter('note')
+        writer = batch.BatchWriter('deal', max_workers=3)
+        self.assertEqual(writer.chunk_size, 12)
+
+    @mock.patch('basecrm.helpers.update_contact')
+    @mock.patch('basecrm.helpers.create_contact')
+    def test_write(self, create_contact, update_contact):
+        create_contact.side_effect = lambda d: dict(d, id=d['n'])
+        update_contact.side_effect = [exceptions.BaseCRMValidationError('bad')]
+
+        operations = [batch.Operation(utils.CREATE, None, {'n': n}) for n in range(5)]
+        operations.insert(2, batch.Operation(utils.UPDATE, 99, {'n': 'x'}, 'context'))
+        results = list(batch.BatchWriter('contact', max_workers=2, chunk_size=2).write(operations))
+
+        self.assertEqual([r.operation for r in results], operations)
+        self.assertEqual([r.record['id'] for r in results if r.record], [0, 1, 2, 3, 4])
+        self.assertEqual(results[2].record, None)
+        self.assertIsInstance(results[2].error, exceptions.BaseCRMValidationError)
+        self.assertEqual(results[2].operation.context, 'context')
+        update_contact.assert_called_once_with(99, {'n': 'x'})
+
+        result = batch.BatchWriter('contact').write_one(batch.Operation(utils.DELETE, 1, None))
+        self.assertIsInstance(result.error, exceptions.BaseCRMBadParameterFormat)
+
+    @mock.patch('basecrm.limits.time')
+    def test_rate_limiter(self, time):
+        time.monotonic.side_effect = [100.0, 100.1, 100.6, 102.0]
+        limiter = limits.RateLimiter(2)
+        for _ in range(4):
+            limiter.wait()
+        # the second and third calls wait for the next slot; the fourth is well after it
+        self.assertEqual(
+            [round(c[0][0], 6) for c in time.sleep.call_args_list], [0.4, 0.4]
+        )
+
+    @mock.patch('basecrm.limits.time')
+    def test_rate_limiter_timeout(self, time):
+        time.monotonic.side_effect = [100.0, 100.1, 100.2]
+        limiter = limits.RateLimiter(2)
+        self.assertTrue(limiter.wait(timeout=0.1))
+        # the next slot is 0.4s away, so it isn't taken
+        self.assertFalse(limiter.wait(timeout=0.1))
+        self.assertTrue(limiter.wait(timeout=0.5))
+        self.assertEqual([round(c[0][0], 6) for c in time.sleep.call_args_list], [0.3])
+
+    @mock.patch('basecrm.batch.RateLimiter.wait')
+    @mock.patch('basecrm.helpers.create_contact')
+    def test_rate(self, create_contact, wait):
+        self.assertEqual(batch.BatchWriter('contact').limiter, None)
+        with mock.patch('basecrm.settings.BASECRM_BATCH_RATE', 5):
+            self.assertEqual(batch.BatchWriter('contact').limiter.interval, 0.2)
+        list(batch.create('contact', [{}, {}], rate=10))
+        self.assertEqual(wait.call_count, 2)
+
+    @mock.patch('basecrm.helpers.update_lead')
+    @mock.patch('basecrm.helpers.create_lead')
+    def test_create_update(self, create_lead, update_lead):
+        list(batch.create('lead', [{'a': 1}, {'a': 2}]))
+        self.assertEqual(create_lead.call_count, 2)
+        list(batch.update('lead', [(1, {'a': 1})]))
+        update_lead.assert_called_once_with(1, {'a': 1})
+
+
+class ReconciliationTests(TestCase):
+    """
+    Uses the mirror Contact table as a stand-in local model, with `contact_id` as the BaseCRM link
+    """
+
+    def setUp(self):
+        class ExampleSerializer(serializers.ContactModelSerializer):
+            class Meta:
+                model = mirror_models.Contact
+                fields = ['first_name', 'last_name', 'email', 'custom_fields']
+
+        self.reconciliation = reconcile.Reconciliation(
+            mirror_models.Contact.objects.all(), ExampleSerializer, base_id_field='contact_id'
+        )
+        self.reconciliation._last_id = mock.Mock(return_value=30)
+        for pk, base_id, email in [(1, None, 'new@b.com'), (2, 10, 'same@b.com'),
+                                   (3, 20, 'changed@b.com'), (4, 25, 'gone@b.com')]:
+            mirror_models.Contact.objects.create(
+                id=pk, contact_id=base_id, first_name='A', last_name='B', email=email
+            )
+        self.remote = [[
+            {'id': 5, 'email': 'orphan@b.com'},
+            {'id': 10, 'first_name': 'A', 'last_name': 'B', 'email': 'same@b.com'},
+        ], [
+            {'id': 20, 'first_name': 'A', 'last_name': 'C', 'email': 'changed@b.com'},
+            {'id': 30, 'email': 'orphan2@b.com'},
+        ]]
+
+    def test_resource(self):
+        self.assertEqual(self.reconciliation.resource, 'contact')
+        with self.assertRaises(exceptions.BaseCRMConfigurationError):
+            reconcile.Reconciliation(mirror_models.Contact.objects.all(), object)
+
+    @mock.patch('basecrm.utils.paginate')
+    def test_plan(self, paginate):
+        paginate.return_value = iter(self.remote)
+        plan = [(i.action, i.id, i.data, getattr(i.instance, 'pk', None))
+                for i in self.reconciliation.plan()]
+        paginate.assert_called_once_with('contacts', {'sort_by': 'id'})
+        name = {'first_name': 'A', 'last_name': 'B'}
+        self.assertEqual(plan, [
+            (reconcile.CREATE, None, dict(name, email='new@b.com'), 1),
+            (reconcile.ORPHAN, 5, None, None),
+            (reconcile.UPDATE, 20, {'last_name': 'B'}, 3),
+            (reconcile.CREATE, None, dict(name, email='gone@b.com'), 4),
+            (reconcile.ORPHAN, 30, None, None),
+        ])
+
+    @mock.patch('basecrm.batch.BatchWriter.write')
+    @mock.patch('basecrm.utils.paginate')
+    def test_dry_run(self, paginate, write):
+        paginate.return_value = iter(self.remote)
+        report = self.reconciliation.run(dry_run=True)
+        self.assertFalse(write.called)
+        self.assertEqual(
+            report.summary(), '2 to create, 1 to update, 2 orphaned in BaseCRM, 0 errors'
+        )
+        # only counted, unless asked for
+        self.assertIsNone(report.items)
+        with self.assertRaises(exceptions.BaseCRMConfigurationError):
+            report.get(pk=3)
+
+        paginate.return_value = iter(self.remote)
+        report = self.reconciliation.run(dry_run=True, keep_items=True)
+        self.assertEqual(report.items[0], (reconcile.CREATE, 1, None))
+        self.assertEqual(report.get(pk=3), (reconcile.UPDATE, 3, 20))
+        self.assertEqual(report.get(id=30), (reconcile.ORPHAN, None, 30))
+        # unchanged
+        self.assertIsNone(report.get(pk=2))
+
+    @mock.patch('basecrm.utils.paginate')
+    def test_plan_text_ids(self, paginate):
+        class NameSerializer(serializers.ContactModelSerializer):
+            class Meta:
+                model = mirror_models.Contact
+                fields = ['first_name']
+
+        # BaseCRM IDs kept in a text column, where '10' sorts before '9'
+        mirror_models.Contact.objects.all().delete()
+        for pk, base_id in [(1, '10'), (2, '9'), (3, '100')]:
+            mirror_models.Contact.objects.create(id=pk, email=base_id, first_name='A')
+        paginate.return_value = iter([[
+            {'id': 9, 'first_name': 'A'}, {'id': 10, 'first_name': 'A'},
+            {'id': 100, 'first_name': 'B'},
+        ]])
+        reconciliation = reconcile.Reconciliation(
+            mirror_models.Contact.objects.all(), NameSerializer, base_id_field='email'
+        )
+        reconciliation._last_id = mock.Mock(return_value=100)
+        plan = [(i.action, i.id) for i in reconciliation.plan()]
+        self.assertEqual(plan, [(reconcile.UPDATE, 100)])
+
+    @mock.patch('basecrm.helpers.update_contact')
+    @mock.patch('basecrm.helpers.create_contact')
+    @mock.patch('basecrm.utils.paginate')
+    def test_run(self, paginate, create_contact, update_contact):
+        paginate.return_value = iter(self.remote)
+        create_contact.side_effect = [{'id': 40}, exceptions.BaseCRMValidationError()]
+        report = self.reconciliation.run()
+        self.assertEqual(report.counts[reconcile.CREATE], 2)
+        self.assertEqual(len(report.errors), 1)
+        self.assertEqual(report.errors[0][0], 4)
+        update_contact.assert_called_once_with(20, {'last_name': 'B'})
+        self.assertEqual(mirror_models.Contact.objects.get(pk=1).contact_id, 40)
+        self.assertEqual(mirror_models.Contact.objects.get(pk=4).contact_id, 25)
+
+    @mock.patch('basecrm.settings.BASECRM_PER_PAGE', 5)
+    def test_run_fake_api(self):
+        mirror_models.Contact.objects.all().delete()
+        with testing.FakeBase() as fake, fake.configured():
+            fake.seed(contacts=12)
+            for base_id in fake.data['contacts']:
+                mirror_models.Contact.objects.create(
+                    id=base_id, contact_id=base_id, first_name='A', last_name='B',
+                    email='%s@b.com' % base_id
+                )
+            for n in range(4):
+                mirror_models.Contact.objects.create(
+                    id=1000 + n, first_name='N', last_name='B', email='new%s@b.com' % n
+                )
+            reconciliation = reconcile.Reconciliation(
+                mirror_models.Contact.objects.all(), self.reconciliation.serializer_class,
+                base_id_field='contact_id'
+            )
+            # the creates are sent with the first chunk of updates, while BaseCRM is still being
+            # paged through
+            writer = batch.BatchWriter('contact', chunk_size=10, max_workers=2)
+            report = reconciliation.run(writer=writer)
+            self.assertEqual(
+                report.summary(), '4 to create, 12 to update, 0 orphaned in BaseCRM, 0 errors'
+            )
+            self.assertEqual(len(fake.data['contacts']), 16)
+            self.assertFalse(mirror_models.Contact.objects.filter(contact_id__isnull=True).exists())
+
+            # and once everything's linked, a second run has nothing to do
+            report = reconciliation.run(writer=writer)
+            self.assertEqual(
+                report.summary(), '0 to create, 0 to update, 0 orphaned in BaseCRM, 0 errors'
+            )
+
+    @mock.patch('basecrm.helpers.update_contact')
+    @mock.patch('basecrm.helpers.create_contact')
+    @mock.patch('basecrm.utils.paginate')
+    def test_run_checkpoint(self, paginate, create_contact, update_contact):
+        create_contact.side_effect = lambda data: {'id': 50 + len(create_contact.mock_calls)}
+        update_contact.return_value = {'id': 20}
+        checkpoint = models.Checkpoint.for_job('nightly-contacts')
+        # an interrupted run got as far as the update
+        checkpoint.record([(3, 20, None)])
+        paginate.return_value = iter(self.remote)
+        self.reconciliation.run(checkpoint=checkpoint)
+        self.assertFalse(update_contact.called)
+        self.assertFalse(checkpoint.items.exists())
+
+        # the next night's run changes the same row again
+        mirror_models.Contact.objects.filter(pk=3).update(last_name='D')
+        paginate.return_value = iter(self.remote)
+        self.reconciliation.run(checkpoint=checkpoint)
+        update_contact.assert_called_once_with(20, {'last_name': 'D'})
+
+    def test_same(self):
+        self.assertTrue(reconcile._same(Decimal('1500.00'), '1500'))
+        self.assertTrue(reconcile._same(1500, 1500.0))
+        self.assertFalse(reconcile._same(1500, None))
+        self.assertFalse(reconcile._same(True, 'true'))
+        self.assertTrue(reconcile._same(datetime.date(2017, 6, 1), '2017-06-01'))
+        self.assertTrue(reconcile._same({'a': 1}, {'a': 1, 'b': 2}))
+        self.assertFalse(reconcile._same({'a': 1}, {'a': 2}))
+
+
+class CheckpointTests(TestCase):
+
+    def setUp(self):
+        self.checkpoint = models.Checkpoint.for_job('export-contacts')
+
+    def test_model(self):
+        self.assertEqual(models.Checkpoint.for_job('export-contacts'), self.checkpoint)
+        self.assertEqual(self.checkpoint.page, 0)
+
+        self.checkpoint.advance(3, 999)
+        self.checkpoint.refresh_from_db()
+        self.assertEqual((self.checkpoint.page, self.checkpoint.last_id), (3, 999))
+
+        self.checkpoint.record([(1, 10, None), (2, None, ValueError('oops'))])
+        self.assertEqual(self.checkpoint.done([1, 2, 3]), {'1'})
+        self.assertEqual(self.checkpoint.items.get(key='2').error, 'oops')
+
+        # a retried failure replaces the earlier outcome
+        self.checkpoint.record([(2, 20, None)])
+        self.assertEqual(self.checkpoint.done(['1', '2']), {'1', '2'})
+        self.assertEqual(self.checkpoint.items.count(), 2)
+
+        self.checkpoint.reset()
+        self.assertEqual(self.checkpoint.page, 0)
+        self.assertEqual(self.checkpoint.done([1, 2]), set())
+
+    @mock.patch('basecrm.utils.request')
+    def test_paginate(self, request):
+        request.side_effect = [
+            {'items': [{'data': {'id': 1}}, {'data': {'id': 2}}], 'meta': {}},
+            {'items': [{'data': {'id': 3}}, {'data': {'id': 4}}], 'meta': {}},
+        ]
+        pages = utils.paginate('contacts', None, per_page=2, checkpoint=self.checkpoint)
+        next(pages)
+        next(pages)
+        # the second page hasn't been finished with yet
+        self.checkpoint.refresh_from_db()
+        self.assertEqual((self.checkpoint.page, self.checkpoint.last_id), (1, 2))
+
+        # so a resumed run starts from it
+        request.reset_mock()
+        request.side_effect = [{'items': [{'data': {'id': 3}}], 'meta': {}}]
+        pages = utils.paginate('contacts', None, per_page=2, checkpoint=self.checkpoint)
+        self.assertEqual(list(pages), [[{'id': 3}]])
+        self.assertEqual(request.call_args[0][2]['page'], 2)
+        self.checkpoint.refresh_from_db()
+        self.assertEqual((self.checkpoint.page, self.checkpoint.last_id), (2, 3))
+
+    @mock.patch('basecrm.helpers.create_contact')
+    def test_batch_writer(self, create_contact):
+        # keyed on the contact, as the workers may call it in any order
+        def create(data):
+            if data['n'] == 'c':
+                raise ValueError('oops')
+            return {'a': {'id': 10}, 'd': {'id': 30}}[data['n']]
+        create_contact.side_effect = create
+        self.checkpoint.record([('b', 20, None)])
+        operations = [
+            batch.Operation(utils.CREATE, None, {'n': n}, key=n) for n in ['a', 'b', 'c', 'd']
+        ]
+        writer = batch.BatchWriter('contact', checkpoint=self.checkpoint)
+        results = list(writer.write(operations))
+
+        self.assertEqual([r.operation.key for r in results], ['a', 'c', 'd'])
+        self.assertEqual(self.checkpoint.done('abcd'), {'a', 'b', 'd'})
+        self.assertEqual(self.checkpoint.items.get(key='d').base_id, 30)
+
+        # only the failure is sent again
+        create_contact.reset_mock()
+        create_contact.side_effect = [{'id': 40}]
+        results = list(writer.write(operations))
+        create_contact.assert_called_once_with({'n': 'c'})
+        self.assertEqual(self.checkpoint.done('abcd'), {'a', 'b', 'c', 'd'})
+
+
+class StreamingTests(TestCase):
+
+    def setUp(self):
+        self.body = json.dumps({
+            'items': [
+                {'data': {'id': 1, 'name': u'Caf\u00e9 \u2603'}, 'meta': {'type': 'contact'}},
+                {'data': {'id': 2, 'custom_fields': {'a': [1, 2, {'b': None}]}}, 'meta': {}},
+            ],
+            'meta': {'type': 'collection', 'count': 2, 'links': {}},
+            'total': 12,
+        }, indent=1).encode('utf-8')
+
+    def _chunks(self, body, size):
+        return [body[i:i + size] for i in range(0, len(body), size)]
+
+    def test_item_stream(self):
+        # every chunk size, including ones splitting multibyte characters, tokens and numbers
+        for size in range(1, len(self.body) + 1):
+            stream = streaming.ItemStream(self._chunks(self.body, size))
+            self.assertEqual(stream.meta, None)
+            self.assertEqual(list(stream), [
+                {'id': 1, 'name': u'Caf\u00e9 \u2603'},
+                {'id': 2, 'custom_fields': {'a': [1, 2, {'b': None}]}},
+            ])
+            self.assertEqual(stream.meta, {'type': 'collection', 'count': 2, 'links': {}})
+            self.assertEqual(stream.extra, {'total': 12})
+            self.assertEqual((stream.count, stream.last_id), (2, 2))
+
+    def test_item_stream_errors(self):
+        with self.assertRaises(exceptions.BaseCRMUnexpectedResult):
+            list(streaming.ItemStream([self.body[:-20]]))
+        with self.assertRaises(exceptions.BaseCRMUnexpectedResult):
+            list(streaming.ItemStream([b'["items"]']))
+        with self.assertRaises(exceptions.BaseCRMBadParameterFormat):
+            list(streaming.ItemStream([b'{"items": [{"name": "hello"}]}']))
+
+    def test_exhaust(self):
+        response = mock.Mock()
+        stream = streaming.ItemStream(self._chunks(self.body, 7), response=response)
+        self.assertEqual(next(stream), {'id': 1, 'name': u'Caf\u00e9 \u2603'})
+        self.assertFalse(response.close.called)
+        self.assertEqual(stream.exhaust(), 2)
+        self.assertEqual(stream.meta['count'], 2)
+        response.close.assert_called_once_with()
+
+    @mock.patch('basecrm.utils._request')
+    def test_stream(self, _request):
+        response = mock.Mock()
+        response.status_code = 200
+        response.iter_content.return_value = iter(self._chunks(self.body, 10))
+        _request.return_value = response
+
+        stream = utils.stream('contacts', {'page': 1})
+        self.assertEqual([item['id'] for item in stream], [1, 2])
+        _request.assert_called_once_with('GET', 'contacts', {'page': 1}, stream=True)
+        response.iter_content.assert_called_once_with(
+            chunk_size=settings.BASECRM_STREAM_CHUNK_SIZE
+        )
+
+        response.status_code = 204
+        self.assertEqual(list(utils.stream('contacts')), [])
+
+        response.status_code = 401
+        response.content = b'{"errors": [{"error": {"details": "test error message"}}]}'
+        with self.assertRaises(exceptions.BaseCRMAPIUnauthorized):
+            utils.stream('contacts')
+
+    @mock.patch('basecrm.utils.stream')
+    def test_paginate(self, stream):
+        stream.side_effect = [
+            streaming.ItemStream([self.body]),
+            streaming.ItemStream([b'{"items": [{"data": {"id": 3}}], "meta": {}}']),
+        ]
+        checkpoint = mock.Mock(page=0)
+        pages = utils.paginate('contacts', None, per_page=2, checkpoint=checkpoint, streamed=True)
+        first = next(pages)
+        self.assertIsInstance(first, streaming.ItemStream)
+        # the rest of the first page is drained
+        self.assertEqual(list(next(pages)), [{'id': 3}])
+        checkpoint.advance.assert_called_once_with(1, 2)
+        self.assertEqual(list(pages), [])
+        checkpoint.advance.assert_called_with(2, 3)
+        self.assertEqual(stream.call_count, 2)
+
+
+class CodecTests(TestCase):
+
+    def setUp(self):
+        self.deal = {
+            'name': 'Deal',
+            'value': Decimal('1500.10'),
+            'estimated_close_date': datetime.date(2017, 6, 1),
+            'last_stage_change_at': datetime.datetime(2017, 6, 1, 10, 30),
+            'custom_fields': {'source': u'caf\u00e9'},
+        }
+        self.encoded = {
+            'name': 'Deal',
+            'value': '1500.10',
+            'estimated_close_date': '2017-06-01',
+            'last_stage_change_at': '2017-06-01T10:30:00',
+            'custom_fields': {'source': u'caf\u00e9'},
+        }
+
+    def tearDown(self):
+        codec.reset()
+
+    def test_backends(self):
+        for name in ['json'] + (['orjson'] if HAS_ORJSON else []):
+            backend = codec.get_backend(name)
+            self.assertEqual(backend.name, name)
+            data = backend.dumps(self.deal)
+            self.assertIsInstance(data, bytes)
+            self.assertEqual(backend.loads(data), self.encoded)
+            self.assertEqual(backend.loads(data.decode('utf-8')), self.encoded)
+
+        with self.assertRaises(TypeError):
+            codec.get_backend('json').dumps({'a': object()})
+
+    def test_fallback(self):
+        backend = codec.get_backend('no_such_json_module')
+        self.assertEqual(backend.name, 'json')
+        self.assertIsInstance(codec.get_backend('basecrm.codec'), codec.ModuleBackend)
+
+    @skipUnless(HAS_ORJSON, 'orjson is not installed')
+    def test_settings(self):
+        with mock.patch('basecrm.settings.BASECRM_JSON_BACKEND', 'orjson'):
+            codec.reset()
+            self.assertEqual(codec.backend().name, 'orjson')
+            self.assertEqual(codec.loads(codec.dumps(self.deal)), self.encoded)
+        # the backend is only looked up once
+        self.assertEqual(codec.backend().name, 'orjson')
+        codec.reset()
+        self.assertEqual(codec.backend().name, 'json')
+
+    @mock.patch('basecrm.transport.RequestsTransport.send')
+    def test_request_body(self, send):
+        send.return_value = mock.Mock(status_code=200)
+        utils._request('POST', 'deals', None, json={'data': self.deal})
+        kwargs = send.call_args[1]
+        self.assertNotIn('json', kwargs)
+        self.assertEqual(json.loads(kwargs['data'].decode('utf-8')), {'data': self.encoded})
+
+
+class RecordTests(TestCase):
+
+    def setUp(self):
+        self.deal = {
+            'id': 1,
+            'name': 'Deal',
+            'value': '1500.00',
+            'hot': None,
+            'custom_fields': {'source': 'web'},
+            'created_at': '2017-06-01T10:00:00Z',
+            'not_a_base_field': True,
+        }
+
+    def test_record_class(self):
+        self.assertIs(records.record_class_for(serializers.DealModelSerializer), records.DealRecord)
+        self.assertEqual(records.DealRecord.__name__, 'DealRecord')
+        self.assertEqual(records.ContactRecord.__name__, 'ContactRecord')
+        self.assertEqual(
+            records.DealRecord.fields,
+            tuple(serializers.DealModelSerializer.base_fields + records.COMMON_FIELDS)
+        )
+        example = records.record_class('Example', ['a', 'id'])
+        self.assertIs(example, records.record_class('Example', ['a', 'id']))
+        example = records.record_class('Example', ['id', 'created_at'])
+        self.assertEqual(example.fields, ('id', 'created_at', 'updated_at', 'creator_id'))
+
+    def test_mapping(self):
+        record = records.DealRecord.from_dict(self.deal)
+        self.assertFalse(hasattr(record, '__dict__'))
+        self.assertEqual(record, self.deal)
+        self.assertEqual(record.to_dict(), self.deal)
+        self.assertEqual(dict(record), self.deal)
+        self.assertEqual(len(record), 7)
+        self.assertEqual(record['value'], '1500.00')
+        self.assertEqual(record.value, '1500.00')
+        self.assertEqual(record['hot'], None)
+        self.assertEqual(record['not_a_base_field'], True)
+        self.assertEqual(record.get('stage_id', 'missing'), 'missing')
+        self.assertIn('custom_fields', record)
+        self.assertNotIn('stage_id', record)
+        with self.assertRaises(KeyError):
+            record['stage_id']
+        with self.assertRaises(AttributeError):
+            record.name = 'changed'
+        self.assertIn("'name': 'Deal'", repr(record))
+
+        record = records.DealRecord.from_dict({'id': 2})
+        self.assertEqual(list(record.keys()), ['id'])
+
+    def test_parse(self):
+        response_dict = {'items': [{'data': self.deal}, {'data': {'id': 2}}], 'meta': {}}
+        result = utils.parse(response_dict, records.DealRecord)
+        self.assertEqual([type(r) for r in result], [records.DealRecord] * 2)
+        self.assertEqual(result, [self.deal, {'id': 2}])
+
+        result = utils.parse({'data': self.deal, 'meta': {}}, records.DealRecord)
+        self.assertIsInstance(result, records.DealRecord)
+
+    @mock.patch('basecrm.utils.request')
+    def test_paginate(self, request):
+        request.return_value = {'items': [{'data': self.deal}], 'meta': {}}
+        pages = list(utils.paginate('deals', record_class=records.DealRecord))
+        self.assertIsInstance(pages[0][0], records.DealRecord)
+
+
+class ColumnarTests(TestCase):
+
+    def setUp(self):
+        self.pages = [[
+            {'id': 1, 'owner_id': 10, 'stage_id': 7, 'value': '100.50', 'hot': True,
+             'estimated_close_date': '2017-06-01', 'updated_at': '2017-06-01T00:00:01Z'},
+            {'id': 2, 'owner_id': 11, 'stage_id': 8, 'value': 200, 'hot': False,
+             'estimated_close_date': None, 'updated_at': '2017-06-01T01:00:00+01:00'},
+        ], [
+            {'id': 3, 'owner_id': 10, 'stage_id': 7, 'value': None},
+        ]]
+        self.fields = ['id', 'owner_id', 'stage_id', 'value', 'hot', 'estimated_close_date',
+                       'updated_at']
+
+    def _check(self, columns):
+        self.assertEqual(len(columns), 3)
+        self.assertIn('value', columns)
+        self.assertNotIn('name', columns)
+        self.assertEqual(list(columns['id']), [1, 2, 3])
+        self.assertEqual(list(columns['stage_id']), [7, 8, 7])
+        self.assertEqual(list(columns['value'])[:2], [100.5, 200.0])
+        self.assertNotEqual(columns['value'][2], columns['value'][2])  # NaN
+        self.assertEqual(list(columns['hot']), [1, 0, 0])
+        self.assertEqual(columns['estimated_close_date'][0], 1496275200.0)
+        self.assertNotEqual(columns['estimated_close_date'][1], columns['estimated_close_date'][1])
+        self.assertEqual(list(columns['updated_at'])[:2], [1496275201.0, 1496275200.0])
+
+        self.assertEqual(columns.group_count('stage_id'), {7: 2, 8: 1})
+        self.assertEqual(columns.group_sum('stage_id', 'value'), {7: 100.5, 8: 200.0})
+        self.assertEqual(columns.group_sum('owner_id', 'value'), {10: 100.5, 11: 200.0})
+
+    @mock.patch('basecrm.helpers.get_users')
+    @mock.patch('basecrm.helpers.get_stages')
+    @mock.patch('basecrm.utils.paginate')
+    def test_deal_columns(self, paginate, get_stages, get_users):
+        paginate.return_value = iter(self.pages)
+        get_stages.return_value = [{'id': 7, 'name': 'Won'}, {'id': 8, 'name': 'Lost'}]
+        get_users.return_value = [{'id': 10, 'name': 'Ada'}]
+
+        columns = columnar.deal_columns(self.fields, owner_id=10)
+        paginate.assert_called_once_with('deals', {'owner_id': 10})
+        self.assertEqual(columns.stage_names, {7: 'Won', 8: 'Lost'})
+        self.assertEqual(columns.owner_names, {10: 'Ada'})
+        self._check(columns)
+        if columnar.numpy is not None:
+            self.assertIsInstance(columns['value'], columnar.numpy.ndarray)
+
+        with self.assertRaises(exceptions.BaseCRMBadParameterFormat):
+            columnar.deal_columns(['id', 'name'])
+
+    @mock.patch('basecrm.columnar.numpy', None)
+    def test_without_numpy(self):
+        columns = columnar.Columns((f, columnar.DEAL_FIELDS[f]) for f in self.fields)
+        for page in self.pages:
+            columns.extend(page)
+        columns.finalize()
+        self.assertIsInstance(columns['value'], columnar.array.array)
+        self._check(columns)
+
+    @mock.patch('basecrm.helpers.get_users')
+    @mock.patch('basecrm.utils.paginate')
+    def test_contact_columns(self, paginate, get_users):
+        paginate.return_value = iter([[{'id': 1, 'owner_id': 10, 'is_organization': True}]])
+        get_users.return_value = [{'id': 10, 'name': 'Ada'}]
+        columns = columnar.contact_columns()
+        self.assertEqual(list(columns['is_organization']), [1])
+        self.assertEqual(columns.owner_names, {10: 'Ada'})
+        self.assertEqual(columns.group_count('owner_id'), {10: 1})
+
+        paginate.return_value = iter([])
+        columns = columnar.contact_columns()
+        self.assertEqual(len(columns), 0)
+        self.assertEqual(columns.group_count('owner_id'), {})
+
+
+@skipUnless(HAS_NUMPY, 'numpy is not installed')
+class FunnelTests(TestCase):
+
+    def setUp(self):
+        self.stages = [
+            {'id': 30, 'name': 'Won', 'position': 3, 'likelihood': 100},
+            {'id': 10, 'name': 'Incoming', 'position': 1, 'likelihood': 10},
+            {'id': 20, 'name': 'Qualified', 'position': 2, 'likelihood': 50},
+        ]
+        self.now = 1500000000.0
+        self.deals = [
+            self._deal(1, 10, 100, days=1),
+            self._deal(2, 10, 300, days=10),
+            self._deal(3, 20, 1000, days=40, customized_win_likelihood=80),
+            self._deal(4, 30, 50, days=100),
+            self._deal(5, 99, 5000, days=1),  # not in the pipeline
+            self._deal(6, 20, None, days=None),
+        ]
+        columns = columnar.Columns((f, columnar.DEAL_FIELDS[f]) for f in analytics.DEAL_FIELDS)
+        columns.extend(self.deals)
+        self.funnel = analytics.Funnel(self.stages).load(columns.finalize())
+
+    def _deal(self, id, stage_id, value, days=None, updated=0, **kwargs):
+        deal = {
+            'id': id,
+            'stage_id': stage_id,
+            'value': value,
+            'updated_at': self._iso(self.now - 86400 * 200 + updated),
+            'last_stage_change_at': None if days is None else self._iso(self.now - days * 86400),
+        }
+        deal.update(kwargs)
+        return deal
+
+    def _iso(self, timestamp):
+        return datetime.datetime.utcfromtimestamp(timestamp).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    def _summary(self):
+        return [(r['name'], r['count'], r['value'], round(r['forecast'], 6))
+                for r in self.funnel.report()]
+
+    def test_report(self):
+        self.assertEqual(self._summary(), [
+            ('Incoming', 2, 400.0, 40.0),
+            ('Qualified', 2, 1000.0, 800.0),
+            ('Won', 1, 50.0, 50.0),
+        ])
+        self.assertEqual(self.funnel.updated_at, self.now - 86400 * 200)
+
+    def test_stage_ages(self):
+        ages = self.funnel.stage_ages(now=self.now)
+        self.assertEqual([a['name'] for a in ages], ['Incoming', 'Qualified', 'Won'])
+        self.assertEqual(ages[0]['buckets'], {
+            '0-7': 1, '7-14': 1, '14-30': 0, '30-60': 0, '60-90': 0, '90+': 0
+        })
+        self.assertEqual(ages[0]['mean'], 5.5)
+        self.assertEqual(ages[0]['max'], 10.0)
+        self.assertEqual(ages[1]['buckets']['30-60'], 1)
+        self.assertEqual(ages[1]['mean'], 40.0)
+        self.assertEqual(ages[2]['buckets']['90+'], 1)
+
+        empty = analytics.Funnel(self.stages).stage_ages(now=self.now)
+        self.assertEqual(empty[0]['mean'], None)
+
+    def test_update(self):
+        self.funnel.update([
+            self._deal(1, 20, 100, days=0, updated=5),  # moved on
+            self._deal(7, 10, 70, days=0, updated=10),  # new
+            self._deal(8, 10, 30, days=0, updated=1),  # new
+        ])
+        self.assertEqual(self._summary(), [
+            ('Incoming', 3, 400.0, 40.0),
+            ('Qualified', 3, 1100.0, 850.0),
+            ('Won', 1, 50.0, 50.0),
+        ])
+        self.assertEqual(self.funnel.updated_at, self.now - 86400 * 200 + 10)
+
+        self.funnel.remove([7, 8, 99])
+        self.funnel.update([self._deal(8, 30, 30, updated=20)])
+        self.assertEqual(self._summary(), [
+            ('Incoming', 1, 300.0, 30.0),
+            ('Qualified', 3, 1100.0, 850.0),
+            ('Won', 2, 80.0, 80.0),
+        ])
+
+        # incremental results match a full recompute
+        handler = self.funnel.sync_handler()
+        handler('updated', self._deal(2, 30, 300, updated=30), {})
+        handler('deleted', {'id': 3}, {})
+        incremental = self._summary()
+        columns = columnar.Columns((f, columnar.DEAL_FIELDS[f]) for f in analytics.DEAL_FIELDS)
+        columns.extend([
+            self._deal(1, 20, 100), self._deal(2, 30, 300), self._deal(4, 30, 50),
+            self._deal(6, 20, None), self._deal(8, 30, 30)
+        ])
+        self.funnel.load(columns.finalize())
+        self.assertEqual(incremental, self._summary())
+
+    @mock.patch('basecrm.utils.paginate')
+    def test_refresh(self, paginate):
+        paginate.return_value = iter([
+            [self._deal(9, 10, 10, updated=50), self._deal(1, 30, 100, updated=20)],
+            [self._deal(4, 30, 50, updated=0), self._deal(3, 20, 1000, updated=-5)],
+            [self._deal(2, 10, 300, updated=-10)],
+        ])
+        self.assertEqual(self.funnel.refresh(owner_id=5), 3)
+        paginate.assert_called_once_with('deals', {'owner_id': 5, 'sort_by': 'updated_at:desc'})
+        self.assertEqual(self.funnel.updated_at, self.now - 86400 * 200 + 50)
+        self.assertEqual(self._summary()[2], ('Won', 2, 150.0, 150.0))
+
+    @mock.patch('basecrm.helpers.get_users')
+    @mock.patch('basecrm.helpers.get_stages')
+    @mock.patch('basecrm.utils.paginate')
+    def test_funnel(self, paginate, get_stages, get_users):
+        paginate.return_value = iter([self.deals])
+        get_stages.return_value = self.stages
+        get_users.return_value = []
+        self.funnel = analytics.funnel()
+        paginate.assert_called_once_with('deals', {})
+        self.assertEqual(self._summary()[0], ('Incoming', 2, 400.0, 40.0))
+
+        # stages the caller already has aren't fetched again
+        get_stages.reset_mock()
+        paginate.return_value = iter([self.deals])
+        self.funnel = analytics.funnel(stages=self.stages, stage_id=1)
+        self.assertFalse(get_stages.called or get_users.called)
+        paginate.assert_called_with('deals', {'stage_id': 1})
+        self.assertEqual(self._summary()[0], ('Incoming', 2, 400.0, 40.0))
+
+    @mock.patch('basecrm.analytics.numpy', None)
+    def test_requires_numpy(self):
+        with self.assertRaises(exceptions.BaseCRMConfigurationError):
+            analytics.Funnel(self.stages)
+
+
+class ExportTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'contacts.jsonl.gz')
+        self.checkpoint = models.Checkpoint.for_job('export-contacts')
+
+    def _pages(self, *sizes):
+        """
+        Fake responses keyed by page number, with IDs running on from page to page
+        """
+        pages, id = {}, 0
+        for number, size in enumerate(sizes, 1):
+            items = []
+            for _ in range(size):
+                id += 1
+                items.append({'data': {
+                    'id': id,
+                    'name': 'Contact %s' % id,
+                    'tags': ['a', 'b'],
+                    'address': {'city': 'London'} if id == 1 else None,
+                }})
+            pages[number] = {'items': items, 'meta': {}}
+
+        def request(action, endpoint, get_params):
+            return pages.get(get_params['page'], {'items': [], 'meta': {}})
+        return request
+
+    def _read(self, path=None):
+        with gzip.open(path or self.path, 'rt') as f:
+            return f.read()
+
+    @mock.patch('basecrm.utils.request')
+    def test_parallel_paginate(self, request):
+        request.side_effect = self._pages(2, 2, 2, 1)
+        pages = list(utils.paginate('contacts', {'owner_id': 1}, per_page=2, workers=3))
+        self.assertEqual([[c['id'] for c in page] for page in pages], [[1, 2], [3, 4], [5, 6], [7]])
+        # nothing is asked for more than once, and at most `workers` pages past the end
+        requested = [c[0][2]['page'] for c in request.call_args_list]
+        self.assertEqual(len(requested), len(set(requested)))
+        self.assertLessEqual(max(requested), 7)
+        self.assertEqual(request.call_args[0][2]['owner_id'], 1)
+
+        request.side_effect = self._pages(2, 2)
+        pages = utils.paginate('contacts', per_page=2, checkpoint=self.checkpoint, workers=2)
+        self.assertEqual(len(list(pages)), 2)
+        self.checkpoint.refresh_from_db()
+        self.assertEqual((self.checkpoint.page, self.checkpoint.last_id), (2, 4))
+
+    @mock.patch('basecrm.utils.request')
+    def test_parallel_paginate_stopped(self, request):
+        requested = []
+
+        def page(action, endpoint, get_params):
+            requested.append(get_params['page'])
+            if get_params['page'] > 1:
+                time.sleep(0.5)
+            return {'items': [{'data': {'id': get_params['page']}}], 'meta': {}}
+        request.side_effect = page
+        pages = utils.paginate('contacts', per_page=1, workers=2)
+        next(pages)
+        # e.g. breaking out of a for loop
+        pages.close()
+        seen = list(requested)
+        time.sleep(0.1)
+        # at most the one that was already in flight, and nothing once it's closed
+        self.assertLessEqual(set(seen), {1, 2})
+        self.assertEqual(requested, seen)
+
+    @mock.patch('basecrm.utils.request')
+    def test_parallel_paginate_error(self, request):
+        def fail(action, endpoint, get_params):
+            if get_params['page'] == 2:
+                raise exceptions.BaseCRMNoResult()
+            return {'items': [{'data': {'id': get_params['page']}}], 'meta': {}}
+        request.side_effect = fail
+        pages = utils.paginate('contacts', per_page=1, checkpoint=self.checkpoint, workers=2)
+        with self.assertRaises(exceptions.BaseCRMNoResult):
+            list(pages)
+        self.checkpoint.refresh_from_db()
+        self.assertEqual(self.checkpoint.page, 1)
+
+    @mock.patch('basecrm.exports.os.fsync')
+    @mock.patch('basecrm.utils.request')
+    def test_jsonl(self, request, fsync):
+        request.side_effect = self._pages(2, 1)
+        stats = exports.export(
+            'contacts', self.path, fields=['id', 'name', 'address'], per_page=2
+        )
+        # nothing to keep in step with, so nothing is synced
+        self.assertFalse(fsync.called)
+        lines = [json.loads(l) for l in self._read().splitlines()]
+        self.assertEqual(lines, [
+            {'id': 1, 'name': 'Contact 1', 'address': {'city': 'London'}},
+            {'id': 2, 'name': 'Contact 2', 'address': None},
+            {'id': 3, 'name': 'Contact 3', 'address': None},
+        ])
+        self.assertEqual((stats.records, stats.pages), (3, 2))
+        self.assertEqual(stats.bytes, os.path.getsize(self.path))
+        self.assertIn('3 records in 2 pages', stats.summary())
+
+    @mock.patch('basecrm.utils.request')
+    def test_csv(self, request):
+        request.side_effect = self._pages(2)
+        path = os.path.join(self.directory, 'contacts.csv')
+        exports.export(
+            'contacts', path, format=exports.CSV, fields=['id', 'tags', 'address', 'email'],
+            compress=False, per_page=3
+        )
+        with open(path, newline='') as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows, [
+            ['id', 'tags', 'address', 'email'],
+            ['1', '["a","b"]', '{"city":"London"}', ''],
+            ['2', '["a","b"]', '', ''],
+        ])
+
+    def test_fields(self):
+        self.assertIn('customer_status', exports.fields_for('contacts'))
+        self.assertIn('created_at', exports.fields_for('deals'))
+        self.assertIn('organization_name', exports.fields_for('leads'))
+        with self.assertRaises(exceptions.BaseCRMBadParameterFormat):
+            exports.fields_for('contacts', ['id', 'nope'])
+        with self.assertRaises(exceptions.BaseCRMBadParameterFormat):
+            exports.fields_for('notes')
+        with self.assertRaises(exceptions.BaseCRMBadParameterFormat):
+            exports.export('contacts', self.path, format='xml')
+
+    @mock.patch('basecrm.utils.request')
+    def test_resume(self, request):
+        responses = self._pages(2, 2, 1)
+
+        def fail_on_third(action, endpoint, get_params):
+            if get_params['page'] == 3:
+                raise exceptions.BaseCRMNoResult()
+            return responses(action, endpoint, get_params)
+        request.side_effect = fail_on_third
+        with self.assertRaises(exceptions.BaseCRMNoResult):
+            exports.export(
+                'contacts', self.path, format=exports.CSV, fields=['id'], per_page=2,
+                workers=1, checkpoint=self.checkpoint
+            )
+        self.checkpoint.refresh_from_db()
+        self.assertEqual(self.checkpoint.page, 2)
+
+        request.reset_mock()
+        request.side_effect = responses
+        with mock.patch('basecrm.exports.os.fsync') as fsync:
+            stats = exports.export(
+                'contacts', self.path, format=exports.CSV, fields=['id'], per_page=2,
+                checkpoint=self.checkpoint
+            )
+        # each page is synced before the checkpoint records it
+        self.assertEqual(fsync.call_count, 1)
+        self.assertEqual(stats.records, 1)
+        self.assertEqual(request.call_args_list[0][0][2]['page'], 3)
+        # the header isn't repeated, and the completed export's checkpoint is reset
+        self.assertEqual(self._read().split(), ['id', '1', '2', '3', '4', '5'])
+        self.checkpoint.refresh_from_db()
+        self.assertEqual(self.checkpoint.page, 0)
+
+        # a checkpoint without its file starts afresh
+        self.checkpoint.advance(2, 4)
+        request.side_effect = self._pages(1)
+        path = os.path.join(self.directory, 'missing.jsonl.gz')
+        exports.export('contacts', path, fields=['id'], per_page=2, checkpoint=self.checkpoint)
+        self.assertEqual(self._read(path), '{"id":1}\n')
+
+    @mock.patch('basecrm.utils.request')
+    def test_resume_after_kill(self, request):
+        request.side_effect = self._pages(2, 2, 2, 1)
+        advance = models.Checkpoint.advance
+
+        def killed_on_third(checkpoint, page, last_id=None, offset=None):
+            if page == 3:
+                # the page is on disk, but the process dies before it's recorded
+                raise KeyboardInterrupt()
+            advance(checkpoint, page, last_id, offset)
+        with mock.patch('basecrm.models.Checkpoint.advance', killed_on_third):
+            with self.assertRaises(KeyboardInterrupt):
+                exports.export(
+                    'contacts', self.path, fields=['id'], per_page=2, workers=1,
+                    checkpoint=self.checkpoint
+                )
+        # and a page after it was only half written
+        with open(self.path, 'ab') as f:
+            f.write(gzip.compress(b'{"id":7}\n' * 100)[:-6])
+        with self.assertRaises(Exception):
+            self._read()
+
+        self.checkpoint.refresh_from_db()
+        self.assertEqual(self.checkpoint.page, 2)
+        offset = self.checkpoint.offset
+        stats = exports.export(
+            'contacts', self.path, fields=['id'], per_page=2, checkpoint=self.checkpoint
+        )
+        self.assertEqual(stats.records, 3)
+        ids = [json.loads(line)['id'] for line in self._read().splitlines()]
+        self.assertEqual(ids, [1, 2, 3, 4, 5, 6, 7])
+        self.assertEqual(stats.bytes, os.path.getsize(self.path) - offset)
+
+    @mock.patch('basecrm.utils.request')
+    def test_command(self, request):
+        request.side_effect = self._pages(1)
+        out = io.StringIO()
+        call_command(
+            'basecrm_export', 'contacts', output=self.path, fields='id,name', per_page=2,
+            filter=['owner_id=5'], checkpoint='export-contacts', stdout=out
+        )
+        self.assertEqual(self._read(), '{"id":1,"name":"Contact 1"}\n')
+        self.assertEqual(request.call_args[0][2]['owner_id'], '5')
+        self.assertIn('Exported contacts to %s: 1 records' % self.path, out.getvalue())
+
+        with self.assertRaises(CommandError):
+            call_command('basecrm_export', 'contacts', output=self.path, fields='nope')
+        with self.assertRaises(CommandError):
+            call_command('basecrm_export', 'contacts', output=self.path, filter=['owner_id'])
+
+
+class ImportTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.results = os.path.join(self.directory, 'results.jsonl')
+
+    def _write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with (gzip.open(path, 'wt') if name.endswith('.gz') else open(path, 'w')) as f:
+            f.write(content)
+        return path
+
+    def _results(self):
+        with open(self.results) as f:
+            return sorted((json.loads(l) for l in f), key=lambda r: r['row'])
+
+    @mock.patch('basecrm.helpers.update_contact')
+    @mock.patch('basecrm.helpers.create_contact')
+    def test_jsonl(self, create_contact, update_contact):
+        create_contact.side_effect = lambda d: dict(d, id=100)
+        update_contact.side_effect = exceptions.BaseCRMNoResult()
+        path = self._write('contacts.jsonl.gz', '\n'.join([
+            '{"first_name": "A", "last_name": "B", "created_at": "2017-01-01T00:00:00Z"}',
+            '{"first_name": "A"}',
+            '',
+            '{"id": 7, "email": "a@example.com"}',
+            'not json',
+        ]))
+        stats = imports.import_file('contacts', path, self.results, max_workers=2)
+
+        create_contact.assert_called_once_with({'first_name': 'A', 'last_name': 'B'})
+        update_contact.assert_called_once_with(7, {'email': 'a@example.com'})
+        self.assertEqual(
+            [(r['row'], r['outcome'], r['id']) for r in self._results()],
+            [(1, 'created', 100), (2, 'invalid', None), (4, 'failed', 7), (5, 'invalid', None)]
+        )
+        self.assertEqual(stats.summary(), '1 created, 0 updated, 2 invalid, 1 failed')
+
+    @mock.patch('basecrm.helpers.create_deal')
+    def test_csv(self, create_deal):
+        create_deal.side_effect = lambda d: dict(d, id=d['contact_id'])
+        path = self._write('deals.csv', (
+            'name,contact_id,hot,tags,value,custom_fields\r\n'
+            'Deal 1,1,True,"[""a""]",100.50,{}\r\n'
+            'Deal 2,2,,,,"{""x"": 1}"\r\n'
+            'true,3,false,"[""a""]",,{}\r\n'
+        ))
+        imports.import_file('deals', path, self.results)
+        self.assertEqual(
+            sorted(c[0][0]['contact_id'] for c in create_deal.call_args_list), [1, 2, 3]
+        )
+        create_deal.assert_any_call({
+            'name': 'Deal 1',
+            'contact_id': 1,
+            'hot': True,
+            'tags': ['a'],
+            'value': '100.50',
+            'custom_fields': {},
+        })
+        create_deal.assert_any_call({'name': 'Deal 2', 'contact_id': 2, 'custom_fields': {'x': 1}})
+        # true/false is only decoded in boolean fields
+        create_deal.assert_any_call(
+            {'name': 'true', 'contact_id': 3, 'hot': False, 'tags': ['a'], 'custom_fields': {}}
+        )
+        self.assertEqual([r['outcome'] for r in self._results()], ['created'] * 3)
+
+    @mock.patch('basecrm.helpers.create_lead')
+    def test_checkpoint(self, create_lead):
+        create_lead.side_effect = [{'id': 2}, {'id': 3}]
+        checkpoint = models.Checkpoint.for_job('import-leads')
+        # as an interrupted run would leave it
+        checkpoint.record([(1, 1, None), (2, None, 'Oops')])
+        path = self._write('leads', '{"last_name": "A", "organization_name": "B"}\n' * 3)
+        stats = imports.import_file(
+            'leads', path, self.results, format=imports.JSONL, checkpoint=checkpoint
+        )
+        self.assertEqual(create_lead.call_count, 2)
+        # the row done before is still in the results
+        self.assertEqual(
+            [(r['row'], r['outcome'], r['id']) for r in self._results()],
+            [(1, 'created', 1), (2, 'created', 2), (3, 'created', 3)]
+        )
+        self.assertEqual(stats.counts['created'], 3)
+
+        # once complete, the same job name can import another file from scratch
+        self.assertFalse(checkpoint.items.exists())
+        create_lead.reset_mock()
+        create_lead.side_effect = [{'id': 4}]
+        other = self._write('other', '{"last_name": "C", "organization_name": "D"}\n')
+        imports.import_file(
+            'leads', other, self.results, format=imports.JSONL, checkpoint=checkpoint
+        )
+        self.assertEqual(create_lead.call_count, 1)
+        self.assertEqual([(r['row'], r['id']) for r in self._results()], [(1, 4)])
+
+    def test_bad_parameters(self):
+        path = self._write('contacts.xml', '')
+        with self.assertRaises(exceptions.BaseCRMBadParameterFormat):
+            imports.import_file('contacts', path, self.results)
+        with self.assertRaises(exceptions.BaseCRMBadParameterFormat):
+            imports.import_file('notes', path, self.results, format=imports.JSONL)
+
+    @mock.patch('basecrm.helpers.create_contact')
+    def test_command(self, create_contact):
+        create_contact.return_value = {'id': 5}
+        path = self._write('contacts.jsonl', '{"name": "Org", "is_organization": true}\n')
+        out = io.StringIO()
+        call_command('basecrm_import', 'contacts', path, rate=100, stdout=out)
+        self.assertIn('1 created', out.getvalue())
+        with open(path + '.results.jsonl') as f:
+            self.assertEqual(json.loads(f.read())['id'], 5)
+
+        with self.assertRaises(CommandError):
+            call_command('basecrm_import', 'contacts', path + '.missing')
+        with self.assertRaises(CommandError):
+            call_command('basecrm_import', 'contacts', os.path.join(self.directory, 'no.jsonl'))
+
+
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        self.collector = metrics.Collector()
+        self.collector.connect()
+        self.addCleanup(self.collector.disconnect)
+
+    def _response(self, status_code=200, content=b'{"data": {"id": 1}}'):
+        response = mock.Mock(status_code=status_code, content=content, headers={})
+        return response
+
+    @mock.patch('basecrm.transport.RequestsTransport.send')
+    def test_signals(self, request):
+        started, finished = mock.Mock(), mock.Mock()
+        signals.request_started.connect(started, sender='deals', weak=False)
+        signals.request_finished.connect(finished, sender='deals', weak=False)
+        self.addCleanup(signals.request_started.disconnect, started, sender='deals')
+        self.addCleanup(signals.request_finished.disconnect, finished, sender='deals')
+
+        request.return_value = self._response(201)
+        utils._request('POST', 'deals', None, json={'data': {'name': 'x'}}, retries=1)
+        self.assertNotIn('retries', request.call_args[1])
+        started.assert_called_once_with(
+            signal=signals.request_started, sender='deals', method='POST', endpoint='deals',
+            retries=1
+        )
+        kwargs = finished.call_args[1]
+        self.assertEqual(kwargs['status'], 201)
+        self.assertEqual(kwargs['request_bytes'], len(b'{"data":{"name":"x"}}'))
+        self.assertEqual(kwargs['response_bytes'], len(b'{"data": {"id": 1}}'))
+        self.assertEqual(kwargs['retries'], 1)
+        self.assertIsNone(kwargs['exception'])
+        self.assertGreaterEqual(kwargs['duration'], 0)
+
+        # a streamed body isn't read just to measure it
+        response = self._response()
+        response.headers = {'Content-Length': '99'}
+        request.return_value = response
+        utils._request('GET', 'deals', None, stream=True)
+        self.assertEqual(finished.call_args[1]['response_bytes'], 99)
+
+        # other endpoints aren't sent to these receivers
+        utils._request('GET', 'contacts', None)
+        self.assertEqual(finished.call_count, 2)
+
+        request.side_effect = ValueError('timed out')
+        with self.assertRaises(ValueError):
+            utils._request('GET', 'deals', None)
+        kwargs = finished.call_args[1]
+        self.assertEqual((kwargs['status'], kwargs['response_bytes']), (None, None))
+        self.assertIsInstance(kwargs['exception'], ValueError)
+
+    @mock.patch('basecrm.transport.RequestsTransport.send')
+    def test_collector(self, request):
+        request.side_effect = [self._response(), self._response(404), ValueError('oops')]
+        utils._request('GET', 'deals', None)
+        utils._request('GET', 'deals', None)
+        with self.assertRaises(ValueError):
+            utils._request('GET', 'deals', None)
+        stats = self.collector.snapshot()['GET deals']
+        self.assertEqual(stats['requests'], 3)
+        self.assertEqual(stats['errors'], 2)
+        self.assertAlmostEqual(stats['error_rate'], 2 / 3.0)
+        self.assertEqual(stats['statuses'], {200: 1, 404: 1, 'ValueError': 1})
+        self.assertEqual(stats['response_bytes'], 2 * len(b'{"data": {"id": 1}}'))
+
+        self.assertEqual(self.collector.snapshot(reset=True).keys(), {'GET deals'})
+        self.assertEqual(self.collector.snapshot(), {})
+
+    def test_percentiles(self):
+        for i in range(1, 101):
+            self.collector.record(None, 'GET', 'contacts', 200, i / 1000.0)
+        self.collector.record(None, 'GET', 'contacts', 200, 1000.0)
+        stats = self.collector.snapshot()['GET contacts']
+        # accurate to within a bucket
+        self.assertAlmostEqual(stats['p50'], 0.050, delta=0.005)
+        self.assertAlmostEqual(stats['p95'], 0.095, delta=0.010)
+        self.assertAlmostEqual(stats['p99'], 0.099, delta=0.010)
+        self.assertEqual(stats['max'], 1000.0)
+        self.assertAlmostEqual(stats['total_time'], 1005.05)
+
+        histogram = metrics.Histogram()
+        self.assertIsNone(histogram.percentile(50))
+        histogram.add(0.0123)
+        self.assertEqual(histogram.percentile(99), 0.0123)
+
+    @mock.patch('basecrm.metrics.logger')
+    def test_log(self, logger):
+        self.collector.record(None, 'GET', 'contacts', 200, 0.25)
+        self.collector.log(reset=True)
+        logger.log.assert_called_once_with(
+            20, "BaseCRM GET contacts: 1 requests, 0.0% errors, p50 250ms, p95 250ms, p99 250ms"
+        )
+        self.assertEqual(self.collector.snapshot(), {})
+
+    @mock.patch('basecrm.apps.settings')
+    @mock.patch('basecrm.metrics.collector')
+    def test_ready(self, collector, app_settings):
+        app_settings.BASECRM_CACHE_AT_STARTUP = False
+        app_settings.BASECRM_METRICS = True
+        django_apps.get_app_config('basecrm').ready()
+        collector.connect.assert_called_once_with()
+
+
+class TracingTests(TestCase):
+
+    def setUp(self):
+        self.tracer = tracing.RecordingTracer()
+        use = tracing.use(self.tracer)
+        use.__enter__()
+        self.addCleanup(use.__exit__, None, None, None)
+
+    def _names(self):
+        return [(s.name, s.depth) for s in self.tracer.spans]
+
+    def test_spans(self):
+        with tracing.span('outer', a=1) as outer:
+            with tracing.span('inner') as inner:
+                inner.set('b', 2)
+            with self.assertRaises(ValueError):
+                with tracing.span('failing'):
+                    raise ValueError('oops')
+        self.assertEqual(self._names(), [('inner', 1), ('failing', 1), ('outer', 0)])
+        self.assertIs(inner.parent, outer)
+        self.assertEqual(inner.attributes, {'b': 2})
+        self.assertIsInstance(self.tracer.spans[1].error, ValueError)
+        self.assertIsNone(outer.error)
+        self.assertGreaterEqual(outer.duration, inner.duration)
+        self.assertIsNone(self.tracer.current())
+
+    def test_noop(self):
+        with tracing.use(None):
+            with mock.patch('basecrm.settings.BASECRM_TRACER', None):
+                with tracing.span('anything', a=1) as span:
+                    span.set('b', 2)
+                self.assertIs(span, tracing.NOOP_SPAN)
+                self.assertIsInstance(tracing.tracer(), tracing.NoopTracer)
+        self.assertIs(tracing.tracer(), self.tracer)
+
+        with tracing.use(None):
+            with mock.patch(
+                'basecrm.settings.BASECRM_TRACER', 'basecrm.tracing.RecordingTracer'
+            ):
+                self.assertIsInstance(tracing.tracer(), tracing.RecordingTracer)
+
+    @mock.patch('basecrm.transport.RequestsTransport.send')
+    def test_request(self, request):
+        request.return_value = mock.Mock(
+            status_code=200, content=b'{"items": [{"data": {"id": 1}}], "meta": {}}'
+        )
+        with tracing.span('page'):
+            utils.parse(utils.request(utils.RETRIEVE, 'deals', {}))
+        self.assertEqual(self._names(), [
+            ('basecrm.http', 1), ('basecrm.decode', 1), ('basecrm.parse', 1), ('page', 0)
+        ])
+        self.assertEqual(self.tracer.spans[0].attributes, {
+            'method': 'GET', 'endpoint': 'deals', 'status': 200
+        })
+
+    def test_worker_threads(self):
+        with testing.FakeBase() as fake, fake.configured():
+            fake.seed(contacts=6)
+            with tracing.span('job') as job:
+                list(utils.paginate('contacts', per_page=2, workers=3))
+                contacts = [{'first_name': 'F%s' % i, 'last_name': 'L'} for i in range(3)]
+                list(batch.create('contact', contacts, max_workers=2))
+        requests = [s for s in self.tracer.spans if s.name == 'basecrm.http']
+        # paginate may ask for a page or two past the end
+        self.assertGreaterEqual(len(requests), 3 + 3)
+        for span in requests:
+            self.assertIs(span.parent, job)
+        self.assertIsNone(self.tracer.current())
+
+        # without a current span there's nothing to carry over
+        fn = mock.Mock()
+        self.assertIs(tracing.bind(fn), fn)
+
+    def test_validation(self):
+        utils.validate_lead_dict(utils.UPDATE, {'id': 1})
+        utils.validate_many('lead', utils.UPDATE, [{'id': 1}])
+        self.assertEqual(self._names(), [('basecrm.validate', 0), ('basecrm.validate_many', 0)])
+        self.assertEqual(self.tracer.spans[0].attributes['resource'], 'lead')
+
+    def test_serializer(self):
+        instance = mock.Mock(spec=ModelBase, first='Robert', last='Oppenheimer')
+
+        class Serializer(serializers.AbstractModelSerializer):
+            base_fields = ['first', 'last']
+
+            class Meta:
+                model = instance.__class__
+
+        Serializer(instance).to_dict()
+        self.assertEqual(self._names(), [
+            ('basecrm.serialize.field', 1),
+            ('basecrm.serialize.field', 1),
+            ('basecrm.serialize', 0),
+            ('basecrm.to_dict', 0),
+        ])
+        self.assertEqual(
+            [s.attributes.get('field') for s in self.tracer.spans[:2]], ['first', 'last']
+        )
+        self.assertEqual(self.tracer.spans[2].attributes, {'serializer': 'Serializer'})
+
+
+class FakeBaseTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(FakeBaseTests, cls).setUpClass()
+        cls.fake = testing.FakeBase(seed=1).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.fake.stop()
+        super(FakeBaseTests, cls).tearDownClass()
+
+    def setUp(self):
+        configured = self.fake.configured()
+        configured.__enter__()
+        self.addCleanup(configured.__exit__, None, None, None)
+        self.fake.stats = testing.Stats()
+
+    def test_pagination(self):
+        self.fake.data['contacts'].clear()
+        self.fake.seed(contacts=25)
+        pages = list(utils.paginate('contacts', {'sort_by': 'id:desc'}, per_page=10))
+        self.assertEqual([len(p) for p in pages], [10, 10, 5])
+        ids = [c['id'] for p in pages for c in p]
+        self.assertEqual(ids, sorted(self.fake.data['contacts'], reverse=True))
+
+        response = utils.request(utils.RETRIEVE, 'contacts', {'page': 2, 'per_page': 10})
+        self.assertEqual(utils.count(response), 10)
+        self.assertIn('next_page', response['meta']['links'])
+        self.assertEqual(response['items'][0]['meta'], {'type': 'contact'})
+
+        # filters
+        owner_id = next(iter(self.fake.data['users']))
+        contacts = helpers.get_contacts(owner_id=owner_id, per_page=100)
+        self.assertEqual(len(contacts), 13)
+        self.assertEqual(len(helpers.get_contacts(ids='%s,%s' % tuple(ids[:2]))), 2)
+        self.assertEqual(len(helpers.get_contacts(is_organization='false', per_page=100)), 25)
+
+        # parallel reads give the same pages
+        pages = list(utils.paginate('contacts', {'sort_by': 'id:desc'}, per_page=10, workers=3))
+        self.assertEqual([c['id'] for p in pages for c in p], ids)
+
+        stages = helpers.get_stages_from_api()
+        self.assertEqual([s['name'] for s in stages][:2], ['Incoming', 'Qualified'])
+        self.assertEqual(len(helpers.get_pipelines_from_api()), 1)
+
+    def test_crud(self):
+        contact = helpers.create_contact({'first_name': 'Robert', 'last_name': 'Oppenheimer'})
+        self.assertIn('created_at', contact)
+        self.assertEqual(helpers.get_contacts(id=contact['id'])['last_name'], 'Oppenheimer')
+
+        updated = helpers.update_contact(contact['id'], {'email': 'r@example.com'})
+        self.assertEqual(updated['email'], 'r@example.com')
+        self.assertEqual(updated['first_name'], 'Robert')
+
+        self.assertIsNone(utils.request(utils.DELETE, 'contacts', {'id': contact['id']}))
+        with self.assertRaises(exceptions.BaseCRMNoResult):
+            helpers.get_contacts(id=contact['id'])
+        self.assertEqual(self.fake.stats.statuses, {200: 3, 204: 1, 404: 1})
+
+    def test_failures(self):
+        response = requests.get(self.fake.url + 'contacts')
+        self.assertEqual(response.status_code, 401)
+
+        self.fake.fail_next(503, count=2, resource='deals')
+        helpers.get_contacts()
+        for _ in range(2):
+            with self.assertRaisesRegex(Exception, "status code '503'"):
+                helpers.get_deals()
+        helpers.get_deals()
+
+        self.fake.fail_next(429)
+        response = requests.get(
+            self.fake.url + 'contacts', headers={'Authorization': 'Bearer x'}
+        )
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '1')
+        self.assertEqual(response.json()['errors'][0]['error']['code'], 'rate_limit_exceeded')
+
+        fake = testing.FakeBase(error_rate=0.5, seed=3)
+        environ = {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': '/v2/users', 'HTTP_AUTHORIZATION': 'Bearer x'
+        }
+        for _ in range(100):
+            fake(environ, mock.Mock())
+        self.assertTrue(30 < fake.stats.statuses[500] < 70)
+
+    def test_rate_limit(self):
+        self.fake.rate_limit = 5
+        self.fake._allowance = 5
+        self.addCleanup(setattr, self.fake, 'rate_limit', None)
+        session = requests.Session()
+        statuses = [
+            session.get(self.fake.url + 'users', headers={'Authorization': 'Bearer x'}).status_code
+            for _ in range(8)
+        ]
+        self.assertEqual(statuses[:5], [200] * 5)
+        self.assertIn(429, statuses[5:])
+        # the session's connection was kept alive throughout
+        self.assertEqual(self.fake.stats.connections, 1)
+
+    def test_latency(self):
+        self.fake.latency = (0.02, 0.03)
+        self.addCleanup(setattr, self.fake, 'latency', 0)
+        list(utils.paginate('stages', per_page=1, workers=4))
+        self.assertGreater(self.fake.stats.max_in_flight, 1)
+
+
+class TransportTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(TransportTests, cls).setUpClass()
+        cls.fake = testing.FakeBase(seed=1).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.fake.stop()
+        super(TransportTests, cls).tearDownClass()
+
+    def setUp(self):
+        configured = self.fake.configured()
+        configured.__enter__()
+        self.addCleanup(configured.__exit__, None, None, None)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'recording.jsonl.gz')
+
+    def sync(self):
+        pages = list(utils.paginate('stages', per_page=4))
+        contact = helpers.create_contact({'first_name': 'Robert', 'last_name': 'Oppenheimer'})
+        return pages, contact
+
+    def test_record_and_replay(self):
+        self.assertIsInstance(transport.get_transport(), transport.RequestsTransport)
+        with transport.use(transport.Recorder(self.path)) as recorder:
+            recorded = self.sync()
+        self.assertEqual(recorder.count, 3)
+        with gzip.open(self.path, 'rt') as f:
+            exchanges = [json.loads(line) for line in f]
+        self.assertEqual(exchanges[0]['request']['params'], [['page', '1'], ['per_page', '4']])
+        self.assertEqual(exchanges[2]['response']['status'], 200)
+        self.assertNotIn('Authorization', json.dumps(exchanges))
+
+        requests_made = self.fake.stats.requests
+        with transport.use(transport.Replayer(self.path)) as replayer:
+            self.assertEqual(replayer.remaining, 3)
+            self.assertEqual(self.sync(), recorded)
+            self.assertEqual(replayer.remaining, 0)
+            # nothing left to replay
+            with self.assertRaises(exceptions.BaseCRMReplayError):
+                helpers.get_stages_from_api()
+        self.assertEqual(self.fake.stats.requests, requests_made)
+        self.assertIsInstance(transport.get_transport(), transport.RequestsTransport)
+
+    def test_mismatch(self):
+        with transport.use(transport.Recorder(self.path)):
+            helpers.create_contact({'first_name': 'Robert', 'last_name': 'Oppenheimer'})
+        with transport.use(transport.Replayer(self.path)):
+            with self.assertRaisesRegex(exceptions.BaseCRMReplayError, 'POST'):
+                helpers.create_contact({'first_name': 'Richard', 'last_name': 'Feynman'})
+
+    @mock.patch('basecrm.transport.time.sleep')
+    def test_timing(self, sleep):
+        with transport.use(transport.Recorder(self.path)):
+            helpers.get_stages_from_api()
+        with transport.use(transport.Replayer(self.path)):
+            helpers.get_stages_from_api()
+        sleep.assert_not_called()
+        with transport.use(transport.Replayer(self.path, timing=True, speed=2.0)):
+            helpers.get_stages_from_api()
+        with gzip.open(self.path, 'rt') as f:
+            elapsed = json.loads(f.readline())['elapsed']
+        sleep.assert_called_once_with(elapsed / 2.0)
+
+    def test_errors_replayed(self):
+        self.fake.fail_next(503, resource='deals')
+        with transport.use(transport.Recorder(self.path)):
+            with self.assertRaisesRegex(Exception, "status code '503'"):
+                helpers.get_deals()
+        with transport.use(transport.Replayer(self.path)):
+            with self.assertRaisesRegex(Exception, "status code '503'"):
+                helpers.get_deals()
+
+
+class ClientTests(TestCase):
+
+    def test_headers_and_url(self):
+        base = client.BaseCRMClient(
+            api_key='key', api_url='http://api.base.com/v2/', user_agent='yourApp/1.0'
+        )
+        self.assertEqual(base.headers['Authorization'], 'Bearer key')
+        headers = base.build_headers({'Accept': 'text/html'})
+        self.assertEqual(headers['Accept'], 'text/html')
+        # the client's own headers are left alone
+        self.assertEqual(base.headers['Accept'], 'application/json')
+        self.assertIsNot(base.build_headers(), base.headers)
+        self.assertEqual(base.build_url('deals', {'id': 5}), 'http://api.base.com/v2/deals/5')
+        with self.assertRaises(exceptions.BaseCRMBadParameterFormat):
+            base.build_headers(['Accept'])
+
+    def test_default(self):
+        default = client.get_client()
+        self.assertIs(client.get_client(), default)
+        self.assertEqual(default.api_url, settings.BASECRM_API_URL)
+        self.assertIs(default.cache, cache.default)
+        other = client.BaseCRMClient(api_url='http://other/')
+        with client.use(other):
+            self.assertIs(client.get_client(), other)
+            self.assertEqual(utils._build_api_endpoint('deals'), 'http://other/deals')
+        self.assertIs(client.get_client(), default)
+
+    @mock.patch('basecrm.limits.RateLimiter.wait')
+    def test_rate(self, wait):
+        base = client.BaseCRMClient(rate=5)
+        base.transport = mock.Mock()
+        base.transport.send.return_value = mock.Mock(status_code=200)
+        with client.use(base):
+            utils._request('GET', 'deals')
+            utils._request('GET', 'deals')
+        self.assertEqual(wait.call_count, 2)
+        self.assertEqual(base.transport.send.call_count, 2)
+        self.assertIsNone(client.BaseCRMClient().limiter)
+
+    def test_reference_data(self):
+        base_app = django_apps.get_app_config('basecrm')
+        base_app.users = [{'id': 1}]
+        self.addCleanup(setattr, base_app, 'users', None)
+        with client.use(client.BaseCRMClient()) as other:
+            self.assertIsNone(base_app.users)
+            base_app.users = [{'id': 2}]
+            self.assertEqual(other.users, [{'id': 2}])
+        self.assertEqual(base_app.users, [{'id': 1}])
+        self.assertEqual(client.get_client().users, [{'id': 1}])
+
+    def test_response_cache(self):
+        with mock.patch('basecrm.settings.BASECRM_RESPONSE_CACHE_TIMEOUT', 60):
+            first = cache.ResponseCache(prefix='first')
+            second = cache.ResponseCache(prefix='second', timeout=0)
+            self.assertTrue(first.enabled())
+            self.assertFalse(second.enabled())
+            self.assertEqual(first.make_key('deals', {'id': 1}), 'first:deals:1')
+            self.assertEqual(cache.make_key('deals', {'id': 1}), 'basecrm:deals:1')
+
+    def test_pooled_connections(self):
+        with testing.FakeBase() as fake, fake.configured():
+            for _ in range(5):
+                helpers.get_users_from_api()
+            self.assertEqual(fake.stats.requests, 5)
+            self.assertEqual(fake.stats.connections, 1)
+
+
+class AccountTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(AccountTests, cls).setUpClass()
+        cls.emea = testing.FakeBase(seed=1).start()
+        cls.apac = testing.FakeBase(seed=2).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.emea.stop()
+        cls.apac.stop()
+        super(AccountTests, cls).tearDownClass()
+
+    def setUp(self):
+        accounts = {
+            'emea': {'API_KEY': 'emea-key', 'API_URL': self.emea.url},
+            'apac': {'API_KEY': 'apac-key', 'API_URL': self.apac.url, 'RATE': 50},
+            'broken': {'API_URL': self.apac.url},
+        }
+        patcher = mock.patch('basecrm.settings.BASECRM_ACCOUNTS', accounts)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(client._accounts.clear)
+        self.emea.stats = testing.Stats()
+        self.apac.stats = testing.Stats()
+
+    def test_routing(self):
+        with client.account('emea') as emea:
+            self.assertIs(client.get_client(), emea)
+            self.assertEqual(emea.headers['Authorization'], 'Bearer emea-key')
+            helpers.get_users_from_api()
+            with client.account('apac'):
+                helpers.get_users_from_api()
+                helpers.get_users_from_api()
+            helpers.get_users_from_api()
+        self.assertEqual(self.emea.stats.requests, 2)
+        self.assertEqual(self.apac.stats.requests, 2)
+        self.assertIs(client.get_client(), client.get_account(client.DEFAULT_ACCOUNT))
+        # one client per account
+        self.assertIs(client.get_account('emea'), emea)
+
+    def test_worker_threads(self):
+        self.apac.seed(contacts=30)
+        contacts = [{'first_name': 'F%s' % i, 'last_name': 'L%s' % i} for i in range(5)]
+        with client.account('apac'):
+            pages = list(utils.paginate('contacts', per_page=10, workers=3))
+            results = list(batch.create('contact', contacts, max_workers=3))
+        self.assertEqual(sum(len(p) for p in pages), 30)
+        self.assertEqual([r.error for r in results], [None] * 5)
+        self.assertEqual(self.emea.stats.requests, 0)
+        self.assertEqual(len(self.apac.data['contacts']), 35)
+
+    def test_isolation(self):
+        emea, apac = client.get_account('emea'), client.get_account('apac')
+        self.assertIsNone(emea.limiter)
+        self.assertIsNotNone(apac.limiter)
+        self.assertIsNot(emea.transport.session, apac.transport.session)
+        self.assertEqual(emea.cache.make_key('deals', {'id': 1}), 'basecrm:emea:deals:1')
+
+        base_app = django_apps.get_app_config('basecrm')
+        with client.account('emea'):
+            base_app.users = [{'id': 1}]
+        self.assertIsNone(base_app.users)
+        self.assertEqual(emea.users, [{'id': 1}])
+        self.assertIsNone(apac.users)
+
+        # other threads aren't affected by a selection
+        seen = []
+        with client.account('emea'):
+            thread = threading.Thread(target=lambda: seen.append(client.get_client()))
+            thread.start()
+            thread.join()
+        self.assertEqual(seen, [client.get_account(client.DEFAULT_ACCOUNT)])
+
+    def test_misconfigured(self):
+        with self.assertRaisesRegex(exceptions.BaseCRMConfigurationError, 'nowhere'):
+            with client.account('nowhere'):
+                pass
+        with self.assertRaisesRegex(exceptions.BaseCRMConfigurationError, 'API_KEY'):
+            client.get_account('broken')
+
+
+class DeadlineTests(TestCase):
+
+    def setUp(self):
+        self.transport = mock.Mock()
+        self.transport.send.return_value = mock.Mock(
+            status_code=200, content=b'{"items": [], "meta": {}}'
+        )
+        use = transport.use(self.transport)
+        use.__enter__()
+        self.addCleanup(use.__exit__, None, None, None)
+
+    def test_within(self):
+        self.assertIsNone(deadline.remaining())
+        self.assertEqual(deadline.cap((3.05, 30)), (3.05, 30))
+        with deadline.within(10):
+            self.assertTrue(9 < deadline.remaining() <= 10)
+            with deadline.within(60):
+                # an inner deadline can't outlast the outer one
+                self.assertLessEqual(deadline.remaining(), 10)
+            with deadline.within(1):
+                self.assertLessEqual(deadline.remaining(), 1)
+                self.assertTrue(all(t <= 1 for t in deadline.cap((3.05, 30))))
+                self.assertLessEqual(deadline.cap(None), 1)
+                self.assertLessEqual(deadline.cap(5), 1)
+            self.assertGreater(deadline.remaining(), 9)
+        self.assertIsNone(deadline.current())
+
+    def test_timeouts(self):
+        utils._request('GET', 'deals')
+        self.assertEqual(
+            self.transport.send.call_args[1]['timeout'],
+            (settings.BASECRM_CONNECT_TIMEOUT, settings.BASECRM_READ_TIMEOUT)
+        )
+        utils._request('GET', 'deals', timeout=5)
+        self.assertEqual(self.transport.send.call_args[1]['timeout'], 5)
+        with client.use(client.BaseCRMClient(connect_timeout=1, read_timeout=2)):
+            utils._request('GET', 'deals')
+        self.assertEqual(self.transport.send.call_args[1]['timeout'], (1, 2))
+        with deadline.within(0.5):
+            utils._request('GET', 'deals')
+        connect, read = self.transport.send.call_args[1]['timeout']
+        self.assertTrue(0 < connect <= 0.5 and 0 < read <= 0.5)
+
+    def test_expired(self):
+        with deadline.within(0):
+            with self.assertRaises(exceptions.BaseCRMTimeout):
+                helpers.get_deals()
+            results = list(batch.create('lead', [
+                {'last_name': 'Last', 'organization_name': 'Org'}
+            ] * 3))
+        self.assertFalse(self.transport.send.called)
+        self.assertEqual(
+            [type(r.error) for r in results], [exceptions.BaseCRMTimeout] * 3
+        )
+
+    def test_requests_timeout(self):
+        self.transport.send.side_effect = requests.exceptions.ReadTimeout('too slow')
+        with self.assertRaisesRegex(exceptions.BaseCRMTimeout, "'deals' endpoint"):
+            utils._request('GET', 'deals')
+
+    def test_worker_threads(self):
+        expires = []
+
+        def send(method, url, **kwargs):
+            expires.append(deadline.current())
+            items = [{'data': {'id': 1}}] if kwargs['params']['page'] < 3 else []
+            return mock.Mock(status_code=200, content=json.dumps({'items': items}).encode())
+
+        self.transport.send.side_effect = send
+        with deadline.within(10):
+            outer = deadline.current()
+            pages = list(utils.paginate('deals', per_page=1, workers=2))
+        self.assertEqual(len(pages), 2)
+        self.assertEqual(set(expires), {outer})
+
+    def test_slow_api(self):
+        with testing.FakeBase(latency=0.5) as fake, fake.configured():
+            with transport.use(transport.RequestsTransport()):
+                started = time.monotonic()
+                with self.assertRaises(exceptions.BaseCRMTimeout):
+                    with deadline.within(0.1):
+                        helpers.get_users_from_api()
+                self.assertLess(time.monotonic() - started, 0.4)
+
+
+class BreakerTests(TestCase):
+
+    def setUp(self):
+        self.changed = mock.Mock()
+        signals.breaker_state_changed.connect(self.changed, weak=False)
+        self.addCleanup(signals.breaker_state_changed.disconnect, self.changed)
+
+    def _states(self):
+        return [(c[1]['previous'], c[1]['state']) for c in self.changed.call_args_list]
+
+    @mock.patch('basecrm.breaker.time')
+    def test_states(self, time):
+        time.monotonic.return_value = 100.0
+        b = breaker.CircuitBreaker(
+            'deals', failure_rate=0.6, minimum_requests=4, window=6, reset_timeout=30
+        )
+        for failed in [True, False, True]:
+            self.assertFalse(b.before())
+            b.record(failed)
+        # not enough requests yet
+        self.assertEqual(b.state, breaker.CLOSED)
+        b.record(False)
+        self.assertEqual(b.state, breaker.CLOSED)
+        b.record(True)
+        self.assertEqual(b.state, breaker.OPEN)
+        self.assertAlmostEqual(b.current_failure_rate, 0.6)
+        with self.assertRaisesRegex(exceptions.BaseCRMCircuitOpen, "'deals'"):
+            b.before()
+
+        # half-open after the reset timeout, with one probe at a time
+        time.monotonic.return_value = 130.0
+        self.assertTrue(b.before())
+        self.assertEqual(b.state, breaker.HALF_OPEN)
+        with self.assertRaises(exceptions.BaseCRMCircuitOpen):
+            b.before()
+        b.record(True, probe=True)
+        self.assertEqual(b.state, breaker.OPEN)
+
+        time.monotonic.return_value = 160.0
+        self.assertTrue(b.before())
+        b.record(False, probe=True)
+        self.assertEqual(b.state, breaker.CLOSED)
+        self.assertEqual(b.current_failure_rate, 0.0)
+        self.assertEqual(self._states(), [
+            ('closed', 'open'), ('open', 'half-open'), ('half-open', 'open'),
+            ('open', 'half-open'), ('half-open', 'closed'),
+        ])
+        self.assertEqual(self.changed.call_args_list[0][1]['sender'], 'deals')
+
+    def test_window(self):
+        b = breaker.CircuitBreaker('deals', failure_rate=0.9, minimum_requests=2, window=4)
+        for failed in [True, False, False, False, False, True]:
+            b.record(failed)
+        # the first failure has left the window
+        self.assertAlmostEqual(b.current_failure_rate, 0.25)
+        self.assertEqual(b.state, breaker.CLOSED)
+
+    def test_request_path(self):
+        with testing.FakeBase() as fake:
+            base = client.BaseCRMClient(
+                api_url=fake.url,
+                breakers=breaker.Breakers(minimum_requests=3, failure_rate=0.5, window=10),
+            )
+            with client.use(base):
+                fake.fail_next(503, count=3, resource='deals')
+                for _ in range(3):
+                    with self.assertRaisesRegex(Exception, "status code '503'"):
+                        helpers.get_deals()
+                with self.assertRaises(exceptions.BaseCRMCircuitOpen):
+                    helpers.get_deals()
+                # other endpoints carry on
+                helpers.get_users_from_api()
+            self.assertEqual(fake.stats.requests, 4)
+            self.assertEqual(base.breakers.states(), {'deals': 'open', 'users': 'closed'})
+            self.assertEqual(self._states(), [('closed', 'open')])
+            base.close()
+
+    def test_receivers_outside_lock(self):
+        b = breaker.CircuitBreaker('deals', failure_rate=0.5, minimum_requests=1, reset_timeout=1)
+        acquired = []
+
+        def receiver(sender, **kwargs):
+            # would deadlock if the signal were sent with the lock held
+            acquired.append(b._lock.acquire(timeout=1))
+            b._lock.release()
+        signals.breaker_state_changed.connect(receiver, weak=False)
+        self.addCleanup(signals.breaker_state_changed.disconnect, receiver)
+        b.record(True)
+        self.assertEqual(b.state, breaker.OPEN)
+        with mock.patch('basecrm.breaker.time.monotonic', return_value=time.monotonic() + 5):
+            self.assertTrue(b.before())
+        self.assertEqual(acquired, [True, True])
+
+    @mock.patch('basecrm.transport.RequestsTransport.send')
+    def test_open_fails_fast(self, send):
+        base = client.BaseCRMClient(
+            rate=2, breakers=breaker.Breakers(minimum_requests=1, failure_rate=0.5)
+        )
+        self.addCleanup(base.close)
+        b = base.breakers.get('deals')
+        b.record(True)
+        started = time.monotonic()
+        with client.selected(base):
+            for _ in range(5):
+                with self.assertRaises(exceptions.BaseCRMCircuitOpen):
+                    helpers.get_deals()
+            # without waiting for, or using up, the rate limit
+            self.assertLess(time.monotonic() - started, 0.25)
+            self.assertLess(base.limiter._next, started)
+
+            # a half-open probe that times out waiting for the rate limit isn't counted
+            b.opened_at -= b.reset_timeout
+            base.limiter.wait()
+            with deadline.within(0.05), self.assertRaises(exceptions.BaseCRMTimeout):
+                helpers.get_deals()
+            self.assertEqual((b.state, b._probing), (breaker.HALF_OPEN, 0))
+        self.assertFalse(send.called)
+
+    def test_settings(self):
+        with mock.patch('basecrm.settings.BASECRM_BREAKER', False):
+            self.assertIsNone(client.BaseCRMClient().breakers)
+        self.assertIsNotNone(client.BaseCRMClient().breakers)
+        b = client.BaseCRMClient().breakers.get('deals')
+        self.assertEqual(b.failure_rate, settings.BASECRM_BREAKER_FAILURE_RATE)
+        self.assertEqual(b.reset_timeout, settings.BASECRM_BREAKER_RESET_TIMEOUT)
+
+
+class AdaptiveConcurrencyTests(TestCase):
+
+    def _release(self, limiter, latency, overloaded=False):
+        limiter.acquire()
+        limiter.release(time.monotonic() - latency, overloaded)
+
+    def test_aimd(self):
+        limiter = limits.AdaptiveLimiter('test', maximum=6, initial=2)
+        # additive increase, about one a round trip
+        for _ in range(10):
+            self._release(limiter, 0.01)
+        self.assertTrue(4 < limiter.limit < 5)
+        for _ in range(50):
+            self._release(limiter, 0.01)
+        self.assertEqual(limiter.limit, 6)
+
+        # multiplicative decrease
+        self._release(limiter, 0.01, overloaded=True)
+        self.assertEqual(limiter.limit, 3)
+        limiter.limit = limiter.minimum
+        self._release(limiter, 0.01, overloaded=True)
+        self.assertEqual(limiter.limit, 1)
+
+    def test_in_flight_cut_once(self):
+        limiter = limits.AdaptiveLimiter('test', maximum=8, initial=8)
+        started = [limiter.acquire() for _ in range(4)]
+        for s in started:
+            limiter.release(s, overloaded=True)
+        # the other three were sent before the first cut
+        self.assertEqual(limiter.limit, 4)
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_latency(self):
+        limiter = limits.AdaptiveLimiter('test', maximum=8, initial=8)
+        for _ in range(5):
+            self._release(limiter, 0.01)
+        self.assertEqual(limiter.limit, 8)
+        for _ in range(4):
+            self._release(limiter, 0.1)
+        self.assertLess(limiter.limit, 8)
+        self.assertAlmostEqual(limiter.best_latency, 0.01, places=2)
+
+    def test_acquire_waits(self):
+        limiter = limits.AdaptiveLimiter('test', maximum=1)
+        started = limiter.acquire()
+        acquired = threading.Event()
+        thread = threading.Thread(target=lambda: (limiter.acquire(), acquired.set()))
+        thread.start()
+        self.assertFalse(acquired.wait(0.05))
+        limiter.release(started)
+        self.assertTrue(acquired.wait(1))
+        thread.join()
+
+    def test_run(self):
+        limiter = limits.AdaptiveLimiter('test', maximum=8, initial=8)
+        with self.assertRaises(ValueError):
+            limiter.run(mock.Mock(side_effect=ValueError))
+        self.assertEqual(limiter.limit, 8)
+        with self.assertRaises(exceptions.BaseCRMOverloaded):
+            limiter.run(mock.Mock(side_effect=exceptions.BaseCRMOverloaded(status_code=429)))
+        self.assertEqual(limiter.limit, 4)
+        self.assertEqual(limiter.run(lambda x: x * 2, 21), 42)
+        self.assertTrue(limits.overloaded(requests.exceptions.ConnectionError()))
+        self.assertFalse(limits.overloaded(exceptions.BaseCRMValidationError()))
+
+    def test_throttled_status(self):
+        response = mock.Mock(status_code=429, content=json.dumps({
+            'errors': [{'error': {'code': 'rate_limit_exceeded', 'details': 'Slow down'}}]
+        }).encode('utf-8'))
+        with self.assertRaisesRegex(exceptions.BaseCRMOverloaded, "status code '429'") as cm:
+            utils._raise_for_status(response, False)
+        self.assertEqual(cm.exception.status_code, 429)
+
+    def test_status_without_json(self):
+        bodies = [
+            (503, b'<html><body>Service Unavailable</body></html>'),
+            (429, b''),
+            (502, b'{"message": "Bad Gateway"}'),
+        ]
+        for status_code, content in bodies:
+            response = mock.Mock(status_code=status_code, content=content)
+            with self.assertRaises(exceptions.BaseCRMOverloaded) as cm:
+                utils._raise_for_status(response, False)
+            self.assertEqual(cm.exception.status_code, status_code)
+        with self.assertRaises(exceptions.BaseCRMAPIUnauthorized):
+            utils._raise_for_status(mock.Mock(status_code=401, content=b''), False)
+        with self.assertRaises(exceptions.BaseCRMNoResult):
+            utils._raise_for_status(mock.Mock(status_code=404, content=b'Not Found'), True)
+
+    def test_metric(self):
+        collector = metrics.Collector()
+        collector.connect()
+        self.addCleanup(collector.disconnect)
+        limiter = limits.AdaptiveLimiter('batch contact', maximum=8, initial=8)
+        self._release(limiter, 0.01, overloaded=True)
+        self.assertEqual(collector.concurrency(), {'batch contact': 4})
+
+    def test_batch_and_paginate(self):
+        collector = metrics.Collector()
+        collector.connect()
+        self.addCleanup(collector.disconnect)
+        with testing.FakeBase(latency=0.005) as fake, fake.configured():
+            fake.seed(contacts=60)
+            pages = list(utils.paginate('contacts', per_page=5, workers=6, adaptive=True))
+            self.assertEqual(
+                [c['id'] for p in pages for c in p], sorted(fake.data['contacts'])
+            )
+            fake.fail_next(429, count=2)
+            contacts = [{'first_name': 'F%s' % i, 'last_name': 'L%s' % i} for i in range(30)]
+            writer = batch.BatchWriter('contact', max_workers=6, adaptive=True)
+            results = list(writer.write(batch.Operation(utils.CREATE, None, c) for c in contacts))
+            self.assertLessEqual(fake.stats.max_in_flight, 6)
+        self.assertEqual(
+            [type(r.error) for r in results if r.error], [exceptions.BaseCRMOverloaded] * 2
+        )
+        self.assertIn('batch contact', collector.concurrency())
+        self.assertIsNone(batch.BatchWriter('contact').concurrency)
+
+
+class LaneTests(TestCase):
+
+    def test_use(self):
+        self.assertEqual(lanes.current(), lanes.INTERACTIVE)
+        with lanes.use(lanes.BACKGROUND):
+            self.assertEqual(lanes.current(), lanes.BACKGROUND)
+            with lanes.use(lanes.INTERACTIVE):
+                self.assertEqual(lanes.current(), lanes.INTERACTIVE)
+            self.assertEqual(lanes.current(), lanes.BACKGROUND)
+        self.assertEqual(lanes.current(), lanes.INTERACTIVE)
+        with self.assertRaises(exceptions.BaseCRMBadParameterFormat):
+            with lanes.use('bulk'):
+                pass
+
+    def test_connections(self):
+        client_lanes = client.BaseCRMClient(pool_size=4, interactive_reserve=0.25).lanes
+        self.assertEqual(client_lanes.background_connections, 3)
+        self.assertIsNone(client_lanes.background_limiter)
+        held = [client_lanes.admit(lanes.BACKGROUND) for _ in range(3)]
+        for admission in held:
+            admission.__enter__()
+        with deadline.within(0.05), self.assertRaises(exceptions.BaseCRMTimeout):
+            with client_lanes.admit(lanes.BACKGROUND):
+                pass
+        # the reserved connection is still there for interactive requests
+        with client_lanes.admit(lanes.INTERACTIVE):
+            pass
+        for admission in held:
+            admission.__exit__(None, None, None)
+        with client_lanes.admit(lanes.BACKGROUND):
+            pass
+
+    def test_rate(self):
+        current = client.BaseCRMClient(rate=8, interactive_reserve=0.25)
+        self.assertAlmostEqual(current.lanes.background_limiter.interval, 1.0 / 6)
+        with mock.patch.object(current.limiter, 'wait') as shared, \
+                mock.patch.object(current.lanes.background_limiter, 'wait') as background:
+            with current.lanes.admit(lanes.INTERACTIVE):
+                pass
+            self.assertEqual((shared.call_count, background.call_count), (1, 0))
+            with current.lanes.admit(lanes.BACKGROUND):
+                pass
+            self.assertEqual((shared.call_count, background.call_count), (2, 1))
+        unreserved = client.BaseCRMClient(rate=8, interactive_reserve=0)
+        self.assertIsNone(unreserved.lanes.background_limiter)
+
+    def test_rate_deadline(self):
+        current = client.BaseCRMClient(rate=1, interactive_reserve=0.5)
+        with current.lanes.admit(lanes.BACKGROUND):
+            pass
+        started = time.monotonic()
+        for lane in lanes.LANES:
+            with deadline.within(0.1), self.assertRaises(exceptions.BaseCRMTimeout):
+                with current.lanes.admit(lane):
+                    pass
+        # neither waited out the rate limit, nor took a slot from it
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertLess(current.limiter._next - time.monotonic(), 1)
+        self.assertEqual(
+            current.lanes._background_slots._value, current.lanes.background_connections
+        )
+
+    @mock.patch('basecrm.helpers.create_contact')
+    def test_batch_deadline(self, create_contact):
+        writer = batch.BatchWriter('contact', rate=1)
+        writer.limiter.wait()
+        with deadline.within(0.1):
+            result = writer.write_one(batch.Operation(utils.CREATE, None, {}))
+        self.assertIsInstance(result.error, exceptions.BaseCRMTimeout)
+        self.assertFalse(create_contact.called)
+
+    @mock.patch('basecrm.utils.request')
+    def test_worker_threads(self, request):
+        seen = []
+
+        def page(method, endpoint, get_params=None, **kwargs):
+            seen.append(lanes.current())
+            if get_params['page'] > 6:
+                return {'items': [], 'meta': {}}
+            return {'items': [{'data': {'id': get_params['page']}}], 'meta': {}}
+        request.side_effect = page
+        with lanes.use(lanes.BACKGROUND):
+            pages = list(utils.paginate('contacts', per_page=1, workers=3))
+        self.assertEqual(len(pages), 6)
+        self.assertEqual(set(seen), {lanes.BACKGROUND})
+
+    @mock.patch('basecrm.helpers.create_contact')
+    def test_batch(self, create_contact):
+        seen = []
+        create_contact.side_effect = lambda data: seen.append(lanes.current()) or data
+        contacts = [{'first_name': 'F%s' % i, 'last_name': 'L%s' % i} for i in range(4)]
+        list(batch.create('contact', contacts, max_workers=2))
+        list(batch.create('contact', contacts, max_workers=2, lane=lanes.INTERACTIVE))
+        self.assertEqual(seen, [lanes.BACKGROUND] * 4 + [lanes.INTERACTIVE] * 4)
+
+    @mock.patch('basecrm.utils.request')
+    def test_export(self, request):
+        seen = []
+
+        def page(method, endpoint, get_params=None, **kwargs):
+            seen.append(lanes.current())
+            return {'items': [], 'meta': {}}
+        request.side_effect = page
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        exports.export('contacts', os.path.join(directory, 'contacts.jsonl.gz'), fields=['id'])
+        self.assertEqual(set(seen), {lanes.BACKGROUND})
+        self.assertEqual(lanes.current(), lanes.INTERACTIVE)
+
+    def test_fake_api(self):
+        with testing.FakeBase(latency=0.01) as fake:
+            fake.seed(contacts=40)
+            current = client.BaseCRMClient(api_url=fake.url, pool_size=4, interactive_reserve=0.5)
+            with client.use(current):
+                with lanes.use(lanes.BACKGROUND):
+                    list(utils.paginate('contacts', per_page=2, workers=4))
+                self.assertLessEqual(fake.stats.max_in_flight, 2)
+                list(utils.paginate('contacts', per_page=2, workers=4))
+            self.assertGreater(fake.stats.max_in_flight, 2)
+
+
+class HedgingTests(TestCase):
+
+    def setUp(self):
+        self.hedger = hedging.Hedger(percentile=50, budget=1, minimum_requests=3, window=10)
+        self.addCleanup(self.hedger.close)
+
+    def _prime(self, latency=0.01, count=3):
+        for _ in range(count):
+            self.hedger._record('contacts', latency)
+
+    def _sends(self, *latencies):
+        """
+        A send whose n-th call takes the n-th latency and returns n
+        """
+        calls = []
+        lock = threading.Lock()
+
+        def send():
+            with lock:
+                n = len(calls)
+                calls.append(n)
+            time.sleep(latencies[n])
+            return n
+        return send, calls
+
+    def test_delay(self):
+        self.assertIsNone(self.hedger.delay('contacts'))
+        self._prime(count=2)
+        self.assertIsNone(self.hedger.delay('contacts'))
+        self._prime(count=1)
+        self.assertAlmostEqual(self.hedger.delay('contacts'), 0.01, places=2)
+        self.assertIsNone(self.hedger.delay('deals'))
+        # a new window starts after 10, and takes over once it has enough requests
+        self._prime(count=7)
+        self._prime(0.1, count=2)
+        self.assertAlmostEqual(self.hedger.delay('contacts'), 0.01, places=2)
+        self._prime(0.1, count=1)
+        self.assertAlmostEqual(self.hedger.delay('contacts'), 0.1, places=1)
+
+    def test_not_hedged(self):
+        send, calls = self._sends(0.05, 0)
+        # too few requests seen to know what's slow
+        self.assertEqual(self.hedger.run('contacts', send), 0)
+        self._prime()
+        send, calls = self._sends(0, 0)
+        self.assertEqual(self.hedger.run('contacts', send), 0)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.hedger.stats(), {'requests': 2, 'hedges': 0, 'wins': 0})
+
+    def test_inline_until_primed(self):
+        seen = []
+        with mock.patch.object(self.hedger._executor, 'submit') as submit:
+            for _ in range(2):
+                self.hedger.run('contacts', lambda: seen.append(threading.current_thread()))
+            with self.assertRaises(ValueError):
+                self.hedger.run('contacts', mock.Mock(side_effect=ValueError))
+        self.assertFalse(submit.called)
+        self.assertEqual(seen, [threading.current_thread()] * 2)
+        # failures are timed as well
+        self.assertEqual(self.hedger._latencies['contacts'][0].count, 3)
+
+    def test_hedged(self):
+        self._prime()
+        send, calls = self._sends(0.5, 0)
+        started = time.monotonic()
+        self.assertEqual(self.hedger.run('contacts', send), 1)
+        self.assertLess(time.monotonic() - started, 0.25)
+        self.assertEqual(self.hedger.stats(), {'requests': 1, 'hedges': 1, 'wins': 1})
+
+        # the first to answer is used, even if it's the original
+        send, calls = self._sends(0.03, 0.5)
+        self.assertEqual(self.hedger.run('contacts', send), 0)
+        self.assertEqual(self.hedger.stats(), {'requests': 2, 'hedges': 2, 'wins': 1})
+
+    def test_budget(self):
+        # the fastest so far, as the slow originals are recorded too
+        hedger = hedging.Hedger(percentile=1, budget=0.5, minimum_requests=1)
+        self.addCleanup(hedger.close)
+        hedger._record('contacts', 0.005)
+        for _ in range(4):
+            hedger.run('contacts', self._sends(0.03, 0)[0])
+        # half a hedge a request
+        self.assertEqual(hedger.hedges, 2)
+        self.assertLessEqual(hedger._tokens, hedging.BURST)
+
+    def test_failures(self):
+        self._prime()
+        # the hedge's answer is used if the original fails
+        calls = []
+
+        def slow_failure():
+            calls.append(None)
+            if len(calls) == 1:
+                time.sleep(0.05)
+                raise exceptions.BaseCRMTimeout()
+            time.sleep(0.1)
+            return 'hedge'
+        self.assertEqual(self.hedger.run('contacts', slow_failure), 'hedge')
+
+        def fail():
+            time.sleep(0.05)
+            raise exceptions.BaseCRMTimeout()
+        with self.assertRaises(exceptions.BaseCRMTimeout):
+            self.hedger.run('contacts', fail)
+        self.assertEqual(self.hedger.hedges, 2)
+
+    @mock.patch('basecrm.transport.RequestsTransport.send')
+    def test_request(self, send):
+        urls = []
+
+        def respond(method, url, **kwargs):
+            urls.append(url)
+            if len(urls) == 1:
+                time.sleep(0.2)
+            return mock.Mock(status_code=200, content=json.dumps({
+                'data': {'id': len(urls)}, 'meta': {}
+            }).encode('utf-8'))
+        send.side_effect = respond
+        current = client.BaseCRMClient(api_url='https://api.example.com/v2/', hedger=self.hedger)
+        with client.use(current):
+            self._prime()
+            self.assertEqual(helpers.get_contacts(id=7)['id'], 2)
+            self.assertEqual(urls, ['https://api.example.com/v2/contacts/7'] * 2)
+            # only single-record, interactive reads are hedged
+            helpers.get_contacts()
+            with lanes.use(lanes.BACKGROUND):
+                helpers.get_contacts(id=7)
+        self.assertEqual(self.hedger.stats(), {'requests': 1, 'hedges': 1, 'wins': 1})
+
+    def test_settings(self):
+        self.assertIsNone(client.BaseCRMClient().hedger)
+        with mock.patch('basecrm.settings.BASECRM_HEDGE', True):
+            current = client.BaseCRMClient(pool_size=3)
+        self.addCleanup(current.close)
+        self.assertEqual(current.hedger.max_workers, 6)
+        self.assertEqual(current.hedger.percentile, 95)
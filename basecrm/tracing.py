@@ -0,0 +1,212 @@
+"""
+Optional tracing of where the time goes in a call to BaseCRM: HTTP requests, decoding responses,
+parsing them, serializing model instances (field by field) and validation each run in a span, and
+spans nest, so a slow page can be broken down into API time, JSON time and ORM time in getters.
+
+By default the tracer is a no-op whose spans cost a function call. To collect spans, set
+BASECRM_TRACER to the dotted path of a Tracer subclass (or call set_tracer()); exporters subclass
+Tracer and override start() and/or finish(), which are given each Span as it starts and ends.
+Your own code can add spans with the same API:
+
+    with tracing.span('nightly-sync', resource='deals') as span:
+        ...
+        span.set('count', n)
+
+The current span is kept per thread; bind() carries it over to a worker thread, as paginate, the
+batch writer and the hedger do, so the spans of their requests are children of the caller's.
+"""
+import contextlib
+import importlib
+import threading
+import time
+
+from . import settings
+
+_tracer = None
+
+
+class NoopSpan(object):
+    name = None
+    parent = None
+    attributes = {}
+    error = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def set(self, key, value):
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class NoopTracer(object):
+    enabled = False
+
+    def span(self, name, **attributes):
+        return NOOP_SPAN
+
+    def current(self):
+        return None
+
+
+class Span(object):
+
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.parent = None
+        self.error = None
+        self.start = None
+        self.end = None
+
+    def __enter__(self):
+        self.parent = self.tracer.current()
+        self.tracer._stack().append(self)
+        self.start = time.perf_counter()
+        self.tracer.start(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end = time.perf_counter()
+        self.error = exc_value
+        self.tracer._stack().pop()
+        self.tracer.finish(self)
+        return False
+
+    def __repr__(self):
+        return '<Span %s %s>' % (self.name, self.attributes)
+
+    @property
+    def duration(self):
+        if self.start is None or self.end is None:
+            return None
+        return self.end - self.start
+
+    @property
+    def depth(self):
+        return 0 if self.parent is None else self.parent.depth + 1
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+
+class Tracer(object):
+    """
+    Creates Spans, tracking the current one per thread so that they nest. Subclasses override
+    start() and finish() to export them
+    """
+    enabled = True
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def span(self, name, **attributes):
+        return Span(self, name, attributes)
+
+    def current(self):
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    @contextlib.contextmanager
+    def adopt(self, span):
+        """
+        Makes a span from another thread the current one in this thread for the duration of a with
+        block, so that spans started in it are its children; it's not started or finished again
+        """
+        stack = self._stack()
+        stack.append(span)
+        try:
+            yield span
+        finally:
+            stack.pop()
+
+    def start(self, span):
+        pass
+
+    def finish(self, span):
+        pass
+
+    def _stack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+
+class RecordingTracer(Tracer):
+    """
+    Keeps every finished span (in the order they finished) on .spans, e.g. for tests or debugging
+    """
+
+    def __init__(self):
+        super(RecordingTracer, self).__init__()
+        self.spans = []
+
+    def finish(self, span):
+        self.spans.append(span)
+
+
+def tracer():
+    global _tracer
+    if _tracer is None:
+        _tracer = _load(settings.BASECRM_TRACER)
+    return _tracer
+
+
+def set_tracer(new_tracer):
+    """
+    Installs a tracer (None to go back to the one given by settings)
+    """
+    global _tracer
+    _tracer = new_tracer
+
+
+@contextlib.contextmanager
+def use(new_tracer):
+    """
+    Installs a tracer for the duration of a with block
+    """
+    global _tracer
+    previous = _tracer
+    _tracer = new_tracer
+    try:
+        yield new_tracer
+    finally:
+        _tracer = previous
+
+
+def span(name, **attributes):
+    """
+    A context manager timing the code inside it, as a child of the current span (if any)
+    """
+    return tracer().span(name, **attributes)
+
+
+def bind(fn):
+    """
+    Wraps fn to run with the span that's current now as its parent, e.g. when it's given to a
+    worker thread
+    """
+    current_tracer = tracer()
+    parent = current_tracer.current()
+    if parent is None:
+        return fn
+
+    def run(*args, **kwargs):
+        with current_tracer.adopt(parent):
+            return fn(*args, **kwargs)
+    return run
+
+
+def _load(path):
+    if not path:
+        return NoopTracer()
+    module, name = path.rsplit('.', 1)
+    return getattr(importlib.import_module(module), name)()
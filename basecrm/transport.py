@@ -0,0 +1,223 @@
+"""
+The transport is what actually sends each HTTP request made by utils._request. By default that's
+the requests library, through the current client's pooled session (see client.py); a Recorder
+wraps another transport and appends every exchange to a gzipped JSON-lines file, and a Replayer
+serves a recording back (optionally with its original timings) without touching the network, so a
+bulk job can be replayed and profiled repeatedly and identically:
+
+    with transport.use(transport.Recorder('sync.jsonl.gz')):
+        run_sync()
+    ...
+    with transport.use(transport.Replayer('sync.jsonl.gz', timing=True)):
+        run_sync()
+
+Request headers (and so the API key) are never recorded.
+"""
+import base64
+import contextlib
+import datetime
+import gzip
+import json
+import threading
+import time
+from collections import defaultdict, deque
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from . import exceptions
+
+_transport = None
+_default = None
+
+
+class Transport(object):
+
+    def send(self, method, url, **kwargs):
+        """
+        Sends the request (kwargs are as for requests.request) and returns a requests.Response
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class RequestsTransport(Transport):
+
+    def __init__(self, session=None):
+        self.session = session
+
+    def send(self, method, url, **kwargs):
+        if self.session is None:
+            return requests.request(method, url, **kwargs)
+        return self.session.request(method, url, **kwargs)
+
+    def close(self):
+        if self.session is not None:
+            self.session.close()
+
+
+class Recorder(Transport):
+
+    def __init__(self, path, transport=None):
+        self.path = path
+        self.transport = transport or RequestsTransport()
+        self.count = 0
+        self._file = gzip.open(path, 'wb')
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+
+    def send(self, method, url, **kwargs):
+        sent = time.monotonic()
+        response = self.transport.send(method, url, **kwargs)
+        # reads the whole body, even of a streamed response; it's then served from memory
+        content = response.content
+        exchange = {
+            'offset': sent - self._started,
+            'elapsed': time.monotonic() - sent,
+            'request': {
+                'method': method,
+                'url': url,
+                'params': _params(kwargs.get('params')),
+                'body': _encode(kwargs.get('data')),
+            },
+            'response': {
+                'status': response.status_code,
+                'reason': response.reason,
+                'url': response.url,
+                'headers': dict(response.headers),
+                'body': _encode(content),
+            },
+        }
+        line = json.dumps(exchange, sort_keys=True).encode('utf-8') + b'\n'
+        with self._lock:
+            self._file.write(line)
+            self.count += 1
+        return response
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+        self.transport.close()
+
+
+class Replayer(Transport):
+    """
+    Serves recorded responses to matching requests (same method, URL, params and body), in the
+    order they were recorded. With timing=True each response takes as long as it originally did
+    (scaled by `speed`); a request with nothing left to match raises BaseCRMReplayError
+    """
+
+    def __init__(self, path, timing=False, speed=1.0):
+        self.timing = timing
+        self.speed = speed
+        self.count = 0
+        self._exchanges = defaultdict(deque)
+        self._lock = threading.Lock()
+        with gzip.open(path, 'rb') as f:
+            for line in f:
+                exchange = json.loads(line.decode('utf-8'))
+                self._exchanges[_key(**exchange['request'])].append(exchange)
+
+    @property
+    def remaining(self):
+        return sum(len(q) for q in self._exchanges.values())
+
+    def send(self, method, url, **kwargs):
+        key = _key(method, url, _params(kwargs.get('params')), _encode(kwargs.get('data')))
+        with self._lock:
+            queue = self._exchanges.get(key)
+            if not queue:
+                raise exceptions.BaseCRMReplayError(
+                    "No recorded response left for %s %s (params %s)" % (
+                        method, url, _params(kwargs.get('params'))
+                    )
+                )
+            exchange = queue.popleft()
+            self.count += 1
+        if self.timing and exchange['elapsed']:
+            time.sleep(exchange['elapsed'] / self.speed)
+        return _response(exchange['response'], exchange['elapsed'])
+
+
+def get_transport(default=None):
+    """
+    The transport installed with set_transport or use, if any; otherwise `default` (e.g. a client's
+    pooled transport), or else a RequestsTransport
+    """
+    global _default
+    if _transport is not None:
+        return _transport
+    if default is not None:
+        return default
+    if _default is None:
+        _default = RequestsTransport()
+    return _default
+
+
+def set_transport(new_transport):
+    """
+    Installs a transport to be used for every request (None to go back to the default)
+    """
+    global _transport
+    _transport = new_transport
+
+
+@contextlib.contextmanager
+def use(new_transport):
+    """
+    Installs a transport for the duration of a with block, closing it afterwards
+    """
+    global _transport
+    previous = _transport
+    _transport = new_transport
+    try:
+        yield new_transport
+    finally:
+        _transport = previous
+        new_transport.close()
+
+
+def _params(params):
+    if not params:
+        return []
+    return sorted([str(k), str(v)] for k, v in params.items())
+
+
+def _encode(body):
+    """
+    Bodies are kept as text where they're UTF-8, which is always for the BaseCRM API
+    """
+    if body is None:
+        return None
+    if isinstance(body, str):
+        return {'text': body}
+    try:
+        return {'text': body.decode('utf-8')}
+    except UnicodeDecodeError:
+        return {'base64': base64.b64encode(body).decode('ascii')}
+
+
+def _decode(body):
+    if body is None:
+        return b''
+    if 'text' in body:
+        return body['text'].encode('utf-8')
+    return base64.b64decode(body['base64'])
+
+
+def _key(method, url, params=None, body=None):
+    return json.dumps([method, url, params or [], body], sort_keys=True)
+
+
+def _response(recorded, elapsed):
+    response = requests.Response()
+    response.status_code = recorded['status']
+    response.reason = recorded.get('reason')
+    response.url = recorded.get('url')
+    response.headers = CaseInsensitiveDict(recorded.get('headers') or {})
+    response.encoding = 'utf-8'
+    response._content = _decode(recorded.get('body'))
+    response.elapsed = datetime.timedelta(seconds=elapsed)
+    return response
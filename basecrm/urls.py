@@ -0,0 +1,10 @@
+from django.conf.urls import url
+
+from . import views
+
+app_name = 'basecrm'
+
+urlpatterns = [
+    url(r'^webhook/$', views.webhook, name='webhook'),
+    url(r'^webhook/(?P<account>[\w-]+)/$', views.webhook, name='webhook'),
+]
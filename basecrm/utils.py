@@ -1,9 +1,16 @@
+import collections
+import functools
 import logging
 import requests
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from django.apps import apps as django_apps
 
-from . import settings, exceptions
+from . import (
+    client, codec, deadline, lanes, limits, settings, exceptions, signals, streaming, tracing,
+    transport, validation
+)
 
 logger = logging.getLogger(__name__)
 
@@ -28,7 +35,8 @@ REQUIRE_BODY_DATA = [
 def request(action, endpoint, get_params=None, **kwargs):
     """
     Makes a request to the BaseCRM API and handles any errors thrown intelligently. See _request
-    for more info on the parameters.
+    for more info on the parameters. If the client has a hedger, slow interactive RETRIEVE requests
+    for a single ID may be sent twice (see hedging.py).
     """
     if action not in VERBS.keys():
         raise exceptions.BaseCRMBadParameterFormat(
@@ -50,59 +58,191 @@ def request(action, endpoint, get_params=None, **kwargs):
     else:
         is_id_request = False
 
+    current = client.get_client()
+    cache = current.cache
+    cache_key = None
+    if cache.enabled() and action == RETRIEVE and not kwargs:
+        cache_key = cache.make_key(endpoint, get_params)
+        if cache_key is not None:
+            cached = cache.get(cache_key)
+            if cached is not None:
+                return cached
+    invalidate_ids = None
+    if is_id_request:
+        # _build_api_endpoint pops the ID off get_params
+        invalidate_ids = [get_params['id']]
+
     method = VERBS[action]
-    r = _request(method, endpoint, get_params, **kwargs)
-    if r.status_code != 200:
-        json = r.json()
-        logger.error(
-            "BaseCRM API responded with status code: '%s'. %s" % (
-                r.status_code,
-                json['errors'][0]['error']['details'],
-            )
-        )
-        if r.status_code == 401:
-            raise exceptions.BaseCRMAPIUnauthorized()
-        elif r.status_code == 404 and is_id_request:
-            # no record with the given ID exists
-            raise exceptions.BaseCRMNoResult()
-        elif r.status_code == 422:
-            raise exceptions.BaseCRMValidationError(json['errors'][0]['error']['details'])
-        else:
-            raise Exception(
-                "BaseCRM API responded with status code '%s'. %s" % (
-                    r.status_code,
-                    json['errors'][0]['error']['details'],
-                )
-            )
+    hedge = (
+        current.hedger is not None and is_id_request and action == RETRIEVE and not kwargs and
+        lanes.current() == lanes.INTERACTIVE
+    )
+    if hedge:
+        # each attempt gets its own copy of get_params, as _request pops the ID off it
+        def send():
+            return _request(method, endpoint, dict(get_params))
+        send = client.bind(deadline.bind(lanes.bind(tracing.bind(send))))
+        r = current.hedger.run(endpoint, send)
     else:
-        return r.json()
+        r = _request(method, endpoint, get_params, **kwargs)
+    if not 200 <= r.status_code < 300:
+        _raise_for_status(r, is_id_request)
+
+    if cache.enabled() and action in (CREATE, UPDATE, DELETE):
+        cache.invalidate(endpoint, invalidate_ids)
+
+    if r.status_code == 204 or not r.content:
+        # e.g. an empty sync queue or an accepted ack; there's no body to decode
+        return None
+    else:
+        with tracing.span('basecrm.decode', endpoint=endpoint, bytes=len(r.content)):
+            json = codec.loads(r.content)
+        if cache_key is not None:
+            cache.set(cache_key, json)
+        return json
+
+
+def stream(endpoint, get_params=None, **kwargs):
+    """
+    Makes a RETRIEVE request to a list endpoint and decodes the body incrementally as it arrives.
+    Returns a streaming.ItemStream, which iterates over the `data` dict of each item (as parse does)
+    and captures the `meta` on the side; only one record is held in memory at a time.
+    """
+    r = _request(VERBS[RETRIEVE], endpoint, get_params, stream=True, **kwargs)
+    if not 200 <= r.status_code < 300:
+        _raise_for_status(r, False)
+    if r.status_code == 204:
+        r.close()
+        return streaming.ItemStream([b'{"items": []}'])
+    return streaming.ItemStream(
+        r.iter_content(chunk_size=settings.BASECRM_STREAM_CHUNK_SIZE), response=r
+    )
 
 
-def parse(response_json):
+def parse(response_json, record_class=None):
     """
     Simple helper method to get into the data dicts for each item returned and ignore all the meta;
     just gives back a list of dicts.
+
+    If given a record_class (see records.py), items are given back as compact records instead.
     """
-    if (
-        not isinstance(response_json, dict) or  # wrong type of arg
-        (  # ID type response
-            'items' not in response_json and
-            'data' not in response_json
-        ) or
-        (  # list endpoint type response
-            'items' in response_json and
-            (
-                len(response_json['items']) > 0 and
-                'data' not in response_json['items'][0]
+    with tracing.span('basecrm.parse'):
+        if (
+            not isinstance(response_json, dict) or  # wrong type of arg
+            (  # ID type response
+                'items' not in response_json and
+                'data' not in response_json
+            ) or
+            (  # list endpoint type response
+                'items' in response_json and
+                (
+                    len(response_json['items']) > 0 and
+                    'data' not in response_json['items'][0]
+                )
             )
-        )
-    ):
-        raise exceptions.BaseCRMBadParameterFormat()
+        ):
+            raise exceptions.BaseCRMBadParameterFormat()
 
-    if 'items' in response_json:
-        return [item['data'] for item in response_json['items']]
-    else:
-        return response_json['data']
+        if record_class is not None:
+            if 'items' in response_json:
+                return [record_class.from_dict(item['data']) for item in response_json['items']]
+            return record_class.from_dict(response_json['data'])
+
+        if 'items' in response_json:
+            return [item['data'] for item in response_json['items']]
+        else:
+            return response_json['data']
+
+
+def paginate(
+    endpoint, get_params=None, per_page=None, checkpoint=None, streamed=False, record_class=None,
+    workers=None, adaptive=None
+):
+    """
+    Generator over every page of a list endpoint, yielding the parsed list of dicts for each page
+    in turn. Any 'page' in get_params is used as the starting page; iteration stops at the first
+    page with fewer than per_page items.
+
+    If given a models.Checkpoint, iteration starts after the last page it recorded, and each page
+    is recorded once the consumer has finished with it (i.e. asks for the next one).
+
+    With streamed=True each page is a streaming.ItemStream instead of a list (see `stream`); any of
+    it left unread when the next page is asked for is read and discarded.
+
+    Given a record_class, pages are lists of compact records (see parse); this isn't used when
+    streaming.
+
+    With more than one worker, that many pages are fetched concurrently ahead of the consumer (still
+    yielded in order); this isn't used when streaming either. With adaptive=True (by default,
+    settings.BASECRM_ADAPTIVE_CONCURRENCY) the number in flight is adjusted between 1 and `workers`
+    as the API speeds up or slows down (see limits.AdaptiveLimiter).
+    """
+    params = dict(get_params or {})
+    params['per_page'] = per_page or params.get('per_page') or settings.BASECRM_PER_PAGE
+    page = params.pop('page', 1)
+    if checkpoint is not None and checkpoint.page:
+        page = checkpoint.page + 1
+    if workers is not None and workers > 1 and not streamed:
+        if adaptive is None:
+            adaptive = settings.BASECRM_ADAPTIVE_CONCURRENCY
+        for page, items in _fetch_pages(endpoint, params, page, workers, record_class, adaptive):
+            if items:
+                yield items
+                if checkpoint is not None:
+                    checkpoint.advance(page, items[-1].get('id'))
+        return
+    while True:
+        params['page'] = page
+        if streamed:
+            items = stream(endpoint, dict(params))
+            yield items
+            size, last_id = items.exhaust(), items.last_id
+        else:
+            items = parse(request(RETRIEVE, endpoint, dict(params)), record_class)
+            if items:
+                yield items
+            size, last_id = len(items), items[-1].get('id') if items else None
+        if checkpoint is not None and size:
+            checkpoint.advance(page, last_id)
+        if size < params['per_page']:
+            return
+        page += 1
+
+
+def _fetch_pages(endpoint, params, page, workers, record_class=None, adaptive=False):
+    """
+    Generator of (page number, items) from `page` onwards, keeping `workers` requests in flight (or
+    as many as an AdaptiveLimiter allows) and stopping after the first page with fewer than
+    per_page items
+    """
+    def fetch(number):
+        return parse(request(RETRIEVE, endpoint, dict(params, page=number)), record_class)
+
+    limiter = None
+    if adaptive:
+        limiter = limits.AdaptiveLimiter('paginate %s' % endpoint, maximum=workers)
+        fetch = functools.partial(limiter.run, fetch)
+    fetch = client.bind(deadline.bind(lanes.bind(tracing.bind(fetch))))
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    pending = collections.deque()
+    try:
+        while True:
+            while len(pending) < (workers if limiter is None else int(limiter.limit)):
+                pending.append((page, executor.submit(fetch, page)))
+                page += 1
+            number, future = pending.popleft()
+            items = future.result()
+            yield number, items
+            if len(items) < params['per_page']:
+                # anything still in flight is past the end
+                return
+    finally:
+        # on an error, the end, or the consumer stopping early (closing the generator), pages not
+        # yet started are never requested, and nothing is left running once this returns
+        for _, f in pending:
+            f.cancel()
+        executor.shutdown()
 
 
 def count(response_json):
@@ -124,116 +264,75 @@ def count(response_json):
     return response_json['meta']['count']
 
 
-def validate_contact_dict(operation, contact_dict, skip_id=False, suppress=False):
-    if suppress is True:
-        raise NotImplementedError("No validation suppression in place yet")
-    valid = False
-    msg = ""
-    if operation == CREATE:
-        if (
-            (  # individual contact requirements
-                (
-                    'is_organization' not in contact_dict or
-                    not contact_dict['is_organization']
-                ) and
-                (
-                    'first_name' in contact_dict and
-                    'last_name' in contact_dict
-                )
-            ) or
-            (  # organization contact requirements
-                (
-                    'is_organization' in contact_dict and
-                    contact_dict['is_organization'] is True
-                ) and
-                (
-                    'name' in contact_dict
-                )
-            )
-        ):
-            valid = True
-        else:
-            msg = (
-                "If 'is_organization'==True, 'first_name' and 'last_name' are all required, "
-                "or if 'is_organization'==False, 'name' is required; "
-                "fields supplied were: %s" % contact_dict.keys()
-            )
-    elif operation == UPDATE:
-        if 'id' in contact_dict or skip_id is True:
-            valid = True
-        else:
-            msg = (
-                "'id' is required; fields supplied were: %s" % contact_dict.keys()
-            )
+SCHEMAS = {
+    'contact': {
+        CREATE: validation.Schema('contact', [
+            validation.Rule(required=['first_name', 'last_name'], false=['is_organization']),
+            validation.Rule(required=['name'], true=['is_organization']),
+        ], (
+            "If 'is_organization'==True, 'name' is required, "
+            "otherwise 'first_name' and 'last_name' are all required"
+        )),
+        UPDATE: validation.Schema(
+            'contact', [validation.Rule(['id'])], "'id' is required", ['is_organization']
+        ),
+    },
+    'deal': {
+        CREATE: validation.Schema(
+            'deal',
+            [validation.Rule(['name', 'contact_id', 'custom_fields'])],
+            "'name', 'contact_id' and 'custom_fields' are all required",
+            ['hot'],
+        ),
+        UPDATE: validation.Schema('deal', [validation.Rule(['id'])], "'id' is required", ['hot']),
+    },
+    'lead': {
+        CREATE: validation.Schema(
+            'lead',
+            [validation.Rule(['last_name', 'organization_name'])],
+            "'last_name' and 'organization_name' are all required",
+        ),
+        UPDATE: validation.Schema('lead', [validation.Rule(['id'])], "'id' is required"),
+    },
+}
 
-    if not valid:
-        msg = "Parameters fail BaseCRM API requirements for contact. %s" % msg
-        raise exceptions.BaseCRMValidationError(msg)
 
-    return True
+def validate_contact_dict(operation, contact_dict, skip_id=False, suppress=False):
+    return _validate('contact', operation, contact_dict, skip_id, suppress)
 
 
 def validate_deal_dict(operation, deal_dict, skip_id=False, suppress=False):
-    if suppress is True:
-        raise NotImplementedError("No validation suppression in place yet")
-    valid = False
-    msg = ""
-    if operation == CREATE:
-        if (
-            'name' in deal_dict and
-            'contact_id' in deal_dict and
-            'custom_fields' in deal_dict
-        ):
-            valid = True
-        else:
-            msg = (
-                "'name', 'contact_id' and 'custom_fields' are all required; "
-                "fields supplied were: %s" % deal_dict.keys()
-            )
-    elif operation == UPDATE:
-        if 'id' in deal_dict or skip_id is True:
-            valid = True
-        else:
-            msg = (
-                "'id' is required; fields supplied were: %s" % deal_dict.keys()
-            )
+    return _validate('deal', operation, deal_dict, skip_id, suppress)
 
-    if not valid:
-        msg = "Parameters fail BaseCRM API requirements for deal. %s" % msg
-        raise exceptions.BaseCRMValidationError(msg)
 
-    return True
+def validate_lead_dict(operation, lead_dict, skip_id=False, suppress=False):
+    return _validate('lead', operation, lead_dict, skip_id, suppress)
 
 
-def validate_lead_dict(operation, lead_dict, skip_id=False, suppress=False):
-    if suppress is True:
-        raise NotImplementedError("No validation suppression in place yet")
-    valid = False
-    msg = ""
-    if operation == CREATE:
-        if (
-            'last_name' in lead_dict and
-            'organization_name' in lead_dict
-        ):
-            valid = True
-        else:
-            msg = (
-                "'last_name' and 'organization_name' are all required; "
-                "fields supplied were: %s" % lead_dict.keys()
-            )
-    elif operation == UPDATE:
-        if 'id' in lead_dict or skip_id is True:
-            valid = True
-        else:
-            msg = (
-                "'id' is required; fields supplied were: %s" % lead_dict.keys()
-            )
+def validate_many(resource, operation, dicts, skip_id=False):
+    """
+    Validates a batch of dicts in one pass without raising; returns an (index, message) pair for
+    each one that fails, so an empty list means they all passed
+    """
+    with tracing.span('basecrm.validate_many', resource=resource, operation=operation):
+        return get_schema(resource, operation, skip_id).validate_many(dicts)
 
-    if not valid:
-        msg = "Parameters fail BaseCRM API requirements for deal. %s" % msg
-        raise exceptions.BaseCRMValidationError(msg)
 
-    return True
+def get_schema(resource, operation, skip_id=False):
+    """
+    The compiled validation.Schema for a resource ('contact', 'deal' or 'lead') and operation
+    """
+    if resource not in SCHEMAS:
+        raise exceptions.BaseCRMBadParameterFormat(
+            "Expecting one of %s but got %s" % (', '.join(sorted(SCHEMAS)), resource)
+        )
+    if operation not in SCHEMAS[resource]:
+        raise exceptions.BaseCRMValidationError(
+            "Parameters fail BaseCRM API requirements for %s. Only CREATE and UPDATE are "
+            "validated, not %s" % (resource, VERBS.get(operation, operation))
+        )
+    schema = SCHEMAS[resource][operation]
+    return schema.without('id') if skip_id else schema
 
 
 def instantiate_if_necessary():
@@ -249,26 +348,76 @@ def instantiate_if_necessary():
 
 def _request(method, endpoint, get_params=None, **kwargs):
     """
-    Wraps requests.request with custom headers and api URL generation methods. Accepts just the last
-    segment of the endpoint, rather than the whole URI; the rest comes from settings.
+    Sends a request through the transport (see transport.py; by default, the current client's
+    session) with the current client's headers and URL. Accepts just the last segment of the
+    endpoint, rather than the whole URI; the rest comes from the client (see client.py).
 
     The get_params param will be used to build GET get_params to append to the API call (e.g. for
     pagination and filtering). An ID can also be added in to the get_params param and will be used
-    by _build_api_endpoint.
-
-    Any extra kwargs will be passed along to `requests.request()`
+    by BaseCRMClient.build_url.
+
+    Any extra kwargs will be passed along to `requests.request()`, except that a `json` body is
+    encoded with our own codec (see codec.py) rather than the requests library's, and `retries` (how
+    many times this request has already been tried) is only passed on to the signals.py receivers.
+    `label` names the endpoint for the signals, circuit breaker and tracing; it defaults to the
+    endpoint, and should be given where that includes an ID (e.g. a sync session's).
+    The timeout defaults to the client's, and is cut to the time left by any deadline (see
+    deadline.py); timing out raises BaseCRMTimeout. While the endpoint's circuit breaker is open
+    (see breaker.py) nothing is sent and BaseCRMCircuitOpen is raised. Requests wait for their
+    lane's share of the client's rate limit and connections (see lanes.py).
     """
-    url = _build_api_endpoint(endpoint, get_params)
-    extra_headers = kwargs.pop('headers', None)
-    kwargs['headers'] = _build_headers(extra_headers)
+    current = client.get_client()
+    url = current.build_url(endpoint, get_params)
+    kwargs['headers'] = current.build_headers(kwargs.pop('headers', None))
     kwargs['params'] = get_params
-
-    response = requests.request(method, url, **kwargs)
+    kwargs['timeout'] = deadline.cap(kwargs.get('timeout', current.timeout))
+    label = kwargs.pop('label', endpoint)
+    breaker = current.breakers.get(label) if current.breakers is not None else None
+    if 'json' in kwargs:
+        kwargs['data'] = codec.dumps(kwargs.pop('json'))
+    retries = kwargs.pop('retries', 0)
+
+    signals.request_started.send(
+        sender=label, method=method, endpoint=label, retries=retries
+    )
+    start = time.monotonic()
+    with tracing.span('basecrm.http', method=method, endpoint=label) as span:
+        try:
+            # before waiting for the rate limit or a connection, so an open circuit fails fast
+            probe = breaker.before() if breaker is not None else False
+            sent = False
+            try:
+                with current.lanes.admit(lanes.current()):
+                    # waiting for the rate limit or a connection may have used up some of the
+                    # deadline
+                    kwargs['timeout'] = deadline.cap(kwargs['timeout'])
+                    sent = True
+                    response = transport.get_transport(current.transport).send(
+                        method, url, **kwargs
+                    )
+            except Exception:
+                if breaker is not None:
+                    if sent:
+                        breaker.record(True, probe)
+                    else:
+                        breaker.release(probe)
+                raise
+        except Exception as e:
+            _request_finished(method, label, retries, start, kwargs, exception=e)
+            if isinstance(e, requests.exceptions.Timeout):
+                raise exceptions.BaseCRMTimeout(
+                    "BaseCRM API '%s' endpoint did not respond in time: %s" % (label, e)
+                ) from e
+            raise
+        if breaker is not None:
+            breaker.record(response.status_code >= 500, probe)
+        span.set('status', response.status_code)
+    _request_finished(method, label, retries, start, kwargs, response=response)
 
     logger.debug(
         "'%s' request to BaseCRM API '%s' endpoint gave a '%s' response (url: %s)" % (
             method,
-            endpoint,
+            label,
             response.status_code,
             response.url,
         )
@@ -276,43 +425,90 @@ def _request(method, endpoint, get_params=None, **kwargs):
     return response
 
 
+def _request_finished(method, endpoint, retries, start, kwargs, response=None, exception=None):
+    duration = time.monotonic() - start
+    if not signals.request_finished.receivers:
+        return
+    response_bytes = None
+    if response is not None:
+        if kwargs.get('stream'):
+            # reading the body would consume it
+            length = response.headers.get('Content-Length')
+            response_bytes = int(length) if length is not None else None
+        else:
+            response_bytes = len(response.content or b'')
+    signals.request_finished.send(
+        sender=endpoint,
+        method=method,
+        endpoint=endpoint,
+        retries=retries,
+        status=None if response is None else response.status_code,
+        duration=duration,
+        request_bytes=len(kwargs.get('data') or b''),
+        response_bytes=response_bytes,
+        exception=exception,
+    )
+
+
+def _raise_for_status(r, is_id_request):
+    """
+    Raises the exception for an error response, which is picked by status code alone: the body
+    may be empty or not JSON at all (e.g. a load balancer's 503 page)
+    """
+    details = _error_details(r)
+    logger.error(
+        "BaseCRM API responded with status code: '%s'. %s" % (r.status_code, details)
+    )
+    if r.status_code == 401:
+        raise exceptions.BaseCRMAPIUnauthorized()
+    elif r.status_code == 404 and is_id_request:
+        # no record with the given ID exists
+        raise exceptions.BaseCRMNoResult()
+    elif r.status_code == 422:
+        raise exceptions.BaseCRMValidationError(details)
+    elif r.status_code == 429 or r.status_code >= 500:
+        raise exceptions.BaseCRMOverloaded(
+            "BaseCRM API responded with status code '%s'. %s" % (r.status_code, details),
+            status_code=r.status_code,
+        )
+    else:
+        raise Exception(
+            "BaseCRM API responded with status code '%s'. %s" % (r.status_code, details)
+        )
+
+
+def _error_details(r):
+    """
+    The details of the first error in a BaseCRM error response, or else the start of its body
+    """
+    try:
+        return codec.loads(r.content)['errors'][0]['error']['details']
+    except (ValueError, LookupError, TypeError):
+        return repr(r.content[:200])
+
+
 def _build_headers(extra_headers=None):
     """
     Puts together the standard headers BaseCRM API requires. Accepts a dict that can add to or
     override these.
     """
-    headers = {
-        'Accept': 'application/json',
-        'Content-Type': 'application/json',
-        'Authorization': 'Bearer %s' % settings.BASECRM_API_KEY,
-        'User-Agent': settings.BASECRM_USER_AGENT
-    }
-    if extra_headers is not None:
-        if not isinstance(extra_headers, dict):
-            raise exceptions.BaseCRMBadParameterFormat(
-                u'Parameter format was not a dict as expected. The parameter given was: %s' %
-                repr(extra_headers)
-            )
-        for k, v in extra_headers.items():
-            headers[k] = v
-
-    return headers
+    return client.get_client().build_headers(extra_headers)
 
 
 def _build_api_endpoint(endpoint, get_params=None):
     """
-    We expect settings.BASECRM_API_URL to be e.g. https://api.getbase.com/v2/ -- note the protocol,
-    the path and the trailing slash are all included and expected (i.e. not handled)
+    We expect the client's api_url (settings.BASECRM_API_URL by default) to be e.g.
+    https://api.getbase.com/v2/ -- note the protocol, the path and the trailing slash are all
+    included and expected (i.e. not handled)
     """
-    url = '%s%s' % (settings.BASECRM_API_URL, endpoint)
-    if get_params is not None:
-        if not isinstance(get_params, dict):
-            raise exceptions.BaseCRMBadParameterFormat(
-                u'Parameter format was not a dict as expected. The parameter given was: %s' %
-                repr(get_params)
-            )
+    return client.get_client().build_url(endpoint, get_params)
+
 
-        id = get_params.pop('id', None)
-        if id is not None:
-            url = "%s/%s" % (url, id)
-    return url
+def _validate(resource, operation, d, skip_id=False, suppress=False):
+    if suppress is True:
+        raise NotImplementedError("No validation suppression in place yet")
+    with tracing.span('basecrm.validate', resource=resource, operation=operation):
+        error = get_schema(resource, operation, skip_id).check(d)
+    if error is not None:
+        raise exceptions.BaseCRMValidationError(error)
+    return True
@@ -0,0 +1,91 @@
+"""
+Declarative validation of the dicts we send to the API. A Schema is a list of Rules, any one of
+which a dict must satisfy, and is compiled once into a single predicate; the message is only built
+for dicts that fail it. Schema.validate_many() checks a whole batch in one pass, giving back every
+failure rather than raising on the first.
+"""
+
+
+class Rule(object):
+    """
+    One way for a dict to be valid: every `required` field is present, every `true` field is True,
+    and every `false` field is missing or falsy
+    """
+
+    def __init__(self, required=(), true=(), false=()):
+        self.required = frozenset(required) | frozenset(true)
+        self.true = tuple(true)
+        self.false = tuple(false)
+
+    def without(self, field_name):
+        return Rule(self.required - {field_name}, self.true, self.false)
+
+    def compile(self):
+        required, true, false = self.required, self.true, self.false
+        if not true and not false:
+            return lambda d: d.keys() >= required
+
+        def check(d):
+            return (
+                d.keys() >= required and
+                all(d[f] is True for f in true) and
+                not any(d.get(f) for f in false)
+            )
+        return check
+
+
+class Schema(object):
+    """
+    `booleans` names the resource's boolean fields (those the rules require to be true or false are
+    included anyway), e.g. for decoding them from text
+    """
+
+    def __init__(self, resource, rules, description, booleans=()):
+        self.resource = resource
+        self.rules = list(rules)
+        self.description = description
+        self.booleans = frozenset(booleans).union(*(r.true + r.false for r in self.rules))
+        self.is_valid = self._compile()
+        self._without = {}
+
+    def check(self, d):
+        """
+        Returns None if d is valid, otherwise a message saying why not
+        """
+        if self.is_valid(d):
+            return None
+        return self.message(d)
+
+    def validate_many(self, dicts):
+        """
+        Returns an (index, message) pair for each of the dicts that isn't valid
+        """
+        is_valid = self.is_valid
+        return [(i, self.message(d)) for i, d in enumerate(dicts) if not is_valid(d)]
+
+    def message(self, d):
+        return "Parameters fail BaseCRM API requirements for %s. %s; fields supplied were: %s" % (
+            self.resource, self.description, ', '.join(sorted(str(k) for k in d))
+        )
+
+    def without(self, field_name):
+        """
+        This schema with field_name no longer required, e.g. the ID of an update given separately
+        """
+        if field_name not in self._without:
+            self._without[field_name] = Schema(
+                self.resource,
+                [r.without(field_name) for r in self.rules],
+                self.description,
+                self.booleans,
+            )
+        return self._without[field_name]
+
+    def _compile(self):
+        checks = [r.compile() for r in self.rules]
+        if len(checks) == 1:
+            return checks[0]
+        if len(checks) == 2:
+            first, second = checks
+            return lambda d: first(d) or second(d)
+        return lambda d: any(check(d) for check in checks)
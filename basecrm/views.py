@@ -0,0 +1,43 @@
+import json
+import logging
+
+from django.http import (
+    Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseServerError
+)
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from . import client, settings, webhooks
+
+logger = logging.getLogger(__name__)
+
+
+@csrf_exempt
+@require_POST
+def webhook(request, account=client.DEFAULT_ACCOUNT):
+    """
+    Accepts a signed payload of change events for an account, either a single event or
+    {'items': [...]}, and applies them before acknowledging; if they can't be applied it responds
+    with a 500, so Base sends them again
+    """
+    if account != client.DEFAULT_ACCOUNT and account not in settings.BASECRM_ACCOUNTS:
+        raise Http404("No BaseCRM account '%s'" % account)
+    signature = request.META.get('HTTP_%s' % webhooks.SIGNATURE_HEADER.upper().replace('-', '_'))
+    if not webhooks.verify(request.body, signature, webhooks.get_secret(account)):
+        return HttpResponseForbidden()
+
+    try:
+        payload = json.loads(request.body.decode('utf-8'))
+        events = payload['items'] if 'items' in payload else [payload]
+        valid = all('id' in event['data'] and 'type' in event['meta'] for event in events)
+    except (ValueError, KeyError, TypeError):
+        valid = False
+    if not valid:
+        return HttpResponseBadRequest()
+
+    try:
+        webhooks.apply_events(events, account)
+    except Exception:
+        logger.exception("Failed to apply %s BaseCRM webhook events" % len(events))
+        return HttpResponseServerError()
+    return HttpResponse()
@@ -0,0 +1,115 @@
+"""
+Handles change notifications pushed to us by BaseCRM. Events take the same shape as Sync API queue
+items ({'data': {...}, 'meta': {'type': 'contact', 'sync': {'event_type': 'updated', ...}}}). Each
+payload is applied before it's acknowledged, so if applying it fails (or the process dies) Base
+sends it again.
+
+Each account in BASECRM_ACCOUNTS posts to a URL of its own (see urls.py) and may have its own
+WEBHOOK_SECRET; its events invalidate its client's cached responses and refresh its reference
+data. The mirror tables (if basecrm.mirror is installed) hold one account's records
+(BASECRM_MIRROR_ACCOUNT), so only that account's events are written to them.
+"""
+import collections
+import hashlib
+import hmac
+import logging
+
+from django.apps import apps as django_apps
+from django.db import transaction
+
+from . import client, mirror, settings
+
+logger = logging.getLogger(__name__)
+
+SIGNATURE_HEADER = 'X-Basecrm-Signature'
+
+# reference data held on the app config, by resource type
+REFERENCE_DATA = {
+    'pipeline': 'instantiate_pipeline',
+    'stage': 'instantiate_stages',
+    'user': 'instantiate_users',
+}
+
+
+def get_secret(account=client.DEFAULT_ACCOUNT):
+    """
+    The account's WEBHOOK_SECRET in BASECRM_ACCOUNTS, if it has one, or else BASECRM_WEBHOOK_SECRET
+    """
+    config = settings.BASECRM_ACCOUNTS.get(account) or {}
+    return config.get('WEBHOOK_SECRET') or settings.BASECRM_WEBHOOK_SECRET
+
+
+def sign(body, secret=None):
+    secret = secret or settings.BASECRM_WEBHOOK_SECRET
+    return hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+
+
+def verify(body, signature, secret=None):
+    """
+    Checks the signature sent with the payload is the HMAC-SHA256 (hex) of the raw body, keyed with
+    the secret (BASECRM_WEBHOOK_SECRET by default). Everything fails verification if there's no
+    secret set
+    """
+    secret = secret or settings.BASECRM_WEBHOOK_SECRET
+    if secret is None:
+        logger.error("Rejecting BaseCRM webhook: BASECRM_WEBHOOK_SECRET is not set")
+        return False
+    if not signature:
+        return False
+    # compare_digest only takes str if it's ASCII, and the header could be anything
+    return hmac.compare_digest(sign(body, secret).encode('ascii'), signature.encode('utf-8'))
+
+
+def apply_events(events, account=client.DEFAULT_ACCOUNT):
+    """
+    Applies a batch of events from an account: mirrored rows are upserted or deleted in bulk per
+    model (in one transaction), then each affected endpoint has its cached responses invalidated
+    once and reference data on the app config is refreshed once per resource type. Applying the
+    same events again, or older ones later, does no harm: a record is never replaced by a copy with
+    an earlier updated_at.
+    """
+    if account == client.DEFAULT_ACCOUNT:
+        # whichever client is current, so one installed with client.use counts as the default
+        _apply(events, account)
+    else:
+        with client.account(account):
+            _apply(events, account)
+
+
+def _apply(events, account):
+    upserts = collections.defaultdict(dict)
+    deletes = collections.defaultdict(set)
+    for event in events:
+        resource_type = event['meta'].get('type')
+        data = event['data']
+        if _event_type(event['meta']) == 'deleted':
+            upserts[resource_type].pop(data['id'], None)
+            deletes[resource_type].add(data['id'])
+        else:
+            deletes[resource_type].discard(data['id'])
+            upserts[resource_type][data['id']] = mirror.newest(
+                upserts[resource_type].get(data['id']), data
+            )
+    resource_types = set(upserts) | set(deletes)
+
+    if account == settings.BASECRM_MIRROR_ACCOUNT and mirror.is_installed():
+        with transaction.atomic():
+            for resource_type in resource_types:
+                model = mirror.get_model(resource_type)
+                if model is not None:
+                    mirror.upsert(model, upserts[resource_type].values())
+                    mirror.delete(model, deletes[resource_type])
+
+    response_cache = client.get_client().cache
+    app_conf = django_apps.get_app_config('basecrm')
+    for resource_type in resource_types:
+        ids = set(upserts[resource_type]) | deletes[resource_type]
+        response_cache.invalidate('%ss' % resource_type, ids)
+        if resource_type in REFERENCE_DATA:
+            getattr(app_conf, REFERENCE_DATA[resource_type])(force=True)
+
+
+def _event_type(meta):
+    if 'event_type' in meta:
+        return meta['event_type']
+    return meta.get('sync', {}).get('event_type')
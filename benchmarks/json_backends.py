@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+Compares the JSON backends available to basecrm.codec on a page of fat deal records, both
+encoding (request bodies) and decoding (responses). Run from the repo root:
+
+    python benchmarks/json_backends.py [--records 100] [--repeat 200]
+"""
+import argparse
+import datetime
+import os
+import sys
+import timeit
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings')
+
+import django  # noqa: E402
+django.setup()
+
+from basecrm import codec  # noqa: E402
+
+BACKENDS = ['json', 'orjson', 'ujson']
+
+
+def deal(i):
+    return {
+        'id': i,
+        'owner_id': 1000 + i % 7,
+        'name': 'Deal %s' % i,
+        'value': Decimal('%s.50' % (i * 100)),
+        'currency': 'GBP',
+        'hot': i % 2 == 0,
+        'stage_id': 10 + i % 5,
+        'contact_id': 5000 + i,
+        'estimated_close_date': datetime.date(2017, 6, 1) + datetime.timedelta(days=i),
+        'last_stage_change_at': datetime.datetime(2017, 6, 1, 10, 30),
+        'tags': ['tag-%s' % t for t in range(5)],
+        'custom_fields': {'field_%s' % f: 'value %s' % f for f in range(30)},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--records', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    body = {'data': [deal(i) for i in range(args.records)]}
+    response = codec.get_backend('json').dumps(
+        {'items': [{'data': d, 'meta': {'type': 'deal'}} for d in body['data']], 'meta': {}}
+    )
+
+    print('%d records, %d bytes per response, best of 3 x %d' % (
+        args.records, len(response), args.repeat
+    ))
+    print('%-8s %12s %12s' % ('backend', 'encode (ms)', 'decode (ms)'))
+    for name in BACKENDS:
+        backend = codec.get_backend(name)
+        if backend.name != name:
+            print('%-8s %12s %12s' % (name, 'n/a', 'n/a'))
+            continue
+        encode = min(timeit.repeat(lambda: backend.dumps(body), number=args.repeat, repeat=3))
+        decode = min(timeit.repeat(lambda: backend.loads(response), number=args.repeat, repeat=3))
+        print('%-8s %12.3f %12.3f' % (
+            name, encode * 1000 / args.repeat, decode * 1000 / args.repeat
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""
+Measures the memory held by a bulk read of deals parsed as plain dicts (utils.parse) versus
+compact records (utils.parse with records.DealRecord). Run from the repo root:
+
+    python benchmarks/record_memory.py [--records 100000]
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings')
+
+import django  # noqa: E402
+django.setup()
+
+from basecrm import records, utils  # noqa: E402
+
+PAGE_SIZE = 100
+
+
+def page(start):
+    # a JSON round trip so that, as with a real response, no strings are shared between records
+    return json.loads(json.dumps({
+        'items': [{'data': {
+            'id': i,
+            'creator_id': 1,
+            'owner_id': 1000 + i % 7,
+            'name': 'Deal %s' % i,
+            'value': '%s.50' % (i * 100),
+            'currency': 'GBP',
+            'hot': i % 2 == 0,
+            'stage_id': 10 + i % 5,
+            'last_stage_change_at': '2017-06-01T10:30:00Z',
+            'last_activity_at': None,
+            'source_id': None,
+            'loss_reason_id': None,
+            'dropbox_email': 'deal%s@dropbox.example.com' % i,
+            'contact_id': 5000 + i,
+            'organization_id': None,
+            'estimated_close_date': '2017-07-01',
+            'customized_win_likelihood': None,
+            'tags': [],
+            'custom_fields': {},
+            'created_at': '2017-06-01T10:00:00Z',
+            'updated_at': '2017-06-02T10:00:00Z',
+        }, 'meta': {'type': 'deal'}} for i in range(start, start + PAGE_SIZE)],
+        'meta': {'count': PAGE_SIZE},
+    }))
+
+
+def measure(count, record_class):
+    gc.collect()
+    tracemalloc.start()
+    held = []
+    for start in range(0, count, PAGE_SIZE):
+        response = page(start)
+        held.extend(utils.parse(response, record_class))
+        del response
+    gc.collect()
+    current = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return current, held
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--records', type=int, default=100000)
+    args = parser.parse_args()
+
+    dict_bytes, dicts = measure(args.records, None)
+    del dicts
+    record_bytes, compact = measure(args.records, records.DealRecord)
+    del compact
+
+    print('%d deals held after parsing' % args.records)
+    print('%-8s %12s %12s' % ('', 'total (MB)', 'per record'))
+    for name, size in [('dicts', dict_bytes), ('records', record_bytes)]:
+        print('%-8s %12.1f %12d' % (name, size / 1024.0 / 1024.0, size // args.records))
+    print('records use %.0f%% of the memory of dicts' % (100.0 * record_bytes / dict_bytes))
+
+    data = page(0)['items'][0]['data']
+    print('container alone: dict %d bytes, record %d bytes (values are shared by both)' % (
+        sys.getsizeof(data), sys.getsizeof(records.DealRecord.from_dict(data))
+    ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+"""
+The benchmark suite: microbenchmarks of the hot paths (parsing, headers and URLs, serializers,
+validation) and macrobenchmarks of paginated reads and batch writes against basecrm.testing's fake
+API server. Results are written as JSON and can be compared with a stored baseline; run from the
+repo root:
+
+    python benchmarks/suite.py [--output results.json] [--baseline benchmarks/baseline.json]
+                               [--threshold 0.25] [--filter micro.] [--quick]
+
+Times are seconds per operation (the best of several repeats); with --baseline, any benchmark more
+than --threshold slower than its baseline is reported as a regression and the exit status is 1.
+Baselines are only meaningful on the machine they were recorded on, so record your own with
+--output before changing anything.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings')
+
+import django  # noqa: E402
+django.setup()
+
+from basecrm import batch, serializers, testing, utils  # noqa: E402
+from basecrm.mirror import models  # noqa: E402
+
+BENCHMARKS = []
+
+
+def benchmark(name):
+    """
+    Registers a function returning (callable, operations per call) to be timed
+    """
+    def register(setup):
+        BENCHMARKS.append((name, setup))
+        return setup
+    return register
+
+
+def contact(i):
+    return {
+        'id': i,
+        'owner_id': 1000 + i % 7,
+        'is_organization': False,
+        'first_name': 'First%s' % i,
+        'last_name': 'Last%s' % i,
+        'email': 'contact%s@example.com' % i,
+        'tags': ['tag%s' % (i % 5)],
+        'custom_fields': {'field_%s' % f: 'value %s' % f for f in range(10)},
+        'created_at': '2017-06-01T10:30:00Z',
+        'updated_at': '2017-06-01T10:30:00Z',
+    }
+
+
+@benchmark('micro.parse')
+def parse():
+    response = {'items': [{'data': contact(i), 'meta': {'type': 'contact'}} for i in range(100)],
+                'meta': {'count': 100}}
+    return lambda: utils.parse(response), 1
+
+
+@benchmark('micro.count')
+def count():
+    response = {'items': [], 'meta': {'count': 100}}
+    return lambda: utils.count(response), 1
+
+
+@benchmark('micro.build_headers')
+def build_headers():
+    return lambda: utils._build_headers({'X-Basecrm-Device-UUID': 'device'}), 1
+
+
+@benchmark('micro.build_api_endpoint')
+def build_api_endpoint():
+    return lambda: utils._build_api_endpoint('contacts', {'id': 1, 'page': 2}), 1
+
+
+@benchmark('micro.serializer_to_dict')
+def serializer_to_dict():
+    class Serializer(serializers.ContactModelSerializer):
+        class Meta:
+            model = models.Contact
+            fields = ['first_name', 'last_name', 'name', 'email', 'is_organization', 'title']
+
+        def get_title(self, instance):
+            return 'Physicist'
+
+    instance = models.Contact(
+        id=1, first_name='Robert', last_name='Oppenheimer', email='r@example.com'
+    )
+    return lambda: Serializer(instance).to_dict(), 1
+
+
+@benchmark('micro.validate_dict')
+def validate_dict():
+    contacts = [contact(i) for i in range(100)]
+    deal = {'name': 'Deal', 'contact_id': 1, 'custom_fields': {}}
+    lead = {'last_name': 'Last', 'organization_name': 'Org'}
+
+    def run():
+        for c in contacts:
+            utils.validate_contact_dict(utils.CREATE, c)
+        for _ in range(100):
+            utils.validate_deal_dict(utils.CREATE, deal)
+            utils.validate_lead_dict(utils.UPDATE, lead, skip_id=True)
+    return run, 300
+
+
+@benchmark('micro.validate_many')
+def validate_many():
+    contacts = [contact(i) for i in range(1000)]
+    return lambda: utils.validate_many('contact', utils.CREATE, contacts), 1000
+
+
+@benchmark('macro.paginate')
+def paginate(fake):
+    def run():
+        for page in utils.paginate('contacts', per_page=100):
+            pass
+    return run, len(fake.data['contacts'])
+
+
+@benchmark('macro.paginate_parallel')
+def paginate_parallel(fake):
+    def run():
+        for page in utils.paginate('contacts', per_page=100, workers=4):
+            pass
+    return run, len(fake.data['contacts'])
+
+
+@benchmark('macro.batch_create')
+def batch_create(fake):
+    contacts = [
+        {'first_name': 'First%s' % i, 'last_name': 'Last%s' % i, 'email': 'c%s@example.com' % i}
+        for i in range(200)
+    ]
+
+    def run():
+        for result in batch.create('contact', contacts, max_workers=4):
+            if result.error is not None:
+                raise result.error
+    return run, len(contacts)
+
+
+def measure(run, ops, repeat, min_time):
+    """
+    Best seconds per operation over `repeat` rounds, each looping until it takes min_time
+    """
+    timer = timeit.Timer(run)
+    number, _ = timer.autorange() if min_time else (1, None)
+    while min_time and number > 1 and timer.timeit(number) < min_time:
+        number *= 2
+    times = [t / number / ops for t in timer.repeat(repeat=repeat, number=number)]
+    return {'seconds_per_op': min(times), 'repeats': times, 'ops_per_call': ops, 'calls': number}
+
+
+def run_all(name_filter=None, quick=False, latency=0.0):
+    results = {}
+    selected = [(n, s) for n, s in BENCHMARKS if not name_filter or n.startswith(name_filter)]
+    fake = None
+    if any(n.startswith('macro.') for n, s in selected):
+        fake = testing.FakeBase(latency=latency).start()
+        fake.seed(contacts=500 if quick else 2000)
+    try:
+        for name, setup in selected:
+            if name.startswith('macro.'):
+                with fake.configured():
+                    run, ops = setup(fake)
+                    results[name] = measure(run, ops, repeat=1 if quick else 3, min_time=0)
+            else:
+                run, ops = setup()
+                results[name] = measure(
+                    run, ops, repeat=3 if quick else 5, min_time=0.05 if quick else 0.2
+                )
+            print('%-32s %12.3f us/op' % (name, results[name]['seconds_per_op'] * 1e6))
+    finally:
+        if fake is not None:
+            fake.stop()
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Prints each benchmark against its baseline; returns the names of those that regressed
+    """
+    regressions = []
+    print('\n%-32s %12s %12s %8s' % ('benchmark', 'baseline', 'current', 'change'))
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        before = baseline[name]['seconds_per_op']
+        after = results[name]['seconds_per_op']
+        change = after / before - 1 if before else 0.0
+        flag = ''
+        if change > threshold:
+            flag = ' REGRESSION'
+            regressions.append(name)
+        elif change < -threshold:
+            flag = ' faster'
+        print('%-32s %10.3fus %10.3fus %+7.1f%%%s' % (
+            name, before * 1e6, after * 1e6, change * 100, flag
+        ))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--output', help="Write results to this JSON file")
+    parser.add_argument('--baseline', help="Compare with results saved by an earlier --output")
+    parser.add_argument('--threshold', type=float, default=0.25)
+    parser.add_argument('--filter', help="Only run benchmarks whose names start with this")
+    parser.add_argument('--quick', action='store_true', help="Fewer, shorter repeats")
+    parser.add_argument(
+        '--latency', type=float, default=0.0, help="Seconds of latency for the fake API"
+    )
+    args = parser.parse_args()
+
+    results = run_all(args.filter, args.quick, args.latency)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'meta': {
+                    'timestamp': datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+                    'python': platform.python_version(),
+                    'django': django.get_version(),
+                    'platform': platform.platform(),
+                    'quick': args.quick,
+                },
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    started = time.time()
+    main()
+    print('\n%.1fs' % (time.time() - started))
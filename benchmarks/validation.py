@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""
+Times pre-screening a batch of contact dicts (a quarter of them invalid) for creation, one at a
+time with utils.validate_contact_dict and in one pass with utils.validate_many. Run from the repo
+root:
+
+    python benchmarks/validation.py [--rows 100000]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings')
+
+import django  # noqa: E402
+django.setup()
+
+from basecrm import exceptions, utils  # noqa: E402
+
+
+def contact(i):
+    if i % 4 == 0:
+        return {'first_name': 'First %s' % i, 'email': 'c%s@example.com' % i}
+    if i % 4 == 1:
+        return {'is_organization': True, 'name': 'Org %s' % i}
+    return {'first_name': 'First %s' % i, 'last_name': 'Last %s' % i, 'owner_id': i % 7}
+
+
+def one_at_a_time(rows):
+    failures = []
+    for i, row in enumerate(rows):
+        try:
+            utils.validate_contact_dict(utils.CREATE, row)
+        except exceptions.BaseCRMValidationError as e:
+            failures.append((i, str(e)))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    args = parser.parse_args()
+    rows = [contact(i) for i in range(args.rows)]
+
+    for name, validate in [
+        ('validate_contact_dict', one_at_a_time),
+        ('validate_many', lambda rows: utils.validate_many('contact', utils.CREATE, rows)),
+    ]:
+        start = time.perf_counter()
+        failures = validate(rows)
+        print('%-22s %8.1f ms  %d failures' % (
+            name, (time.perf_counter() - start) * 1000, len(failures)
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -12,5 +12,6 @@ SECRET_KEY = 'basecrm'
 
 INSTALLED_APPS = (
     'basecrm',
+    'basecrm.mirror',
 )
 # TEST_RUNNER = 'django_nose.NoseTestSuiteRunner'
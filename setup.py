@@ -12,9 +12,12 @@ setup(
     version="0.6",
     packages=find_packages(),
     install_requires=[
-        'Django>=1.11',
+        'Django>=2.2',
         'requests>=2.6',
     ],
+    extras_require={
+        'analytics': ['numpy'],
+    },
     include_package_data=True,
     description='A Django app that connects to the BaseCRM API (v2)',
     long_description=README,
@@ -26,8 +29,10 @@ setup(
     classifiers=[
         'Environment :: Web Environment',
         'Framework :: Django',
-        'Framework :: Django :: 1.11',
-        'Framework :: Django :: 2.0',
+        'Framework :: Django :: 2.2',
+        'Framework :: Django :: 3.0',
+        'Framework :: Django :: 3.1',
+        'Framework :: Django :: 3.2',
         'Intended Audience :: Developers',
         'License :: OSI Approved :: MIT License',
         'Operating System :: OS Independent',